@@ -0,0 +1,143 @@
+"""Concurrent page queries for Warbler, on an asyncio SQLAlchemy engine.
+
+Most pages make a couple of SELECTs that don't depend on each other (the
+homepage's timeline and likes, a profile's messages and follow state).
+`scalars_all()` takes those statements and, with ASYNC_QUERIES on, runs
+them at the same time, each on its own connection, so the page waits for
+the slowest query rather than the sum of them:
+
+    messages, liked = aio.scalars_all(timeline.page_select(user_id),
+                                      liked_on_page)
+
+With it off (the default) they run one after another on db.session.
+It's also off under gunicorn's gevent worker (see gunicorn.conf.py),
+where waiting on a query already lets other requests run.
+
+Flask views stay sync, so this doesn't free a worker thread while
+queries run; it cuts each request's database wait. The async side runs
+on a single event loop thread per process, with one async engine per
+database (asyncpg connections belong to the loop that made them), so
+however many threads the server starts, it holds at most POOL_SIZE
+connections per database for this.
+
+Statements go to the request's replica, if it has one (see replicas.py).
+Results are detached from any session: eager-load whatever templates use.
+
+Needs the asyncpg driver for Postgres, or aiosqlite for SQLite.
+"""
+
+import asyncio
+import os
+import threading
+
+from flask import current_app
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from models import db
+import pools
+import replicas
+
+# Async connections kept per process (and database), shared by all threads
+POOL_SIZE = 10
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+# The event loop thread, and an async engine per database URL
+_loop = None
+_engines = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    return (current_app.config.get('ASYNC_QUERIES', False)
+            and not pools.greenlets())
+
+
+def async_url(url):
+    """The asyncio driver's version of a sync database URL."""
+
+    backend = url.get_backend_name()
+
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver for {backend!r} databases")
+
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def event_loop():
+    """The event loop every thread's queries run on, started on first use."""
+
+    global _loop
+
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='aio',
+                             daemon=True).start()
+
+    return _loop
+
+
+def engine():
+    """The async engine for the database reads go to now."""
+
+    url = async_url(replicas.read_engine().url)
+    key = url.render_as_string(hide_password=False)
+
+    with _lock:
+        if key not in _engines:
+            _engines[key] = create_async_engine(url,
+                                                poolclass=AsyncAdaptedQueuePool,
+                                                pool_size=POOL_SIZE,
+                                                max_overflow=0)
+        return _engines[key]
+
+
+def run(coroutine):
+    """Run `coroutine` on the event loop thread and wait for its result."""
+
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop()).result()
+
+
+async def _scalars(async_engine, statement):
+    async with AsyncSession(async_engine) as session:
+        return (await session.scalars(statement)).all()
+
+
+async def _gather(async_engine, statements):
+    return await asyncio.gather(*(_scalars(async_engine, statement)
+                                  for statement in statements))
+
+
+def scalars_all(*statements):
+    """Each statement's `scalars().all()`, concurrently if ASYNC_QUERIES is on."""
+
+    if not enabled():
+        return [db.session.scalars(statement).all() for statement in statements]
+
+    return run(_gather(engine(), statements))
+
+
+def dispose():
+    """Close the pooled async connections.
+
+    Only call this while no thread is running queries, e.g. after a
+    benchmark or test. The engines open new connections as needed.
+    """
+
+    with _lock:
+        engines = list(_engines.values())
+
+    for async_engine in engines:
+        run(async_engine.dispose())
+
+
+def init_app(app):
+    """Turn on concurrent queries for `app` if ASYNC_QUERIES is set."""
+
+    app.config.setdefault('ASYNC_QUERIES',
+                          os.environ.get('ASYNC_QUERIES', '') not in ('', '0'))
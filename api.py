@@ -0,0 +1,299 @@
+"""Read-only JSON API for Warbler, at /api/v1.
+
+    GET /api/v1/timeline                    the logged-in user's home timeline
+    GET /api/v1/users/<id>                  a profile
+    GET /api/v1/users/<id>/messages         their messages
+    GET /api/v1/users/<id>/likes            messages they like
+    GET /api/v1/users/<id>/following        users they follow
+    GET /api/v1/users/<id>/followers        users following them
+    GET /api/v1/messages/<id>               one message
+
+Like the HTML pages, everything but profiles and single messages needs a
+login (the session cookie).
+
+Lists are cursor-paged: each response ends with "next_cursor", which goes
+in the `before` (messages) or `after` (users) param of the next request;
+`limit` sets the page size, up to MAX_LIMIT. Queries select just the
+columns the API returns, and lists are encoded and streamed a row at a
+time as the database hands them over, so memory use doesn't depend on
+the page size.
+
+Encodes with orjson (in requirements.txt), or the json module if it's
+missing.
+"""
+
+import json
+
+from flask import (Blueprint, Response, abort, g, jsonify, request,
+                   stream_with_context)
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+from pagination import PAGE_SIZE, encode_cursor, page_query
+import replicas
+import timeline
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAX_LIMIT = 1000
+
+# Rows fetched from the database at a time while streaming
+STREAM_BATCH = 200
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MESSAGE_COLUMNS = (
+    Message.id,
+    Message.text,
+    Message.timestamp,
+    Message.user_id,
+    User.username,
+    User.image_url,
+)
+
+USER_COLUMNS = (
+    User.id,
+    User.username,
+    User.image_url,
+    User.bio,
+)
+
+PROFILE_COLUMNS = USER_COLUMNS + (
+    User.header_image_url,
+    User.location,
+    User.messages_count,
+    User.following_count,
+    User.followers_count,
+    User.likes_count,
+)
+
+
+##############################################################################
+# Encoding
+
+
+def dumps(obj):
+    """`obj` as JSON bytes."""
+
+    if orjson is not None:
+        return orjson.dumps(obj)
+
+    return json.dumps(obj, default=lambda value: value.isoformat(),
+                      separators=(',', ':')).encode('utf-8')
+
+
+def json_response(obj, status=200):
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
+
+def message_item(row):
+    return {
+        'id': row.id,
+        'text': row.text,
+        'timestamp': row.timestamp,
+        'user': {
+            'id': row.user_id,
+            'username': row.username,
+            'image_url': row.image_url,
+        },
+    }
+
+
+def user_item(row):
+    return row._asdict()
+
+
+def stream_list(rows, limit, to_item, cursor_for):
+    """Stream `rows` as {"items": [...], "next_cursor": ...}.
+
+    `rows` should hold up to `limit` + 1 rows; an extra row means there's
+    another page, whose cursor `cursor_for` makes from the last row sent.
+    """
+
+    def generate():
+        yield b'{"items":['
+
+        last = None
+        has_more = False
+
+        for count, row in enumerate(rows):
+            if count == limit:
+                has_more = True
+                break
+            if last is not None:
+                yield b','
+            yield dumps(to_item(row))
+            last = row
+
+        next_cursor = cursor_for(last) if has_more else None
+        yield b'],"next_cursor":' + dumps(next_cursor) + b'}'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
+
+
+##############################################################################
+# Paging
+
+
+def page_limit():
+    """The `limit` param, checked; 400 if it's not a sensible number."""
+
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+    except ValueError:
+        abort(400)
+
+    if not 1 <= limit <= MAX_LIMIT:
+        abort(400)
+
+    return limit
+
+
+def message_list(query, timestamp_col, id_col):
+    """Stream a newest-first page of `query`'s MESSAGE_COLUMNS rows."""
+
+    limit = page_limit()
+    rows = (page_query(query, timestamp_col, id_col,
+                       request.args.get('before'), limit)
+            .yield_per(STREAM_BATCH))
+
+    return stream_list(rows, limit, message_item,
+                       lambda row: encode_cursor(row.timestamp, row.id))
+
+
+def user_list(query):
+    """Stream a page of `query`'s USER_COLUMNS rows, in id order."""
+
+    limit = page_limit()
+
+    try:
+        after = int(request.args.get('after', 0))
+    except ValueError:
+        abort(400)
+
+    rows = (query
+            .filter(User.id > after)
+            .order_by(User.id)
+            .limit(limit + 1)
+            .yield_per(STREAM_BATCH))
+
+    return stream_list(rows, limit, user_item, lambda row: str(row.id))
+
+
+def messages_query():
+    return (db.session
+            .query(*MESSAGE_COLUMNS)
+            .join(User, User.id == Message.user_id))
+
+
+def require_login():
+    if not g.user:
+        abort(401)
+
+
+def require_user(user_id):
+    if not db.session.scalar(db.select(db.exists().where(User.id == user_id))):
+        abort(404)
+
+
+##############################################################################
+# Routes
+
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(404)
+def api_error(error):
+    return jsonify(error=error.name), error.code
+
+
+@api.route('/timeline')
+@replicas.reads_from_replica
+def get_timeline():
+    require_login()
+
+    if not request.args.get('before'):
+        timeline.warm(g.user.id)
+
+    query = (messages_query()
+             .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+             .filter(TimelineEntry.user_id == g.user.id))
+
+    return message_list(query, TimelineEntry.timestamp, TimelineEntry.message_id)
+
+
+@api.route('/users/<int:user_id>')
+@replicas.reads_from_replica
+def get_user(user_id):
+    row = db.session.execute(
+        db.select(*PROFILE_COLUMNS).where(User.id == user_id)).one_or_none()
+
+    if row is None:
+        abort(404)
+
+    return json_response(user_item(row))
+
+
+@api.route('/users/<int:user_id>/messages')
+@replicas.reads_from_replica
+def get_user_messages(user_id):
+    require_user(user_id)
+
+    query = messages_query().filter(Message.user_id == user_id)
+
+    return message_list(query, Message.timestamp, Message.id)
+
+
+@api.route('/users/<int:user_id>/likes')
+@replicas.reads_from_replica
+def get_user_likes(user_id):
+    require_login()
+    require_user(user_id)
+
+    query = (messages_query()
+             .join(Likes, Likes.message_id == Message.id)
+             .filter(Likes.user_id == user_id))
+
+    return message_list(query, Message.timestamp, Message.id)
+
+
+@api.route('/users/<int:user_id>/following')
+@replicas.reads_from_replica
+def get_following(user_id):
+    require_login()
+    require_user(user_id)
+
+    query = (db.session
+             .query(*USER_COLUMNS)
+             .join(Follows, Follows.user_being_followed_id == User.id)
+             .filter(Follows.user_following_id == user_id))
+
+    return user_list(query)
+
+
+@api.route('/users/<int:user_id>/followers')
+@replicas.reads_from_replica
+def get_followers(user_id):
+    require_login()
+    require_user(user_id)
+
+    query = (db.session
+             .query(*USER_COLUMNS)
+             .join(Follows, Follows.user_following_id == User.id)
+             .filter(Follows.user_being_followed_id == user_id))
+
+    return user_list(query)
+
+
+@api.route('/messages/<int:message_id>')
+@replicas.reads_from_replica
+def get_message(message_id):
+    row = messages_query().filter(Message.id == message_id).one_or_none()
+
+    if row is None:
+        abort(404)
+
+    return json_response(message_item(row))
@@ -1,11 +1,31 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, abort
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message, Follows
+from models import db, connect_db, User, Message, Follows, Likes
+from pagination import to_page, next_page_url
+import aio
+import api
+import assets
+import compression
+import conditional
+import counters
+import current_user
+import fragments
+import jobs
+import live
+import media
+import metrics
+import migrations
+import queries
+import replicas
+import search
+import timeline
 
 CURR_USER_KEY = "curr_user"
 
@@ -13,6 +33,10 @@ CURR_USER_KEY = "curr_user"
 def create_app(database_uri='postgresql:///warbler'):
 
     app = Flask(__name__)
+    # Time waits for pooled connections (see metrics.py)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'poolclass': metrics.TimedQueuePool,
+    }
     connect_db(app, database_uri)
 
     return app
@@ -25,7 +49,22 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = conditional.STATIC_MAX_AGE
 toolbar = DebugToolbarExtension(app)
+metrics.init_app(app)
+queries.init_app(app)
+aio.init_app(app)
+jobs.init_app(app)
+replicas.init_app(app)
+fragments.init_app(app)
+assets.init_app(app)
+media.init_app(app)
+app.register_blueprint(api.api)
+live.init_app(app)
+compression.init_app(app)
+
+app.jinja_env.globals['next_page_url'] = next_page_url
 
 
 ##############################################################################
@@ -34,10 +73,14 @@ toolbar = DebugToolbarExtension(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    This is a cached snapshot of the user (see current_user.py); routes
+    that change the user go through `g.user.row`.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = current_user.load(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -71,12 +114,21 @@ def signup():
     form = UserAddForm()
 
     if form.validate_on_submit():
+        image_url = form.image_url.data or User.image_url.default.arg
+
+        try:
+            if form.image_file.data:
+                image_url = media.save_url(form.image_file.data, 'card')
+        except media.InvalidImage as exc:
+            flash(str(exc), 'danger')
+            return render_template('users/signup.html', form=form)
+
         try:
             user = User.signup(
                 username=form.username.data,
                 password=form.password.data,
                 email=form.email.data,
-                image_url=form.image_url.data or User.image_url.default.arg,
+                image_url=image_url,
             )
             db.session.commit()
 
@@ -103,6 +155,7 @@ def login():
                                  form.password.data)
 
         if user:
+            db.session.commit()                 # Saves a rehashed password, if any
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -128,40 +181,100 @@ def logout():
 # General user routes:
 
 @app.route('/users')
+@replicas.reads_from_replica
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username; best
+    matches come first (see search.py). Takes an 'after' cursor param for
+    the next page.
     """
 
-    search = request.args.get('q')
+    page = search.search_users(request.args.get('q'),
+                               after=request.args.get('after'))
+    users = page.items
 
-    if not search:
-        users = User.query.all()
+    # One query for the follow buttons on every card
+    if g.user:
+        followed_ids = g.user.following_among(user.id for user in users)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        followed_ids = set()
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html',
+                           users=users,
+                           followed_ids=followed_ids,
+                           next_cursor=page.next_cursor)
+
+
+@app.route('/users/autocomplete')
+@replicas.reads_from_replica
+def users_autocomplete():
+    """JSON list of the first few usernames starting with the 'q' param."""
+
+    q = request.args.get('q', '').strip()
+
+    if not q:
+        return jsonify(users=[])
+
+    return jsonify(users=[dict(id=row.id,
+                               username=row.username,
+                               image_url=row.image_url)
+                          for row in search.autocomplete_users(q)])
 
 
 @app.route('/users/<int:user_id>')
+@replicas.reads_from_replica
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
 
-    user = User.query.get_or_404(user_id)
+    Messages are paged newest first; takes a 'before' cursor param in the
+    querystring for the next page.
+    """
+
+    # The page changes when the profile does (version) or a message is
+    # posted; check that before loading anything else
+    latest_message = (db.select(Message.id)
+                      .where(Message.user_id == user_id)
+                      .order_by(Message.timestamp.desc(), Message.id.desc())
+                      .limit(1)
+                      .scalar_subquery())
+    found = db.session.execute(
+        db.select(User, latest_message)
+        .where(User.id == user_id)).one_or_none()
+
+    if found is None:
+        abort(404)
+
+    user, latest_message_id = found
+
+    not_modified = conditional.check('user', user_id, user.version,
+                                     latest_message_id)
+    if not_modified:
+        return not_modified
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    messages = Message.user_page_select(user_id,
+                                        before=request.args.get('before'))
+
+    # The messages and our follow state don't depend on each other, so
+    # they can be fetched at once (see aio.py)
+    if g.user:
+        rows, following = aio.scalars_all(messages, g.user.following_select())
+        g.user.preload_following(following)
+    else:
+        rows, = aio.scalars_all(messages)
+
+    page = to_page(rows)
+
+    return render_template('users/show.html',
+                           user=user,
+                           messages=page.items,
+                           next_cursor=page.next_cursor)
 
 
 @app.route('/users/<int:user_id>/following')
+@replicas.reads_from_replica
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -174,6 +287,7 @@ def show_following(user_id):
 
 
 @app.route('/users/<int:user_id>/followers')
+@replicas.reads_from_replica
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -194,8 +308,18 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+
+    # Following twice (e.g. a double-submitted form) changes nothing
+    if not g.user.is_following(followed_user):
+        db.session.add(Follows(user_following_id=g.user.id,
+                               user_being_followed_id=followed_user.id))
+        db.session.flush()
+        counters.follow_added(g.user.id, followed_user.id)
+        jobs.enqueue('timeline.backfill', user_id=g.user.id,
+                     followed_id=followed_user.id)
+        db.session.commit()
+
+        current_user.forget(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -208,13 +332,41 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    unfollowed = db.session.execute(
+        db.delete(Follows)
+        .where(Follows.user_following_id == g.user.id,
+               Follows.user_being_followed_id == follow_id))
+
+    if unfollowed.rowcount:
+        counters.follow_removed(g.user.id, follow_id)
+        jobs.enqueue('timeline.prune', user_id=g.user.id,
+                     followed_id=follow_id)
     db.session.commit()
 
+    current_user.forget(g.user.id, follow_id)
+
     return redirect(f"/users/{g.user.id}/following")
 
 
+def toggle_like(message_id):
+    """Like or unlike a message for the current user; 404 if it's not there.
+
+    Returns True if the message is now liked.
+    """
+
+    if not db.session.scalar(
+            db.select(db.exists().where(Message.id == message_id))):
+        abort(404)
+
+    liked = Likes.toggle(g.user.id, message_id)
+    counters.adjust(g.user.id, likes_count=1 if liked else -1)
+    db.session.commit()
+
+    current_user.forget(g.user.id)
+
+    return liked
+
+
 @app.route('/users/add_like/<int:message_id>', methods=['POST'])
 def add_like(message_id):
     """Have currently-logged-in-user like this message.
@@ -225,19 +377,35 @@ def add_like(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    liked_message = Message.query.get_or_404(message_id)
-
-    if liked_message in g.user.likes:            # Check if the message is already liked
-        g.user.likes.remove(liked_message)       # If it is, remove the like. Else add the like
-    else:
-        g.user.likes.append(liked_message)
+    toggle_like(message_id)
 
-    db.session.commit()
     return redirect("/")
 
+
+@app.route('/messages/<int:message_id>/like', methods=['POST'])
+def like_message_json(message_id):
+    """Toggle the current user's like on a message; responds with JSON.
+
+    Returns {"message_id", "liked", "likes"} with the new state and the
+    message's like count.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    liked = toggle_like(message_id)
+
+    return jsonify(message_id=message_id,
+                   liked=liked,
+                   likes=Likes.count_for(message_id))
+
 @app.route('/users/<int:userid>/likes')
+@replicas.reads_from_replica
 def show_likes(userid):
-    """Show list of messages liked by the current user."""
+    """Show list of messages liked by the current user.
+
+    Paged newest message first, like the profile page.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
@@ -245,14 +413,16 @@ def show_likes(userid):
     
     user = User.query.get_or_404(userid)  # Get the user by ID
 
-    messages = user.likes
+    liked = Message.liked_page_select(user.id,
+                                      before=request.args.get('before'))
+    page = to_page(db.session.scalars(liked).all())
+    messages = page.items
 
-    for message in messages:
-        print("Message ID: ", message.id)
-        print("Message Text: ", message.text)
-        print("Message User ID: ", message.user.id)
+    metrics.annotate(messages=len(messages))
 
-    return render_template('users/likes.html', messages=messages)
+    return render_template('users/likes.html',
+                           messages=messages,
+                           next_cursor=page.next_cursor)
 
 @app.route('/users/profile', methods=["GET", "POST"])
 def profile():
@@ -273,7 +443,7 @@ def profile():
     header_image_url = usereditform.header_image_url.data
     bio = usereditform.bio.data
 
-    user = User.query.get(g.user.id)         # Get the current user from the database
+    user = g.user.row                           # Get the current user from the database
     authusername = user.username
 
     if usereditform.validate_on_submit():       # Handles our POST requests when form is submitted and checks user password
@@ -286,13 +456,27 @@ def profile():
         
         # This needs to be changed to have optional fields for image_url fields - DONE
 
+        try:
+            if usereditform.image_file.data:
+                image_url = media.save_url(usereditform.image_file.data, 'card')
+            if usereditform.header_image_file.data:
+                header_image_url = media.save_url(usereditform.header_image_file.data,
+                                                  'hero')
+        except media.InvalidImage as exc:
+            flash(str(exc), 'danger')
+            return render_template('users/edit.html', form=usereditform, user=user)
+
         user.username = username
         user.email = email
         user.image_url = image_url or User.image_url.default.arg
         user.header_image_url = header_image_url
         user.bio = bio
+        user.version = User.version + 1
+        user.profile_version = User.profile_version + 1
 
         db.session.commit()
+        current_user.forget(user.id)
+        fragments.forget('user', user.id)
         flash("Profile updated successfully.", "success")
         return redirect(f"/users/{user.id}")
     else:
@@ -310,9 +494,20 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    message_ids = db.session.scalars(
+        db.select(Message.id).where(Message.user_id == g.user.id)).all()
+
+    counters.user_removed(g.user.id)
+    # The timelines' ON DELETE CASCADE drops their timeline and their
+    # messages from everyone else's
+    db.session.delete(g.user.row)
     db.session.commit()
 
+    current_user.forget(g.user.id)
+    search.unindex_messages(message_ids)
+    fragments.forget('user', g.user.id)
+    fragments.forget('message', *message_ids)
+
     return redirect("/signup")
 
 
@@ -333,20 +528,64 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        counters.adjust(g.user.id, messages_count=1)
+        jobs.enqueue('timeline.push_message', message_id=msg.id,
+                     key=f"timeline.push_message:{msg.id}:{msg.timestamp.isoformat()}")
         db.session.commit()
 
+        current_user.forget(g.user.id)
+        search.index_message(msg)
+        live.publish(msg)
+
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+@replicas.reads_from_replica
+def messages_search():
+    """Full-text search of messages.
+
+    Takes 'q' for the search and 'page' for the page of results; best
+    matches come first (see search.py).
+    """
+
+    q = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+
+    messages, has_more = search.search_messages(q, page=page)
+
+    return render_template('messages/search.html',
+                           q=q,
+                           messages=messages,
+                           page=page,
+                           has_more=has_more)
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@replicas.reads_from_replica
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    # Messages don't change, but their author's name and picture can
+    author_version = db.session.scalar(
+        db.select(User.version)
+        .join(Message, Message.user_id == User.id)
+        .where(Message.id == message_id))
+
+    if author_version is None:
+        abort(404)
+
+    not_modified = conditional.check('message', message_id, author_version)
+    if not_modified:
+        return not_modified
+
+    msg = db.session.get(Message, message_id,
+                         options=[joinedload(Message.user, innerjoin=True)])
     return render_template('messages/show.html', message=msg)
 
 
@@ -359,9 +598,16 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    author_id = msg.user_id
+    counters.message_removed(msg)
+    jobs.enqueue('timeline.remove_messages', message_ids=[msg.id])
     db.session.delete(msg)
     db.session.commit()
 
+    current_user.forget(author_id)
+    search.unindex_messages([message_id])
+    fragments.forget('message', message_id)
+
     return redirect(f"/users/{g.user.id}")
 
 
@@ -370,67 +616,184 @@ def messages_destroy(message_id):
 
 
 @app.route('/')
+@replicas.reads_from_replica
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, read from
+      their precomputed timeline (see timeline.py). Takes a 'before'
+      cursor param for older pages.
 
     Also takes in likes
     """
 
     if g.user:
-        # messages = (Message
-        #             .query
-        #             .order_by(Message.timestamp.desc())
-        #             .limit(100)
-        #             .all())
-
-        messages = (
-            Message
-            .query
-            .join(
-                Follows,
-                Follows.user_being_followed_id == Message.user_id
-            )
-            .filter(Follows.user_following_id == g.user.id)
-            .order_by(Message.timestamp.desc())
-            .limit(100)
-            .all())
+        before = request.args.get('before')
 
-        likes = (g.user.likes)                      # Get the likes of the current user
+        if not before:
+            timeline.warm(g.user.id)
 
-        likes = [like.id for like in likes]        # Get the ids of the likes
+        # Get the ids of the messages on this page the current user likes;
+        # selecting them by the page rather than by the loaded messages lets
+        # both queries run at once (see aio.py)
+        liked = (db.select(Likes.message_id)
+                 .where(Likes.user_id == g.user.id,
+                        Likes.message_id.in_(
+                            timeline.page_ids_select(g.user.id, before))))
 
-        for like in likes:
-            print("Like ID: ", like)
+        rows, likes = aio.scalars_all(timeline.page_select(g.user.id, before),
+                                      liked)
+        page = to_page(rows)
+        messages = page.items
 
-        for message in messages:
-            if message.id in likes:
-                print("Message ID: ", message.id)
-            else:
-                print("Message ID: ", message.id, "not in likes")
-            
+        metrics.annotate(messages=len(messages), likes=len(likes))
 
-        return render_template('home.html', messages=messages, likes = likes)
+        return render_template('home.html',
+                               messages=messages,
+                               likes=likes,
+                               next_cursor=page.next_cursor)
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Maintenance commands
+
+
+@app.cli.command('rebuild-timelines')
+@click.option('--user-id', type=int, multiple=True,
+              help="Only rebuild these users' timelines.")
+@click.option('--all', 'rebuild_all', is_flag=True,
+              help="Rebuild every user's timeline, not just cold ones.")
+def rebuild_timelines(user_id, rebuild_all):
+    """Rebuild home timelines from the messages and follows tables.
+
+    By default only cold users (who follow people but whose timeline has
+    never been built) are rebuilt.
+    """
+
+    user_ids = user_id or db.session.scalars(db.select(User.id)).all()
+
+    rebuilt = 0
+    for uid in user_ids:
+        if rebuild_all or user_id or timeline.is_cold(uid):
+            timeline.rebuild(uid)
+            db.session.commit()
+            rebuilt += 1
+
+    click.echo(f"Rebuilt {rebuilt} timeline(s).")
+
+
+@app.cli.command('trim-timelines')
+def trim_timelines():
+    """Trim every timeline back to timeline.TIMELINE_LENGTH entries.
+
+    Optional: pushes already keep timelines close to that length.
+    """
+
+    for uid in db.session.scalars(db.select(User.id)).all():
+        timeline.trim(uid)
+        db.session.commit()
+
+    click.echo("Trimmed timelines.")
+
+
+@app.cli.command('reconcile-counters')
+@click.option('--user-id', type=int, multiple=True,
+              help="Only reconcile these users.")
+def reconcile_counters(user_id):
+    """Recompute the denormalized profile counters from the base tables."""
+
+    counters.reconcile(user_id or None)
+    db.session.commit()
+
+    click.echo("Reconciled counters.")
+
+
+@app.cli.command('db-upgrade')
+@click.option('--to', 'target', type=int, help="Stop at this version.")
+def db_upgrade(target):
+    """Apply pending schema migrations (see migrations.py)."""
+
+    for step in migrations.upgrade(target):
+        click.echo(f"Applied {step.version}: {step.description}")
+
+    click.echo(f"Database is at version {migrations.current_version()}.")
+
+
+@app.cli.command('check-indexes')
+@click.option('--user-id', type=int, default=1,
+              help="User to build the queries for.")
+def check_indexes(user_id):
+    """EXPLAIN the homepage, profile and likes queries.
+
+    Exits with an error if any of them would scan a whole table.
+    """
+
+    failed = False
+
+    for name, (plan, scans) in migrations.check_index_usage(user_id).items():
+        click.echo(f"{name}:")
+        for line in plan:
+            click.echo(f"    {line}")
+        if scans:
+            failed = True
+            click.echo(f"  FULL SCAN: {'; '.join(scans)}", err=True)
+
+    if failed:
+        raise click.ClickException("Hot queries are not using indexes.")
+
+    click.echo("All hot queries use indexes.")
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and precompress static/ into static/dist (see assets.py)."""
+
+    manifest = assets.build(app.static_folder, report=click.echo)
+
+    click.echo(f"Built {len(manifest)} assets.")
+
+
+@app.cli.command('run-jobs')
+@click.option('--workers', type=int, default=4,
+              help="Jobs to run at once.")
+@click.option('--until-idle', is_flag=True,
+              help="Exit once there's nothing left to run.")
+def run_jobs(workers, until_idle):
+    """Run background jobs (see jobs.py) until interrupted."""
+
+    click.echo(f"Running jobs on {workers} workers.")
+    jobs.work(app, workers, stop_when_idle=until_idle)
+
+    for status, count in sorted(jobs.counts().items()):
+        click.echo(f"{status}: {count}")
+
+
+@app.cli.command('purge-jobs')
+@click.option('--days', type=int, default=7,
+              help="Keep jobs that finished more recently than this.")
+def purge_jobs(days):
+    """Delete finished and failed jobs older than --days days."""
+
+    click.echo(f"Purged {jobs.purge(days)} jobs.")
+
+
+##############################################################################
+# Caching headers
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Static files get a max-age (SEND_FILE_MAX_AGE_DEFAULT), and built /assets/
+# files and uploaded /media/ images are immutable (see assets.py and
+# media.py); pages must be revalidated, and the ones that call
+# conditional.check() carry an ETag to revalidate against.
 
 @app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+def add_header(resp):
+    """Add caching headers to every dynamic response."""
+
+    if request.endpoint in ('static', 'assets', 'media'):
+        return resp
+
+    return conditional.add_headers(resp)
@@ -0,0 +1,243 @@
+"""Fingerprinted, precompressed static assets for Warbler.
+
+`flask build-assets` copies everything in static/ to static/dist/ under a
+name with a hash of its contents in it (style.css -> style.3f2a9c1d0b7e.css),
+writes .br and .gz copies of the text-like files next to them (just .gz
+if the Brotli package from requirements.txt is missing), and records it
+all in static/dist/manifest.json. url()s in stylesheets are rewritten to
+the fingerprinted names first, so a changed image changes the
+stylesheet's name too.
+
+Templates link assets through `static_url('stylesheets/style.css')`, which
+gives the fingerprinted /assets/ URL once the build has run, and the plain
+/static/ one before it (e.g. in development).
+
+A fingerprinted name never changes contents, so /assets/ responses can be
+cached for a year without revalidating. They're served from the
+precompressed copy that best matches the browser's Accept-Encoding;
+nothing is compressed per request.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import threading
+
+from flask import abort, current_app, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+URL_PREFIX = '/assets'
+
+# Cache-Control for fingerprinted files
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Compress these; images are compressed already
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt', '.html'}
+
+# Only keep a compressed copy that saves at least this much
+MIN_SAVING = 0.1
+
+# Content-Encoding: file suffix, best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)/static/([^'")]+)\1\s*\)''')
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+##############################################################################
+# Building
+
+
+def fingerprint(path, data):
+    """`path` with a hash of `data` before its extension."""
+
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    base, ext = os.path.splitext(path)
+
+    return f"{base}.{digest}{ext}"
+
+
+def compressed_copies(data):
+    """{encoding: compressed bytes} for the encodings worth keeping."""
+
+    copies = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+
+    if brotli is not None:
+        copies['br'] = brotli.compress(data, quality=11)
+
+    return {encoding: body for encoding, body in copies.items()
+            if len(body) <= len(data) * (1 - MIN_SAVING)}
+
+
+def rewrite_css(data, manifest):
+    """Point a stylesheet's url(/static/...)s at fingerprinted files."""
+
+    def replace(match):
+        entry = manifest.get(match.group(2))
+        if entry is None:
+            return match.group(0)
+        return f"url({match.group(1)}{URL_PREFIX}/{entry['path']}{match.group(1)})"
+
+    return CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def source_files(static_dir):
+    """Paths under `static_dir` (relative, with /), stylesheets last."""
+
+    paths = []
+
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir and BUILD_DIR in dirs:
+            dirs.remove(BUILD_DIR)
+
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), static_dir)
+            paths.append(path.replace(os.sep, '/'))
+
+    return sorted(paths, key=lambda path: (path.endswith('.css'), path))
+
+
+def build(static_dir, report=print):
+    """Rebuild `static_dir`/dist; returns the manifest."""
+
+    out_dir = os.path.join(static_dir, BUILD_DIR)
+    shutil.rmtree(out_dir, ignore_errors=True)
+
+    manifest = {}
+
+    for path in source_files(static_dir):
+        with open(os.path.join(static_dir, path), 'rb') as source:
+            data = source.read()
+
+        if path.endswith('.css'):
+            data = rewrite_css(data, manifest)
+
+        built = fingerprint(path, data)
+        target = os.path.join(out_dir, built)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        with open(target, 'wb') as out:
+            out.write(data)
+
+        encodings = []
+        if os.path.splitext(path)[1].lower() in COMPRESSIBLE:
+            for encoding, body in compressed_copies(data).items():
+                with open(target + dict(ENCODINGS)[encoding], 'wb') as out:
+                    out.write(body)
+                encodings.append(encoding)
+
+        manifest[path] = {'path': built, 'encodings': sorted(encodings)}
+        report(f"{path} -> {built}"
+               f"{' (' + ', '.join(sorted(encodings)) + ')' if encodings else ''}")
+
+    with open(os.path.join(out_dir, MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+
+    forget_manifest()
+
+    return manifest
+
+
+##############################################################################
+# Serving
+
+
+def build_dir():
+    return os.path.join(current_app.static_folder, BUILD_DIR)
+
+
+def manifest():
+    """The built manifest ({} if there's no build), cached until it changes."""
+
+    path = os.path.join(build_dir(), MANIFEST)
+
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+
+    with _manifests_lock:
+        cached = _manifests.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path) as manifest_file:
+                cached = _manifests[path] = (mtime, json.load(manifest_file))
+
+    return cached[1]
+
+
+def forget_manifest():
+    with _manifests_lock:
+        _manifests.clear()
+
+
+def static_url(path):
+    """URL for the static file at `path` (template global)."""
+
+    entry = manifest().get(path)
+
+    if entry is None:
+        return url_for('static', filename=path)
+
+    return f"{URL_PREFIX}/{entry['path']}"
+
+
+def best_encoding(available):
+    """The best of `available` encodings the browser accepts, or None."""
+
+    accepted = request.accept_encodings
+
+    for encoding, _ in ENCODINGS:
+        if encoding in available and accepted[encoding] > 0:
+            return encoding
+
+    return None
+
+
+def serve_asset(filename):
+    """A fingerprinted file, precompressed if the browser takes it."""
+
+    path = safe_join(build_dir(), filename)
+
+    if path is None or filename == MANIFEST:
+        abort(404)
+
+    available = {encoding for encoding, suffix in ENCODINGS
+                 if os.path.isfile(path + suffix)}
+    encoding = best_encoding(available)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if encoding is None:
+        resp = send_from_directory(build_dir(), filename, mimetype=mimetype)
+    else:
+        resp = send_from_directory(build_dir(),
+                                   filename + dict(ENCODINGS)[encoding],
+                                   mimetype=mimetype)
+        resp.headers['Content-Encoding'] = encoding
+
+    if available:
+        resp.vary.add('Accept-Encoding')
+
+    resp.headers['Cache-Control'] = IMMUTABLE
+
+    return resp
+
+
+def init_app(app):
+    """Serve built assets under /assets and add static_url() to templates."""
+
+    app.add_url_rule(f"{URL_PREFIX}/<path:filename>", 'assets', serve_asset)
+    app.jinja_env.globals['static_url'] = static_url
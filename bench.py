@@ -0,0 +1,374 @@
+"""Load and latency benchmark for Warbler's routes.
+
+    python bench.py                     # seed, run, compare to the baseline
+    python bench.py --save-baseline     # ...and record this run as the baseline
+    python bench.py --database-url postgresql:///warbler-bench \\
+        --users 10000 --messages 200000 --follows 500000 --likes 300000
+    python bench.py --compare-async     # sync queries vs ASYNC_QUERIES
+
+Seeds a database with generator/create_csvs.py and loader.py (unless
+--no-seed), then runs --sessions logged-in sessions at once, each making
+--requests requests picked from ROUTES. Requests go through Flask's test
+client, so this measures the app and the database, not a web server.
+
+For each route it reports p50/p95/p99 latency, requests/sec and SQL
+statements per request. If there's a baseline file, any route whose p95 or
+SQL count went up, or whose throughput went down, by more than
+--tolerance is reported and the exit status is 1.
+
+--compare-async runs the same sessions twice, with ASYNC_QUERIES off and
+then on (see aio.py), and prints the two side by side instead; the number
+of sessions, i.e. worker threads, is the same for both.
+
+Latencies only compare between runs on the same machine, so the baseline
+file isn't checked in.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'generator'))
+
+DEFAULT_DATABASE_URL = 'sqlite:////tmp/warbler-bench.db'
+BASELINE_FILE = os.path.join(BASE_DIR, 'bench_baseline.json')
+
+# Allowed slack before a change counts as a regression
+TOLERANCE = 0.25
+
+
+##############################################################################
+# What a session does
+
+
+def home(client, rng, ctx):
+    return client.get('/')
+
+
+def list_users(client, rng, ctx):
+    return client.get('/users')
+
+
+def users_show(client, rng, ctx):
+    return client.get(f"/users/{ctx.random_user(rng)}")
+
+
+def show_likes(client, rng, ctx):
+    return client.get(f"/users/{ctx.random_user(rng)}/likes")
+
+
+def messages_show(client, rng, ctx):
+    return client.get(f"/messages/{ctx.random_message(rng)}")
+
+
+def add_like(client, rng, ctx):
+    return client.post(f"/users/add_like/{ctx.random_message(rng)}")
+
+
+def add_follow(client, rng, ctx):
+    return client.post(f"/users/follow/{ctx.random_user(rng)}")
+
+
+def messages_add(client, rng, ctx):
+    return client.post('/messages/new',
+                       data={'text': f"Benchmark warble {rng.random()}"})
+
+
+# Route name: (request function, relative weight)
+ROUTES = {
+    'homepage': (home, 30),
+    'list_users': (list_users, 10),
+    'users_show': (users_show, 20),
+    'show_likes': (show_likes, 10),
+    'messages_show': (messages_show, 15),
+    'add_like': (add_like, 7),
+    'add_follow': (add_follow, 4),
+    'messages_add': (messages_add, 4),
+}
+
+
+class Context:
+    """What sessions need to know about the seeded data."""
+
+    def __init__(self, num_users, num_messages):
+        self.num_users = num_users
+        self.num_messages = num_messages
+
+    def random_user(self, rng):
+        return rng.randint(1, self.num_users)
+
+    def random_message(self, rng):
+        return rng.randint(1, self.num_messages)
+
+
+##############################################################################
+# Measuring
+
+
+class Recorder:
+    """Collects (latency, SQL statements, ok) per route, from any thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.local = threading.local()
+
+    def count_statement(self, *args):
+        self.local.statements = getattr(self.local, 'statements', 0) + 1
+
+    def measure(self, route, fn, *args):
+        self.local.statements = 0
+        started = time.perf_counter()
+        resp = fn(*args)
+        took = time.perf_counter() - started
+
+        with self.lock:
+            self.samples[route].append(
+                (took, self.local.statements, resp.status_code < 400))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(samples, elapsed):
+    """Per-route stats from Recorder.samples, plus an 'all' row."""
+
+    everything = [sample for route in samples.values() for sample in route]
+    results = {}
+
+    for route, route_samples in [*sorted(samples.items()), ('all', everything)]:
+        latencies = sorted(took for took, _, _ in route_samples)
+        results[route] = {
+            'requests': len(route_samples),
+            'errors': sum(not ok for _, _, ok in route_samples),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'rps': len(route_samples) / elapsed,
+            'sql_per_request': (sum(statements for _, statements, _ in route_samples)
+                                / len(route_samples)),
+        }
+
+    return results
+
+
+def print_report(results):
+    print(f"{'route':<16}{'requests':>9}{'errors':>7}{'p50 ms':>9}"
+          f"{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'sql/req':>9}")
+
+    for route, stats in results.items():
+        print(f"{route:<16}{stats['requests']:>9}{stats['errors']:>7}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+              f"{stats['p99_ms']:>9.1f}{stats['rps']:>9.1f}"
+              f"{stats['sql_per_request']:>9.1f}")
+
+
+def print_comparison(sync_results, async_results):
+    print(f"{'route':<16}{'p50 sync':>10}{'p50 async':>11}"
+          f"{'p95 sync':>10}{'p95 async':>11}{'req/s sync':>12}{'req/s async':>13}")
+
+    for route, before in sync_results.items():
+        after = async_results[route]
+        print(f"{route:<16}{before['p50_ms']:>10.1f}{after['p50_ms']:>11.1f}"
+              f"{before['p95_ms']:>10.1f}{after['p95_ms']:>11.1f}"
+              f"{before['rps']:>12.1f}{after['rps']:>13.1f}")
+
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+    """Descriptions of everything that got worse than `baseline` allows."""
+
+    found = []
+
+    for route, stats in results.items():
+        before = baseline.get(route)
+        if not before:
+            continue
+
+        if stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found.append(f"{route}: p95 {before['p95_ms']:.1f}ms -> "
+                         f"{stats['p95_ms']:.1f}ms")
+        if stats['rps'] < before['rps'] * (1 - tolerance):
+            found.append(f"{route}: {before['rps']:.1f} -> "
+                         f"{stats['rps']:.1f} req/s")
+        # Query counts barely move between runs, so any real growth counts
+        if stats['sql_per_request'] > before['sql_per_request'] * (1 + tolerance / 4) + 0.5:
+            found.append(f"{route}: {before['sql_per_request']:.1f} -> "
+                         f"{stats['sql_per_request']:.1f} SQL statements per request")
+        if stats['errors'] > before['errors']:
+            found.append(f"{route}: {before['errors']} -> {stats['errors']} errors")
+
+    return found
+
+
+##############################################################################
+# Running
+
+
+def seed(args):
+    """Generate and load a data set of the requested size."""
+
+    import create_csvs
+    import loader
+    from app import app
+
+    with tempfile.TemporaryDirectory() as csv_dir:
+        create_csvs.generate(csv_dir, args.users, args.messages, args.follows,
+                             args.likes, args.seed)
+
+        with app.app_context():
+            loader.load(csv_dir, report=lambda line: print(f"  {line}"))
+
+
+def run_session(app, recorder, ctx, session_number, args):
+    from app import CURR_USER_KEY
+
+    rng = Random(f"{args.seed}:{session_number}")
+    names = list(ROUTES)
+    weights = [ROUTES[name][1] for name in names]
+
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = ctx.random_user(rng)
+
+        for _ in range(args.requests):
+            route = rng.choices(names, weights)[0]
+            recorder.measure(route, ROUTES[route][0], client, rng, ctx)
+
+
+def run(args):
+    """Run the sessions; returns summarize()'s results."""
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import app
+    from models import db, Message, User
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+    recorder = Recorder()
+
+    with app.app_context():
+        ctx = Context(db.session.scalar(db.select(db.func.max(User.id))),
+                      db.session.scalar(db.select(db.func.max(Message.id))))
+
+    # Every engine, to include the async ones aio.py makes
+    event.listen(Engine, 'before_cursor_execute', recorder.count_statement)
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            for done in [pool.submit(run_session, app, recorder, ctx, number, args)
+                         for number in range(args.sessions)]:
+                done.result()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', recorder.count_statement)
+    elapsed = time.perf_counter() - started
+
+    return summarize(recorder.samples, elapsed)
+
+
+def compare_async(args):
+    """Run the sessions with ASYNC_QUERIES off, then on, and compare."""
+
+    import aio
+    from app import app
+
+    results = {}
+
+    for setting in (False, True):
+        app.config['ASYNC_QUERIES'] = setting
+        print(f"Running {args.sessions} sessions x {args.requests} requests, "
+              f"ASYNC_QUERIES={setting}")
+        results[setting] = run(args)
+
+    # Close the pooled async connections
+    aio.dispose()
+
+    print_comparison(results[False], results[True])
+
+    if args.json_out:
+        with open(args.json_out, 'w') as out:
+            json.dump({'sync': results[False], 'async': results[True]},
+                      out, indent=2)
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load and latency benchmark for Warbler's routes.")
+    parser.add_argument('--database-url', default=os.environ.get(
+        'BENCH_DATABASE_URL', DEFAULT_DATABASE_URL))
+    parser.add_argument('--no-seed', dest='seed_data', action='store_false',
+                        help="use the data already in the database")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=30000)
+    parser.add_argument('--likes', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sessions', type=int, default=8,
+                        help="concurrent simulated sessions")
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests per session")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="record this run as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--json', dest='json_out',
+                        help="also write the results to this file")
+    parser.add_argument('--compare-async', action='store_true',
+                        help="run with ASYNC_QUERIES off, then on, and compare")
+    args = parser.parse_args()
+
+    # Has to be set before the app is imported
+    os.environ['DATABASE_URL'] = args.database_url
+
+    if args.seed_data:
+        print(f"Seeding {args.database_url}")
+        seed(args)
+
+    if args.compare_async:
+        return compare_async(args)
+
+    print(f"Running {args.sessions} sessions x {args.requests} requests")
+    results = run(args)
+    print_report(results)
+
+    if args.json_out:
+        with open(args.json_out, 'w') as out:
+            json.dump(results, out, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as out:
+            json.dump(results, out, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --save-baseline")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        found = regressions(results, json.load(baseline_file), args.tolerance)
+
+    for regression in found:
+        print(f"REGRESSION {regression}")
+
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""Response compression for Warbler.
+
+`CompressMiddleware` wraps the WSGI app and compresses text responses
+(pages, JSON, CSS, JS) with brotli or gzip, whichever the browser accepts
+(brotli first). Brotli comes from requirements.txt; without it responses
+are only gzipped.
+
+Streamed responses are compressed as they go: each chunk is fed to the
+compressor, and whatever has built up is flushed out at least every
+FLUSH_BYTES of input, so at most that much is ever held back. The body
+is never collected in memory first.
+
+Left alone:
+
+- bodies known to be smaller than COMPRESS_MIN_SIZE
+- types not in COMPRESSIBLE_TYPES (images, and event streams, which must
+  reach the browser the moment they're written)
+- responses that already have a Content-Encoding, or say no-transform
+- /assets/ files, which are precompressed at build time (see assets.py)
+- HEAD requests, and responses without a body
+
+Compressed responses get Vary: Accept-Encoding, and their ETags are made
+weak, since the bytes differ from the uncompressed page's.
+
+Config:
+
+- COMPRESS_MIN_SIZE: smallest body worth compressing, in bytes (default
+  1024; also read from the environment)
+"""
+
+import os
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import dump_header, parse_accept_header, parse_set_header
+
+from assets import URL_PREFIX as ASSETS_PREFIX
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIN_SIZE = 1024
+
+COMPRESSIBLE_TYPES = {
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/xml',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+}
+
+# Flush compressed output at least this often (bytes of input)
+FLUSH_BYTES = 16 * 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+SKIP_PREFIXES = (ASSETS_PREFIX + '/',)
+
+
+class GzipCompressor:
+    def __init__(self):
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self.compressor = brotli.Compressor(mode=brotli.MODE_TEXT,
+                                            quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def available_encodings():
+    """Content-Encoding: compressor class, best first."""
+
+    encodings = {}
+
+    if brotli is not None:
+        encodings['br'] = BrotliCompressor
+    encodings['gzip'] = GzipCompressor
+
+    return encodings
+
+
+def choose_encoding(environ):
+    """The best encoding the request accepts, or None."""
+
+    accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+
+    for encoding in available_encodings():
+        if accepted[encoding] > 0:
+            return encoding
+
+    return None
+
+
+def weak_etag(headers):
+    etag = headers.get('ETag')
+
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = 'W/' + etag
+
+
+def should_compress(status, headers, min_size):
+    """Is a response with this status and these headers worth compressing?"""
+
+    code = int(status.split(None, 1)[0])
+    if code < 200 or code in (204, 206, 304):
+        return False
+
+    mimetype = headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if mimetype not in COMPRESSIBLE_TYPES:
+        return False
+
+    if headers.get('Content-Encoding', 'identity') != 'identity':
+        return False
+
+    if 'no-transform' in headers.get('Cache-Control', ''):
+        return False
+
+    length = headers.get('Content-Length')
+    if length is not None and length.isdigit() and int(length) < min_size:
+        return False
+
+    return True
+
+
+class CompressedBody:
+    """The app's response iterable, compressed chunk by chunk.
+
+    `get_compressor()` is asked once the first chunk is in, for apps that
+    only start the response then; if it's None the body passes through.
+    """
+
+    def __init__(self, app_iter, get_compressor):
+        self.app_iter = app_iter
+        self.get_compressor = get_compressor
+
+    def __iter__(self):
+        compressor = None
+        pending = 0
+
+        for chunk in self.app_iter:
+            if compressor is None:
+                compressor = self.get_compressor()
+                if compressor is None:
+                    yield chunk
+                    continue
+
+            out = compressor.compress(chunk)
+            pending += len(chunk)
+
+            if pending >= FLUSH_BYTES:
+                out += compressor.flush()
+                pending = 0
+
+            if out:
+                yield out
+
+        compressor = compressor or self.get_compressor()
+        if compressor is not None:
+            yield compressor.finish()
+
+    def close(self):
+        # Let the app clean up (Flask's teardown, live.py's unsubscribe)
+        close = getattr(self.app_iter, 'close', None)
+        if close is not None:
+            close()
+
+
+class CompressMiddleware:
+    """Compress `app`'s responses for browsers that accept it."""
+
+    def __init__(self, app, min_size=DEFAULT_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ)
+
+        if (encoding is None or environ.get('REQUEST_METHOD') == 'HEAD'
+                or environ.get('PATH_INFO', '').startswith(SKIP_PREFIXES)):
+            return self.app(environ, start_response)
+
+        started = False
+        compressor = None
+
+        def compressing_start_response(status, headers, exc_info=None):
+            nonlocal started, compressor
+
+            started = True
+            headers = Headers(headers)
+
+            if should_compress(status, headers, self.min_size):
+                compressor = available_encodings()[encoding]()
+
+                del headers['Content-Length']
+                del headers['Accept-Ranges']
+                headers['Content-Encoding'] = encoding
+                weak_etag(headers)
+
+                vary = parse_set_header(headers.get('Vary'))
+                vary.add('Accept-Encoding')
+                headers['Vary'] = dump_header(vary)
+            else:
+                compressor = None
+
+            write = start_response(status, headers.to_wsgi_list(), exc_info)
+
+            if compressor is None:
+                return write
+
+            return lambda data: write(compressor.compress(data)
+                                      + compressor.flush())
+
+        app_iter = self.app(environ, compressing_start_response)
+
+        if started and compressor is None:
+            # Untouched, so the server can still use wsgi.file_wrapper
+            return app_iter
+
+        return CompressedBody(app_iter, lambda: compressor)
+
+
+def init_app(app):
+    """Compress `app`'s responses."""
+
+    app.config.setdefault('COMPRESS_MIN_SIZE',
+                          int(os.environ.get('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)))
+
+    app.wsgi_app = CompressMiddleware(
+        app.wsgi_app,
+        min_size=app.config['COMPRESS_MIN_SIZE'])
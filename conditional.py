@@ -0,0 +1,64 @@
+"""Conditional GET for Warbler pages.
+
+A route that can cheaply tell whether its page changed calls `check()`
+with whatever the page depends on (ids, User.version, ...) before doing
+its real work. That sets the response's ETag and, if the browser already
+has that version, returns a 304 to send back instead of rendering.
+
+Pages also depend on who's looking (navbar, follow buttons), so the
+current user's id and version are always part of the ETag, and the
+responses are private to that browser.
+
+User.version goes up whenever anything a page shows about the user
+changes: their profile, or any of their counters (see counters.py).
+"""
+
+import hashlib
+
+from flask import g, make_response, request, session
+
+# Cache-Control for pages: browsers may keep them but must revalidate
+PAGE_CACHE_CONTROL = 'private, no-cache'
+
+# Plain /static/ URLs aren't fingerprinted (the built /assets/ ones are,
+# and get cached for a year; see assets.py), so they can't be cached
+# forever; a week keeps repeat visits fast without stranding changes
+STATIC_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def make_etag(parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def check(*parts):
+    """Set this response's ETag from `parts` and the current user.
+
+    Returns a 304 response if the browser already has this version of the
+    page, else None.
+    """
+
+    # A page with a flash message on it only looks like that once
+    if session.get('_flashes'):
+        return None
+
+    viewer = (g.user.id, g.user.version) if g.user else None
+    g.etag = make_etag((request.full_path, viewer) + parts)
+
+    if request.if_none_match.contains_weak(g.etag):
+        return make_response('', 304)
+
+    return None
+
+
+def add_headers(resp):
+    """Validators and Cache-Control for a dynamic response."""
+
+    etag = g.get('etag')
+
+    if etag and resp.status_code in (200, 304):
+        resp.set_etag(etag)
+        resp.vary.add('Cookie')
+
+    resp.headers['Cache-Control'] = PAGE_CACHE_CONTROL
+
+    return resp
@@ -0,0 +1,125 @@
+"""Denormalized profile counters for Warbler.
+
+Profile stats used to be rendered with `user.messages | length` and
+friends, which loads a whole relationship just to count it. Instead, each
+user row carries messages/following/followers/likes counts. The routes
+adjust them in the same transaction as the write they describe, and
+`reconcile()` recomputes them from the base tables.
+
+Every counter change also bumps User.version, since profile pages show
+the counters (see conditional.py).
+"""
+
+from sqlalchemy import func, select, update
+
+from models import db, Follows, Likes, Message, User
+
+
+def adjust(user_id, **deltas):
+    """Add `deltas` to counters on `user_id`, e.g. adjust(1, likes_count=-1)."""
+
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values({getattr(User, name): getattr(User, name) + delta
+                 for name, delta in deltas.items()})
+        .values(version=User.version + 1))
+
+
+def follow_added(user_id, followed_id):
+    """Count `user_id` starting to follow `followed_id`."""
+
+    adjust(user_id, following_count=1)
+    adjust(followed_id, followers_count=1)
+
+
+def follow_removed(user_id, followed_id):
+    """Count `user_id` no longer following `followed_id`."""
+
+    adjust(user_id, following_count=-1)
+    adjust(followed_id, followers_count=-1)
+
+
+def message_removed(message):
+    """Count `message` going away, for its author and anyone who liked it.
+
+    Call before the message (and its likes) are deleted.
+    """
+
+    adjust(message.user_id, messages_count=-1)
+
+    likers = select(Likes.user_id).where(Likes.message_id == message.id)
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(likers))
+        .values(likes_count=User.likes_count - 1,
+                version=User.version + 1))
+
+
+def user_removed(user_id):
+    """Count `user_id` going away for the users they were connected to.
+
+    Call before the user (and their follows, likes and messages) are
+    deleted.
+    """
+
+    followed = select(Follows.user_being_followed_id).where(
+        Follows.user_following_id == user_id)
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(followed))
+        .values(followers_count=User.followers_count - 1,
+                version=User.version + 1))
+
+    followers = select(Follows.user_following_id).where(
+        Follows.user_being_followed_id == user_id)
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(followers))
+        .values(following_count=User.following_count - 1,
+                version=User.version + 1))
+
+    # Anyone who liked this user's messages loses one like per message
+    lost_likes = (select(func.count())
+                  .select_from(Likes)
+                  .join(Message, Message.id == Likes.message_id)
+                  .where(Message.user_id == user_id,
+                         Likes.user_id == User.id)
+                  .scalar_subquery())
+    likers = (select(Likes.user_id)
+              .join(Message, Message.id == Likes.message_id)
+              .where(Message.user_id == user_id))
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(likers))
+        .values(likes_count=User.likes_count - lost_likes,
+                version=User.version + 1))
+
+
+def reconcile(user_ids=None, bump_version=True):
+    """Recompute counters from the base tables.
+
+    Does every user unless given a list of `user_ids`. Migrations that run
+    before users.version existed pass bump_version=False.
+    """
+
+    def count(table, column):
+        return (select(func.count())
+                .select_from(table)
+                .where(column == User.id)
+                .scalar_subquery())
+
+    stmt = update(User).values(
+        messages_count=count(Message, Message.user_id),
+        following_count=count(Follows, Follows.user_following_id),
+        followers_count=count(Follows, Follows.user_being_followed_id),
+        likes_count=count(Likes, Likes.user_id),
+    )
+
+    if bump_version:
+        stmt = stmt.values(version=User.version + 1)
+
+    if user_ids is not None:
+        stmt = stmt.where(User.id.in_(user_ids))
+
+    db.session.execute(stmt)
@@ -0,0 +1,145 @@
+"""The logged-in user, as seen by routes and templates through `g.user`.
+
+Loading the whole User row before every request is wasteful: most pages
+only need a handful of columns for the navbar and sidebar, and nothing
+needs the password hash. So we keep a small snapshot of those columns per
+user id, cached in-process for SNAPSHOT_TTL seconds, and only load the
+full row when a route asks for `g.user.row` to change it.
+
+Routes that change a user's snapshot columns call `forget(user_id)`.
+"""
+
+import threading
+import time
+
+from models import db, Follows, User
+
+# How long a snapshot is trusted before we reload it
+SNAPSHOT_TTL = 30
+
+# Stop growing the cache past this many users; expired entries get dropped
+MAX_SNAPSHOTS = 10000
+
+SNAPSHOT_COLUMNS = (
+    User.id,
+    User.username,
+    User.image_url,
+    User.header_image_url,
+    User.messages_count,
+    User.following_count,
+    User.followers_count,
+    User.likes_count,
+    User.version,
+)
+
+_snapshots = {}
+_lock = threading.Lock()
+
+
+class CurrentUser:
+    """Snapshot of the logged-in user's display columns.
+
+    Has the same attribute names as User for the snapshot columns, plus the
+    follow checks templates use. Anything else goes through `row`.
+    """
+
+    def __init__(self, snapshot):
+        self.__dict__.update(snapshot)
+        self._row = None
+        self._following_ids = None
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    @property
+    def row(self):
+        """The full User row, loaded the first time it's asked for."""
+
+        if self._row is None:
+            self._row = db.session.get(User, self.id)
+
+        return self._row
+
+    def following_ids(self):
+        """Ids of the users we follow, loaded once per request."""
+
+        if self._row is not None:
+            return self._row.following_ids()
+
+        if self._following_ids is None:
+            self._following_ids = set(db.session.scalars(self.following_select()))
+
+        return self._following_ids
+
+    def following_select(self):
+        """SELECT for the ids of the users we follow."""
+
+        return (db.select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == self.id))
+
+    def preload_following(self, user_ids):
+        """Use these results of `following_select()` for this request."""
+
+        self._following_ids = set(user_ids)
+
+    def following_among(self, user_ids):
+        """Which of `user_ids` do we follow? See User.following_among()."""
+
+        if self._row is not None:
+            return self._row.following_among(user_ids)
+
+        user_ids = set(user_ids)
+
+        if not user_ids:
+            return set()
+
+        if self._following_ids is not None:
+            return self._following_ids & user_ids
+
+        return set(db.session.scalars(
+            db.select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == self.id,
+                   Follows.user_being_followed_id.in_(user_ids))))
+
+    def is_following(self, other_user):
+        """Are we following `other_user`?"""
+
+        return other_user.id in self.following_ids()
+
+
+def load(user_id):
+    """Get a CurrentUser for `user_id`, or None if there's no such user."""
+
+    now = time.monotonic()
+    cached = _snapshots.get(user_id)
+
+    if cached and cached[0] > now:
+        return CurrentUser(cached[1])
+
+    row = db.session.execute(
+        db.select(*SNAPSHOT_COLUMNS)
+        .where(User.id == user_id)).one_or_none()
+
+    if row is None:
+        forget(user_id)
+        return None
+
+    snapshot = row._asdict()
+
+    with _lock:
+        if len(_snapshots) >= MAX_SNAPSHOTS:
+            for stale_id, (expires, _) in list(_snapshots.items()):
+                if expires <= now:
+                    del _snapshots[stale_id]
+        if len(_snapshots) < MAX_SNAPSHOTS:
+            _snapshots[user_id] = (now + SNAPSHOT_TTL, snapshot)
+
+    return CurrentUser(snapshot)
+
+
+def forget(*user_ids):
+    """Drop cached snapshots after changing these users."""
+
+    with _lock:
+        for user_id in user_ids:
+            _snapshots.pop(user_id, None)
@@ -1,7 +1,10 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField
 from wtforms import StringField, PasswordField, TextAreaField
 from wtforms.validators import DataRequired, Email, Length
 
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+
 
 class MessageForm(FlaskForm):
     """Form for adding/editing messages."""
@@ -16,6 +19,8 @@ class UserAddForm(FlaskForm):
     email = StringField('E-mail', validators=[DataRequired(), Email()])
     password = PasswordField('Password', validators=[Length(min=6)])
     image_url = StringField('(Optional) Image URL')
+    image_file = FileField('(Optional) Upload an image',
+                           validators=[FileAllowed(IMAGE_EXTENSIONS, 'Images only.')])
 
 class UserEditForm(FlaskForm):
     """Form for editting users."""
@@ -25,6 +30,10 @@ class UserEditForm(FlaskForm):
     password = PasswordField('Password', validators=[Length(min=6)])
     image_url = StringField('(Optional) Image URL')
     header_image_url = StringField('(Optional) Header Image URL')
+    image_file = FileField('(Optional) Upload an image',
+                           validators=[FileAllowed(IMAGE_EXTENSIONS, 'Images only.')])
+    header_image_file = FileField('(Optional) Upload a header image',
+                                  validators=[FileAllowed(IMAGE_EXTENSIONS, 'Images only.')])
     bio = TextAreaField('(Optional) Bio')
 
 
@@ -0,0 +1,244 @@
+"""Rendered fragment cache for Warbler.
+
+Message cards and user cards look the same to every viewer, apart from
+the like or follow button. So the shared part is rendered once per
+(entity, version) from templates/fragments/, cached, and reused; the
+page's template fills in the per-viewer part through a `{% call %}` block:
+
+    {% call message_card(msg) %}
+      <form ...like button for this viewer...></form>
+    {% endcall %}
+
+Cards are cached under "message:<id>" / "user:<id>" along with the
+version they were rendered from (the author's or user's
+User.profile_version), so a changed profile simply misses the cache.
+That version only moves when the profile is edited: likes, follows and
+new messages bump User.version for the counters, which cards don't show,
+so a busy author's cards stay cached. Deleted messages and users are
+dropped with `forget()`.
+
+FRAGMENT_CACHE picks the backend:
+
+- "memory": an LRU dict in each process (the default)
+- "sqlite:////path/to/file.db": a SQLite file shared by every process on
+  the machine
+- "" / None: no caching (the default under testing, where ids and
+  versions repeat between tests with different data behind them)
+
+FRAGMENT_CACHE_SIZE caps the number of cards kept (default 10000).
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+DEFAULT_SIZE = 10000
+
+# Stands in for the per-viewer part of a card until it's filled in
+SLOT = '<!-- fragment slot -->'
+
+
+class MemoryBackend:
+    """Least-recently-used cache in this process."""
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """(version, html) cached for `key`, or None."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, version, html):
+        with self.lock:
+            self.entries[key] = (version, html)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteBackend:
+    """Cache in a SQLite file, shared by every process that opens it.
+
+    Evicts the oldest entries once it holds more than `size`.
+    """
+
+    # Check the size every this many writes rather than on each one
+    TRIM_EVERY = 100
+
+    def __init__(self, path, size=DEFAULT_SIZE):
+        self.path = path
+        self.size = size
+        self.local = threading.local()
+        self.writes = 0
+
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fragments ("
+                " key TEXT PRIMARY KEY,"
+                " version INTEGER NOT NULL,"
+                " html TEXT NOT NULL,"
+                " stored_at REAL NOT NULL)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_fragments_stored_at"
+                " ON fragments (stored_at)")
+
+    def connection(self):
+        """This thread's connection to the cache file."""
+
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        return self.connection().execute(
+            "SELECT version, html FROM fragments WHERE key = ?",
+            (key,)).fetchone()
+
+    def set(self, key, version, html):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?)",
+                (key, version, html, time.time()))
+
+        self.writes += 1
+        if self.writes % self.TRIM_EVERY == 0:
+            self.trim()
+
+    def trim(self):
+        with self.connection() as conn:
+            conn.execute(
+                "DELETE FROM fragments WHERE key IN ("
+                " SELECT key FROM fragments ORDER BY stored_at DESC"
+                " LIMIT -1 OFFSET ?)",
+                (self.size,))
+
+    def delete(self, *keys):
+        with self.connection() as conn:
+            conn.executemany("DELETE FROM fragments WHERE key = ?",
+                             [(key,) for key in keys])
+
+    def clear(self):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM fragments")
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def make_backend(setting, size=DEFAULT_SIZE):
+    if setting == 'memory':
+        return MemoryBackend(size)
+
+    if setting.startswith('sqlite:///'):
+        return SQLiteBackend(setting[len('sqlite:///'):], size)
+
+    raise ValueError(f"Unknown FRAGMENT_CACHE: {setting!r}")
+
+
+def backend():
+    """The configured cache backend, or None if caching is off."""
+
+    config = current_app.config
+    setting = config.get('FRAGMENT_CACHE',
+                         None if current_app.testing else 'memory')
+
+    if not setting:
+        return None
+
+    with _backends_lock:
+        if setting not in _backends:
+            _backends[setting] = make_backend(
+                setting, config.get('FRAGMENT_CACHE_SIZE', DEFAULT_SIZE))
+        return _backends[setting]
+
+
+def render(kind, entity_id, version, template, **context):
+    """`template` rendered with `context`, from the cache if it's current."""
+
+    cache = backend()
+    key = f"{kind}:{entity_id}"
+
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    html = render_template(template, slot=Markup(SLOT), **context)
+
+    if cache is not None:
+        cache.set(key, version, html)
+
+    return html
+
+
+def fill(html, caller):
+    """Put the caller's per-viewer markup into a card's slot."""
+
+    return Markup(html.replace(SLOT, caller() if caller else '', 1))
+
+
+def message_card(message, caller=None):
+    """A message's card (template global)."""
+
+    html = render('message', message.id, message.user.profile_version,
+                  'fragments/message-card.html', message=message)
+
+    return fill(html, caller)
+
+
+def user_card(user, caller=None):
+    """A user's card (template global)."""
+
+    html = render('user', user.id, user.profile_version,
+                  'fragments/user-card.html', user=user)
+
+    return fill(html, caller)
+
+
+def forget(kind, *entity_ids):
+    """Drop the cached cards for these deleted/changed entities."""
+
+    cache = backend()
+
+    if cache is not None and entity_ids:
+        cache.delete(*(f"{kind}:{entity_id}" for entity_id in entity_ids))
+
+
+def clear():
+    """Drop every cached card."""
+
+    cache = backend()
+
+    if cache is not None:
+        cache.clear()
+
+
+def init_app(app):
+    """Make message_card() and user_card() available to `app`'s templates."""
+
+    app.jinja_env.globals.update(message_card=message_card,
+                                 user_card=user_card)
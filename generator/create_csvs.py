@@ -2,13 +2,27 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for a load test:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 50000000 --likes 30000000 --seed 42
+
+Rows are written as they're generated, so memory use doesn't grow with the
+row counts, and the same seed always produces the same files. Nothing is
+fetched over the network.
+
+Follows and likes are skewed the way real ones are: a few users have most
+of the followers and a few messages get most of the likes, while how many
+people each user follows (or how much they like) has a long tail too.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import math
+import os
+from datetime import datetime
+from random import Random
+
 from faker import Faker
 from helpers import get_random_datetime
 
@@ -17,14 +31,32 @@ MAX_WARBLER_LENGTH = 140
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+NUM_LIKES = 3000
+
+# Timestamps fall in the two years before this, unless told otherwise, so
+# that a seed always gives the same files
+END_DATE = datetime(2024, 1, 1)
+
+# Nobody follows (or likes) more than this many things
+MAX_OUT_DEGREE = 5000
 
-fake = Faker()
+# Shape of the out-degree tail; lower is longer
+OUT_DEGREE_ALPHA = 2.0
 
-# Generate random profile image URLs to use for users
+# Share of edges that go to a uniformly random target instead of a popular
+# one, so that everyone gets *some* followers and likes
+UNIFORM_SHARE = 0.3
+
+# How many distinct fake words/names to draw rows from; rows pick from these
+# pools instead of calling Faker each time, which keeps big runs fast
+POOL_SIZE = 2000
+
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +64,189 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-
+# Header images ship with the app, so there's nothing to download
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    "/static/images/warbler-hero.jpg",
+    "/static/images/signed-out-home.jpg",
+    "/static/images/nav-bg.png",
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+class Popularity:
+    """Picks ids from 1..n with a Zipf-like (1/rank) skew.
+
+    Which ids are the popular ones is scrambled by a fixed permutation
+    (rank * step + offset, mod n), so popularity isn't tied to id order and
+    nothing needs to be stored per id.
+    """
+
+    def __init__(self, rng, n):
+        self.rng = rng
+        self.n = n
+        self.log_n = math.log(n + 1)
+        self.offset = rng.randrange(n)
+        self.step = rng.randrange(1, n + 1) if n > 1 else 1
+        while math.gcd(self.step, n) != 1:
+            self.step += 1
+
+    def pick(self):
+        if self.rng.random() < UNIFORM_SHARE:
+            return self.rng.randrange(self.n) + 1
+
+        rank = min(int(math.exp(self.rng.random() * self.log_n)), self.n) - 1
+        return (rank * self.step + self.offset) % self.n + 1
+
+
+def out_degrees(rng, sources, total, cap):
+    """Long-tailed per-source edge counts that add up to about `total`.
+
+    Each count is drawn from a Pareto distribution whose mean is whatever
+    is still left to hand out, spread over the sources still to come.
+    """
+
+    remaining = total
+
+    for left in range(sources, 0, -1):
+        mean = remaining / left
+        if mean <= 0:
+            yield 0
+            continue
+
+        scale = mean * (OUT_DEGREE_ALPHA - 1) / OUT_DEGREE_ALPHA
+        degree = min(round(scale * rng.paretovariate(OUT_DEGREE_ALPHA)),
+                     cap, remaining)
+        remaining -= degree
+        yield degree
+
+
+def edges(rng, num_sources, num_targets, total, exclude_self=False):
+    """Yield (source, target) pairs, no pair twice, about `total` in all.
+
+    Only one source's targets are held in memory at a time.
+    """
+
+    targets = Popularity(rng, num_targets)
+    cap = min(MAX_OUT_DEGREE, (num_targets - exclude_self) // 2)
+
+    for source, degree in enumerate(
+            out_degrees(rng, num_sources, total, cap), start=1):
+        picked = set()
+        while len(picked) < degree:
+            target = targets.pick()
+            if not (exclude_self and target == source):
+                picked.add(target)
+
+        for target in sorted(picked):
+            yield source, target
+
+
+def write_csv(path, headers, rows):
+    """Stream `rows` to `path`; returns how many were written."""
+
+    count = 0
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(headers)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+
+    return count
+
+
+def generate(out_dir='generator', num_users=NUM_USERS,
+             num_messages=NUM_MESSAGES, num_follows=NUM_FOLLOWS,
+             num_likes=NUM_LIKES, seed=0, end=END_DATE):
+    """Write users, messages, follows and likes CSVs to `out_dir`.
+
+    Returns {file name: rows written}.
+    """
+
+    fake = Faker()
+    fake.seed_instance(seed)
+
+    # Each file gets its own stream of randomness, so changing e.g. the
+    # number of likes doesn't change the users or messages
+    def rng_for(name):
+        return Random(f"{seed}:{name}")
+
+    user_names = [fake.user_name() for _ in range(POOL_SIZE)]
+    domains = [fake.free_email_domain() for _ in range(POOL_SIZE // 100)]
+    bios = [fake.sentence() for _ in range(POOL_SIZE)]
+    cities = [fake.city() for _ in range(POOL_SIZE)]
+    sentences = [fake.sentence() for _ in range(POOL_SIZE)]
+
+    def users(rng):
+        for i in range(1, num_users + 1):
+            # The id suffix keeps usernames and emails unique
+            username = f"{rng.choice(user_names)}{i}"
+            yield (f"{username}@{rng.choice(domains)}",
+                   username,
+                   rng.choice(image_urls),
+                   PASSWORD,
+                   rng.choice(bios),
+                   rng.choice(header_image_urls),
+                   rng.choice(cities))
+
+    def messages(rng):
+        # Some users post a lot more than others
+        authors = Popularity(rng, num_users)
+        for _ in range(num_messages):
+            text = ' '.join(rng.choice(sentences)
+                            for _ in range(rng.randint(1, 4)))
+            yield (text[:MAX_WARBLER_LENGTH],
+                   get_random_datetime(rng, end),
+                   authors.pick())
+
+    def follows(rng):
+        for follower, followed in edges(rng, num_users, num_users,
+                                        num_follows, exclude_self=True):
+            yield followed, follower
+
+    def likes(rng):
+        if num_messages:
+            yield from edges(rng, num_users, num_messages, num_likes)
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    files = [
+        ('users.csv', USERS_CSV_HEADERS, users),
+        ('messages.csv', MESSAGES_CSV_HEADERS, messages),
+        ('follows.csv', FOLLOWS_CSV_HEADERS, follows),
+        ('likes.csv', LIKES_CSV_HEADERS, likes),
+    ]
+
+    return {name: write_csv(os.path.join(out_dir, name), headers,
+                            rows(rng_for(name)))
+            for name, headers, rows in files}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate CSVs of random data for Warbler.")
+    parser.add_argument('--out', default='generator',
+                        help="directory to write the CSVs to")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS,
+                        help="roughly how many follows to make")
+    parser.add_argument('--likes', type=int, default=NUM_LIKES,
+                        help="roughly how many likes to make")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=datetime.fromisoformat, default=END_DATE,
+                        help="latest message timestamp (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+
+    written = generate(args.out, args.users, args.messages, args.follows,
+                       args.likes, args.seed, args.end)
+
+    for name, count in written.items():
+        print(f"{name}: {count} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,22 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from datetime import datetime, timedelta
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def years_before(moment, years):
+    """`moment`, `years` years earlier; Feb 29 becomes Feb 28 in other years."""
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    try:
+        return moment.replace(year=moment.year - years)
+    except ValueError:
+        return moment.replace(year=moment.year - years, day=28)
 
-    return datetime.fromtimestamp(random_timestamp)
+
+def get_random_datetime(rng, end=None, year_gap=2):
+    """Get a random datetime within the few years before `end` (default: now)."""
+
+    end = end or datetime.now()
+    start = years_before(end, year_gap)
+    seconds = rng.uniform(0, (end - start).total_seconds())
+
+    return start + timedelta(seconds=seconds)
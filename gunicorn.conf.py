@@ -0,0 +1,31 @@
+"""gunicorn settings for running Warbler in production:
+
+    gunicorn app:app
+
+(gunicorn picks this file up from the working directory.) Use
+`flask run` for development; it's threaded, so live updates poll there.
+
+Each worker process serves every connection on a greenlet (gevent), so
+the homepage's open /timeline/stream connections cost a socket each
+rather than a thread (see live.py). Database drivers block the whole
+process unless they yield to gevent, so psycopg2 is made to yield once
+the worker has started, and slow CPU work runs on real threads (see
+pools.py).
+
+WEB_CONCURRENCY sets the number of worker processes (gunicorn reads it
+itself; default 1), and WORKER_CONNECTIONS the connections each one
+takes at once, streams included.
+"""
+
+import os
+
+worker_class = 'gevent'
+
+# Room for live.GREENLET_MAX_STREAMS streams plus ordinary requests
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 10000))
+
+
+def post_worker_init(worker):
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
@@ -0,0 +1,251 @@
+"""Background jobs for Warbler.
+
+Work a write sets off that can grow with the size of the data (pushing a
+message into every follower's timeline, backfilling one after a follow)
+runs as a job instead of inside the request:
+
+    @jobs.handler('timeline.push_message')
+    def push_message_job(message_id):
+        ...
+
+    jobs.enqueue('timeline.push_message', message_id=msg.id,
+                 key=f"timeline.push_message:{msg.id}:{msg.timestamp.isoformat()}")
+    db.session.commit()
+
+`enqueue()` adds a row to the `jobs` table in the caller's transaction, so
+a job exists exactly when the write that needed it was committed. Workers
+(`flask run-jobs`) claim queued jobs, run the handler and mark the job
+done in one transaction; a handler that raises is rolled back and retried
+with exponential backoff, up to MAX_ATTEMPTS times, after which the job is
+left as failed. Handlers get retried, so they must be safe to run again
+from scratch, and should expect the rows they were queued for to be gone.
+
+Jobs enqueued with the same `key` only run once; without a key every
+enqueue is a separate job.
+
+With JOBS_SYNC on (the default under testing) `enqueue()` runs the handler
+right away in the caller's transaction instead, and keys are ignored.
+"""
+
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, delete, or_, select, update
+
+from models import db, Job
+
+# Attempts before a job is left as failed
+MAX_ATTEMPTS = 5
+
+# Delay before the first retry; doubles with each attempt after that
+BACKOFF_SECONDS = 10
+MAX_BACKOFF_SECONDS = 60 * 60
+
+# A job running for longer than this is assumed to have lost its worker
+LOCK_SECONDS = 10 * 60
+
+# How long an idle worker waits before looking for jobs again
+POLL_SECONDS = 1
+
+HANDLERS = {}
+
+
+class UnknownJob(Exception):
+    """A job's name has no handler."""
+
+
+def handler(name):
+    """Register the decorated function as the handler for `name` jobs."""
+
+    def register(fn):
+        HANDLERS[name] = fn
+        return fn
+
+    return register
+
+
+def is_sync():
+    return current_app.config.get('JOBS_SYNC', current_app.testing)
+
+
+def enqueue(name, key=None, **args):
+    """Queue a `name` job with these (JSON-able) keyword arguments.
+
+    Joins the caller's transaction; nothing runs until it's committed.
+    Returns False if a job with the same `key` was already queued.
+    """
+
+    if name not in HANDLERS:
+        raise UnknownJob(name)
+
+    if is_sync():
+        HANDLERS[name](**args)
+        return True
+
+    if key is None:
+        db.session.add(Job(name=name, args=args))
+        return True
+
+    return Job.insert_once(name=name, args=args, idempotency_key=key)
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed `attempts` times."""
+
+    delay = min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+
+    # Spread out retries of jobs that failed together
+    return delay * random.uniform(1, 1.25)
+
+
+def runnable(now):
+    """Condition for jobs a worker may claim at `now`."""
+
+    return or_(and_(Job.status == 'queued', Job.run_at <= now),
+               and_(Job.status == 'running',
+                    Job.locked_at < now - timedelta(seconds=LOCK_SECONDS)))
+
+
+def claim():
+    """Mark the next runnable job as running and return its id, or None.
+
+    On Postgres, concurrent workers skip each other's locked rows; the
+    conditional UPDATE makes sure only one of them gets a job either way.
+    """
+
+    while True:
+        now = datetime.utcnow()
+
+        job_id = db.session.scalar(
+            select(Job.id)
+            .where(runnable(now))
+            .order_by(Job.run_at, Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True))
+
+        if job_id is None:
+            db.session.rollback()
+            return None
+
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, runnable(now))
+            .values(status='running', locked_at=now,
+                    attempts=Job.attempts + 1))
+        db.session.commit()
+
+        if claimed.rowcount:
+            return job_id
+
+
+def run(job_id):
+    """Run a claimed job, then mark it done, or queued again, or failed."""
+
+    job = db.session.get(Job, job_id)
+
+    try:
+        if job.name not in HANDLERS:
+            raise UnknownJob(job.name)
+
+        HANDLERS[job.name](**job.args)
+
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        job.last_error = None
+        db.session.commit()
+
+    except Exception as exc:
+        db.session.rollback()
+        current_app.logger.exception("Job %s (%s) failed", job_id, job.name)
+
+        job = db.session.get(Job, job_id)
+        job.last_error = f"{type(exc).__name__}: {exc}"
+
+        if job.attempts >= MAX_ATTEMPTS or isinstance(exc, UnknownJob):
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = 'queued'
+            job.run_at = (datetime.utcnow()
+                          + timedelta(seconds=backoff(job.attempts)))
+
+        db.session.commit()
+
+
+def run_pending():
+    """Run jobs until none are runnable; returns how many were run."""
+
+    count = 0
+
+    while (job_id := claim()) is not None:
+        run(job_id)
+        count += 1
+
+    return count
+
+
+def work(app, workers=1, stop_when_idle=False, stop=None):
+    """Run jobs on `workers` threads until `stop` (a threading.Event) is set.
+
+    With `stop_when_idle`, each thread stops once there's nothing to run.
+    """
+
+    stop = stop or threading.Event()
+
+    def worker():
+        with app.app_context():
+            while not stop.is_set():
+                if run_pending() == 0:
+                    if stop_when_idle:
+                        return
+                    stop.wait(POLL_SECONDS)
+
+    threads = [threading.Thread(target=worker, name=f"jobs-{number}")
+               for number in range(workers)]
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=POLL_SECONDS)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def purge(days):
+    """Delete jobs that finished over `days` days ago; returns how many.
+
+    Their idempotency keys go with them.
+    """
+
+    cutoff = datetime.utcnow() - timedelta(days=days)
+
+    purged = db.session.execute(
+        delete(Job)
+        .where(Job.status.in_(('done', 'failed')),
+               Job.finished_at < cutoff))
+    db.session.commit()
+
+    return purged.rowcount
+
+
+def counts():
+    """{status: number of jobs}"""
+
+    return dict(db.session.execute(
+        select(Job.status, db.func.count()).group_by(Job.status)).all())
+
+
+def init_app(app):
+    """Run `app`'s jobs inline if JOBS_SYNC is set in the environment."""
+
+    if 'JOBS_SYNC' in os.environ:
+        app.config.setdefault('JOBS_SYNC',
+                              os.environ['JOBS_SYNC'] not in ('', '0'))
@@ -0,0 +1,292 @@
+"""Live timeline updates for Warbler.
+
+`/timeline/new?after=<id>` counts the timeline's messages newer than a
+message id; the homepage polls it to show a "N new warbles" link. Each
+poll is a short read, so polling clients never hold a server thread.
+
+`/timeline/stream` pushes the same thing as Server-Sent Events instead.
+An open stream is parked on its queue for as long as the browser stays on
+the page, so it needs a server that gives each connection a greenlet:
+gunicorn's gevent worker, which is how Warbler runs in production (see
+gunicorn.conf.py). There an idle stream costs a greenlet and a socket,
+not a thread, and each process takes up to GREENLET_MAX_STREAMS of them.
+On a threaded server (`flask run`) streaming is off and the homepage
+polls. LIVE_MAX_STREAMS overrides either limit; browsers beyond it get a
+204, which tells EventSource not to reconnect, and poll instead.
+
+The Hub is in-process pub/sub. Each open stream is a Subscriber with its
+own small queue; publishing puts the message id on the queues of the
+author's followers who have a stream open, and nothing else runs for idle
+streams.
+
+Each process only hears about messages posted through it. A stream that
+falls behind or reconnects (browsers send Last-Event-ID) is caught up
+from the timelines table, which every process writes to.
+"""
+
+import os
+import queue
+import threading
+from collections import defaultdict
+
+from flask import (Blueprint, Response, abort, current_app, g, jsonify,
+                   request)
+from sqlalchemy import func, select
+
+from models import db, Follows, TimelineEntry
+import pools
+import replicas
+
+# Open streams allowed per process, on a threaded server and under gevent;
+# 0 turns streaming off. The LIVE_MAX_STREAMS setting overrides both
+MAX_STREAMS = 0
+GREENLET_MAX_STREAMS = 8000
+
+# Seconds between keep-alive comments on an idle stream; the
+# LIVE_HEARTBEAT_SECONDS setting overrides it
+HEARTBEAT_SECONDS = 20
+
+# Messages a stream can fall behind by before it's told to catch up
+QUEUE_SIZE = 100
+
+# Connected follower ids looked up per query when publishing
+FOLLOWER_BATCH = 1000
+
+# Count no further than this for the "N new warbles" banner
+MAX_NEW_COUNT = 100
+
+# Sent instead of a message id when a stream's queue overflowed
+RESYNC = object()
+
+live = Blueprint('live', __name__)
+
+
+class Subscriber:
+    """One open stream for `user_id`."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    def deliver(self, message_id):
+        try:
+            self.queue.put_nowait(message_id)
+        except queue.Full:
+            # Too far behind; swap the backlog for one catch-up marker
+            self.drain()
+            self.queue.put_nowait(RESYNC)
+
+    def drain(self):
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def next(self, timeout):
+        """Next message id (or RESYNC), or None after `timeout` seconds."""
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Hub:
+    """Open streams by user id."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id, limit=None):
+        """A new Subscriber for `user_id`, or None if `limit` streams are open."""
+
+        subscriber = Subscriber(user_id)
+
+        with self.lock:
+            if limit is not None and self.count >= limit:
+                return None
+
+            self.subscribers[user_id].add(subscriber)
+            self.count += 1
+
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            streams = self.subscribers.get(subscriber.user_id)
+            if streams is not None and subscriber in streams:
+                streams.discard(subscriber)
+                self.count -= 1
+                if not streams:
+                    del self.subscribers[subscriber.user_id]
+
+    def connected_user_ids(self):
+        with self.lock:
+            return list(self.subscribers)
+
+    def deliver(self, user_ids, message_id):
+        """Send `message_id` to every open stream of these users."""
+
+        with self.lock:
+            streams = [subscriber
+                       for user_id in user_ids
+                       for subscriber in self.subscribers.get(user_id, ())]
+
+        for subscriber in streams:
+            subscriber.deliver(message_id)
+
+
+hub = Hub()
+
+
+def publish(message):
+    """Tell the author's connected followers about a committed `message`."""
+
+    connected = hub.connected_user_ids()
+
+    for start in range(0, len(connected), FOLLOWER_BATCH):
+        followers = db.session.scalars(
+            select(Follows.user_following_id)
+            .where(Follows.user_being_followed_id == message.user_id,
+                   Follows.user_following_id.in_(
+                       connected[start:start + FOLLOWER_BATCH])))
+
+        hub.deliver(list(followers), message.id)
+
+
+def newer_than(user_id, message_id, limit=MAX_NEW_COUNT):
+    """Ids of `user_id`'s timeline messages newer than `message_id`, oldest first."""
+
+    return db.session.scalars(
+        select(TimelineEntry.message_id)
+        .where(TimelineEntry.user_id == user_id,
+               TimelineEntry.message_id > message_id)
+        .order_by(TimelineEntry.message_id)
+        .limit(limit)).all()
+
+
+def count_newer(user_id, message_id):
+    """How many (up to MAX_NEW_COUNT) timeline messages are newer than `message_id`."""
+
+    newer = (select(TimelineEntry.message_id)
+             .where(TimelineEntry.user_id == user_id,
+                    TimelineEntry.message_id > message_id)
+             .limit(MAX_NEW_COUNT)
+             .subquery())
+
+    return db.session.scalar(select(func.count()).select_from(newer))
+
+
+def event(message_id):
+    return f"id: {message_id}\nevent: warble\ndata: {message_id}\n\n"
+
+
+def stream(subscriber, backlog, heartbeat=HEARTBEAT_SECONDS):
+    """The SSE body for `subscriber`, starting with the `backlog` message ids.
+
+    Doesn't touch the database or the request, so it can outlive both.
+    After an overflow the client gets a "resync" event and should catch up
+    with /timeline/new.
+    """
+
+    yield f"retry: {heartbeat * 1000}\n\n"
+
+    for message_id in backlog:
+        yield event(message_id)
+
+    while True:
+        message_id = subscriber.next(timeout=heartbeat)
+
+        if message_id is None:
+            yield ": keep-alive\n\n"
+        elif message_id is RESYNC:
+            yield "event: resync\ndata: \n\n"
+        else:
+            yield event(message_id)
+
+
+##############################################################################
+# Routes
+
+
+def max_streams():
+    default = GREENLET_MAX_STREAMS if pools.greenlets() else MAX_STREAMS
+
+    return int(current_app.config.get('LIVE_MAX_STREAMS', default))
+
+
+def streaming_enabled():
+    """Should pages try /timeline/stream before polling? (template global)"""
+
+    return max_streams() > 0
+
+
+def after_param():
+    """The message id to start after, from Last-Event-ID or `after`."""
+
+    after = request.headers.get('Last-Event-ID') or request.args.get('after')
+
+    try:
+        return int(after) if after else None
+    except ValueError:
+        abort(400)
+
+
+@live.route('/timeline/stream')
+def timeline_stream():
+    """Stream the ids of new messages on the logged-in user's timeline.
+
+    204 if streaming is off or full; the client should poll instead.
+    """
+
+    if not g.user:
+        abort(401)
+
+    after = after_param()
+    heartbeat = current_app.config.get('LIVE_HEARTBEAT_SECONDS',
+                                       HEARTBEAT_SECONDS)
+
+    # Subscribe before reading the backlog so nothing falls in between
+    subscriber = hub.subscribe(g.user.id, limit=max_streams())
+    if subscriber is None:
+        return Response(status=204)
+
+    backlog = newer_than(g.user.id, after) if after is not None else []
+
+    resp = Response(stream(subscriber, backlog, heartbeat),
+                    mimetype='text/event-stream')
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.call_on_close(lambda: hub.unsubscribe(subscriber))
+
+    return resp
+
+
+@live.route('/timeline/new')
+@replicas.reads_from_replica
+def timeline_new():
+    """How many timeline messages are newer than `after`, as JSON."""
+
+    if not g.user:
+        abort(401)
+
+    after = after_param()
+
+    if after is None:
+        abort(400)
+
+    return jsonify(count=count_newer(g.user.id, after),
+                   max=MAX_NEW_COUNT)
+
+
+def init_app(app):
+    """Register the live routes; LIVE_MAX_STREAMS can come from the environment."""
+
+    if 'LIVE_MAX_STREAMS' in os.environ:
+        app.config.setdefault('LIVE_MAX_STREAMS',
+                              int(os.environ['LIVE_MAX_STREAMS']))
+
+    app.register_blueprint(live)
+    app.jinja_env.globals['live_streaming'] = streaming_enabled
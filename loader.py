@@ -0,0 +1,178 @@
+"""Bulk loader for the generator CSVs.
+
+Streams each CSV straight into the database without building ORM objects
+or per-row dicts:
+
+- Postgres: `COPY ... FROM STDIN`, fed from the open file.
+- Anything else (SQLite): csv.reader into DBAPI executemany() in batches.
+
+Tables are created without their secondary indexes (and, on Postgres,
+without foreign keys); those are added once the data is in, which is much
+cheaper than maintaining them row by row. Users load first, then messages
+and follows (in parallel on Postgres), then likes.
+
+Run it through seed.py.
+"""
+
+import csv
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from sqlalchemy import DDL, text
+from sqlalchemy.schema import AddConstraint, CreateTable
+
+from models import db
+import counters
+import migrations
+
+# Rows per executemany() batch on the fallback path
+BATCH_SIZE = 10000
+
+# Each stage only depends on the stages before it
+STAGES = (
+    ('users',),
+    ('messages', 'follows'),
+    ('likes',),
+)
+
+Loaded = namedtuple('Loaded', ['table', 'rows', 'seconds'])
+
+
+def is_postgres(engine):
+    return engine.dialect.name == 'postgresql'
+
+
+def create_bare_schema(engine):
+    """Drop everything and create the tables without indexes or FKs.
+
+    SQLite can't add foreign keys to an existing table, so there they're
+    created up front (SQLite doesn't enforce them by default anyway).
+    """
+
+    db.metadata.drop_all(engine)
+    migrations.schema_migrations.drop(engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if is_postgres(engine):
+                conn.execute(CreateTable(table,
+                                         include_foreign_key_constraints=[]))
+            else:
+                conn.execute(CreateTable(table))
+
+
+def add_indexes_and_keys(engine):
+    """Create the indexes and foreign keys create_bare_schema() left out."""
+
+    with engine.begin() as conn:
+        if is_postgres(engine):
+            conn.execute(DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+            for table in db.metadata.sorted_tables:
+                for fk in table.foreign_key_constraints:
+                    conn.execute(AddConstraint(fk))
+
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                # Skips the Postgres-only indexes elsewhere
+                index.create(conn)
+
+
+def copy_csv(engine, table, path):
+    """Stream `path` into `table`; returns the number of rows loaded.
+
+    Works on a raw DBAPI connection of its own, so it's safe to call from
+    a worker thread.
+    """
+
+    with open(path, newline='') as csv_file:
+        columns = next(csv.reader(csv_file))
+        csv_file.seek(0)
+
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+
+            if is_postgres(engine):
+                cursor.copy_expert(
+                    f"COPY {table} ({', '.join(columns)}) "
+                    "FROM STDIN WITH (FORMAT csv, HEADER true)",
+                    csv_file)
+                rows = cursor.rowcount
+
+            else:
+                reader = csv.reader(csv_file)
+                next(reader)
+                insert = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                          f"VALUES ({', '.join('?' for _ in columns)})")
+                rows = 0
+                while batch := list(islice(reader, BATCH_SIZE)):
+                    cursor.executemany(insert, batch)
+                    rows += len(batch)
+
+            raw.commit()
+
+        finally:
+            raw.close()
+
+    return rows
+
+
+def load_table(engine, table, directory):
+    started = time.perf_counter()
+    rows = copy_csv(engine, table, os.path.join(directory, f"{table}.csv"))
+
+    return Loaded(table, rows, time.perf_counter() - started)
+
+
+def load(directory='generator', parallel=True, report=print):
+    """Recreate the database from the CSVs in `directory`.
+
+    Tables without a CSV are left empty. `report` gets a line of progress
+    per table. Returns a list of Loaded results.
+    """
+
+    started = time.perf_counter()
+    results = []
+    engine = db.engine
+
+    create_bare_schema(engine)
+
+    # Parallel loads would just queue on SQLite's single writer
+    workers = 2 if parallel and is_postgres(engine) else 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for stage in STAGES:
+            tables = [table for table in stage
+                      if os.path.exists(os.path.join(directory, f"{table}.csv"))]
+
+            for loaded in pool.map(
+                    lambda table: load_table(engine, table, directory), tables):
+                report(f"{loaded.table}: {loaded.rows} rows in "
+                       f"{loaded.seconds:.2f}s "
+                       f"({loaded.rows / max(loaded.seconds, 1e-9):,.0f} rows/sec)")
+                results.append(loaded)
+
+    index_started = time.perf_counter()
+    add_indexes_and_keys(engine)
+    report(f"indexes and keys: {time.perf_counter() - index_started:.2f}s")
+
+    # The CSVs don't carry the profile counters, so work them out now
+    counters.reconcile()
+    db.session.commit()
+
+    # The schema is already current, so this just records that
+    migrations.upgrade()
+
+    with engine.begin() as conn:
+        conn.execute(text('ANALYZE'))
+
+    total_rows = sum(loaded.rows for loaded in results)
+    total_seconds = time.perf_counter() - started
+    report(f"total: {total_rows} rows in {total_seconds:.2f}s "
+           f"({total_rows / max(total_seconds, 1e-9):,.0f} rows/sec)")
+
+    return results
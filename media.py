@@ -0,0 +1,227 @@
+"""Uploaded profile images for Warbler.
+
+Avatars and header images can be uploaded instead of linked. An upload is
+decoded once and resized into fixed-size variants, each saved as WebP and
+JPEG:
+
+- timeline: 96x96, for timeline rows and the navbar (shown at 48px)
+- card: 400x400, for user cards and profile pages
+- hero: 1200x400, for header images
+
+Files are stored under MEDIA_FOLDER by a hash of the uploaded bytes, so
+uploading the same picture twice stores it once, and a stored file never
+changes. The user's image_url is /media/<hash>/card (or /hero); templates
+pick the size they need with the `image` filter:
+
+    <img src="{{ user.image_url|image('timeline') }}">
+
+which leaves linked (non-uploaded) images alone. /media/ serves WebP to
+browsers that accept it and JPEG to the rest, cached for a year.
+
+Decoding and resizing run on a small, bounded pool of threads (see
+pools.py), never on the request thread that received the upload.
+
+Config:
+
+- MEDIA_FOLDER: where images are stored (default: media/ next to app.py)
+- MEDIA_WORKERS: how many images can be resized at once (default 2)
+"""
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+from flask import abort, request, send_from_directory
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+import metrics
+import pools
+from assets import IMMUTABLE
+
+URL_PREFIX = '/media'
+
+# name: (width, height); images are cropped to fill
+VARIANTS = {
+    'timeline': (96, 96),
+    'card': (400, 400),
+    'hero': (1200, 400),
+}
+
+# Bump to store new variants under new names after changing the above
+VARIANTS_VERSION = b'1'
+
+# format: (Pillow format, file extension, save options)
+FORMATS = {
+    'image/webp': ('WEBP', '.webp', {'quality': 80, 'method': 4}),
+    'image/jpeg': ('JPEG', '.jpg', {'quality': 85, 'optimize': True,
+                                    'progressive': True}),
+}
+
+# Biggest upload accepted, and biggest image decoded
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+MAX_PIXELS = 40_000_000
+
+ACCEPTED_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+DEFAULT_WORKERS = 2
+
+MEDIA_URL = re.compile(rf'^{URL_PREFIX}/([0-9a-f]{{64}})/(\w+)$')
+
+_pool = pools.Pool('media', 'MEDIA_WORKERS', DEFAULT_WORKERS)
+
+
+class InvalidImage(Exception):
+    """An upload isn't an image we can use."""
+
+
+##############################################################################
+# Storing
+
+
+def media_folder():
+    return pools.config('MEDIA_FOLDER',
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     'media'))
+
+
+def digest(data):
+    """The name an upload is stored under."""
+
+    return hashlib.sha256(VARIANTS_VERSION + data).hexdigest()
+
+
+def variant_path(folder, name, variant, mimetype):
+    """Where a variant is stored, relative to `folder` if it's None."""
+
+    path = os.path.join(name[:2], name, variant + FORMATS[mimetype][1])
+
+    return path if folder is None else os.path.join(folder, path)
+
+
+def _write(path, data):
+    """Write `data` to `path` all at once, so readers never see half a file."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _resize(data, folder, name):
+    """Decode `data` and save all its variants. Runs on the media pool."""
+
+    try:
+        image = Image.open(io.BytesIO(data))
+
+        if image.format not in ACCEPTED_FORMATS:
+            raise InvalidImage("Upload a JPEG, PNG, GIF or WebP image.")
+        if image.width * image.height > MAX_PIXELS:
+            raise InvalidImage("That image is too large.")
+
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise InvalidImage("That file isn't an image we can read.")
+
+    for variant, size in VARIANTS.items():
+        resized = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+
+        for mimetype, (fmt, _, options) in FORMATS.items():
+            out = io.BytesIO()
+            resized.save(out, fmt, **options)
+            _write(variant_path(folder, name, variant, mimetype), out.getvalue())
+
+
+def stored(folder, name):
+    return all(os.path.exists(variant_path(folder, name, variant, mimetype))
+               for variant in VARIANTS for mimetype in FORMATS)
+
+
+def save(upload):
+    """Store an uploaded image (a werkzeug FileStorage); returns its name.
+
+    Raises InvalidImage if it's too big or not an image.
+    """
+
+    data = upload.stream.read(MAX_UPLOAD_BYTES + 1)
+
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise InvalidImage("Images can be at most "
+                           f"{MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    if not data:
+        raise InvalidImage("That file is empty.")
+
+    folder = media_folder()
+    name = digest(data)
+
+    if not stored(folder, name):
+        with metrics.span('image_resize', bytes=len(data)):
+            _pool.submit(_resize, data, folder, name).result()
+
+    return name
+
+
+def save_url(upload, variant):
+    """Store an uploaded image and return its URL for `variant`."""
+
+    return f"{URL_PREFIX}/{save(upload)}/{variant}"
+
+
+##############################################################################
+# Serving
+
+
+def image_variant(url, variant):
+    """The URL of `variant` of an uploaded image; other URLs as they are."""
+
+    match = MEDIA_URL.match(url or '')
+
+    if match is None or variant not in VARIANTS:
+        return url
+
+    return f"{URL_PREFIX}/{match.group(1)}/{variant}"
+
+
+def best_format():
+    """WebP if the browser says it takes it, else JPEG."""
+
+    if 'image/webp' in request.accept_mimetypes.values():
+        return 'image/webp'
+
+    return 'image/jpeg'
+
+
+def serve_media(name, variant):
+    """A stored variant in the best format for the browser."""
+
+    if not re.fullmatch(r'[0-9a-f]{64}', name) or variant not in VARIANTS:
+        abort(404)
+
+    mimetype = best_format()
+    resp = send_from_directory(media_folder(),
+                               variant_path(None, name, variant, mimetype),
+                               mimetype=mimetype)
+
+    resp.vary.add('Accept')
+    resp.headers['Cache-Control'] = IMMUTABLE
+
+    return resp
+
+
+def init_app(app):
+    """Serve stored images under /media and add the `image` filter."""
+
+    if 'MEDIA_FOLDER' in os.environ:
+        app.config.setdefault('MEDIA_FOLDER', os.environ['MEDIA_FOLDER'])
+
+    app.add_url_rule(f"{URL_PREFIX}/<name>/<variant>", 'media', serve_media)
+    app.jinja_env.filters['image'] = image_variant
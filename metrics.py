@@ -0,0 +1,404 @@
+"""Metrics and request tracing for Warbler.
+
+GET /metrics serves this process's metrics in the Prometheus text format:
+
+- warbler_request_seconds{endpoint,method,status}: request latency
+- warbler_request_sql_seconds{endpoint}: time in SQL per request
+- warbler_request_render_seconds{endpoint}: time rendering templates per
+  request (including any queries the templates trigger)
+- warbler_sql_statement_seconds: latency of single statements
+- warbler_db_pool_wait_seconds: waits for a pooled database connection
+- warbler_db_pool_checked_out: connections in use right now
+- warbler_bcrypt_seconds{operation}, warbler_bcrypt_queue_seconds: time
+  hashing/checking passwords, and waiting for the bcrypt pool
+- warbler_bcrypt_queued: password operations waiting right now
+
+Each process keeps its own numbers, so with several workers each scrape
+sees one of them; label them by instance when scraping. /metrics itself
+has no login, so keep it off the public internet at the proxy.
+
+A sample of requests is also traced: at the end of a sampled request one
+JSON line goes to the "warbler.trace" logger, with the request's timings
+and a span for every SQL statement, template render and bcrypt call, plus
+anything a view adds with `annotate()`. The sample rate is the number in
+the file named by TRACE_SAMPLE_FILE (0 to 1; no file means 0), re-read
+every few seconds, so tracing can be turned up and down on running
+servers:
+
+    echo 0.05 > /var/run/warbler/trace-sample-rate
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import (Response, current_app, g, has_app_context,
+                   has_request_context, request, template_rendered,
+                   before_render_template)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+DEFAULT_TRACE_SAMPLE_FILE = '/tmp/warbler-trace-sample-rate'
+
+# How often the sample rate file is re-read
+SAMPLE_FILE_CHECK_SECONDS = 5
+
+# Longest statement text kept in a span
+SPAN_SQL_LENGTH = 200
+
+trace_logger = logging.getLogger('warbler.trace')
+
+
+##############################################################################
+# Metric types
+
+
+def escape(value):
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{name}="{escape(value)}"'
+                          for name, value in labels) + '}'
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count, per set of label values."""
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+
+        with self.lock:
+            counts = self.series.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, then the sum
+                counts = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+
+        with self.lock:
+            series = {key: list(counts) for key, counts in self.series.items()}
+
+        for key, counts in sorted(series.items()):
+            labels = list(zip(self.labels, key))
+
+            for bound, count in zip(self.buckets, counts):
+                yield (f"{self.name}_bucket"
+                       f"{format_labels(labels + [('le', repr(bound))])} {count}")
+            yield (f"{self.name}_bucket"
+                   f"{format_labels(labels + [('le', '+Inf')])} {counts[-2]}")
+            yield f"{self.name}_sum{format_labels(labels)} {counts[-1]}"
+            yield f"{self.name}_count{format_labels(labels)} {counts[-2]}"
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+class Gauge:
+    """A value read when the metrics are scraped."""
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.read()}"
+
+    def clear(self):
+        pass
+
+
+REQUEST_SECONDS = Histogram(
+    'warbler_request_seconds', "Request latency.",
+    ('endpoint', 'method', 'status'))
+REQUEST_SQL_SECONDS = Histogram(
+    'warbler_request_sql_seconds', "Time spent in SQL per request.",
+    ('endpoint',))
+REQUEST_RENDER_SECONDS = Histogram(
+    'warbler_request_render_seconds', "Time spent rendering templates per request.",
+    ('endpoint',))
+SQL_STATEMENT_SECONDS = Histogram(
+    'warbler_sql_statement_seconds', "Latency of single SQL statements.")
+POOL_WAIT_SECONDS = Histogram(
+    'warbler_db_pool_wait_seconds', "Wait for a pooled database connection.")
+BCRYPT_SECONDS = Histogram(
+    'warbler_bcrypt_seconds', "Time hashing or checking a password.",
+    ('operation',))
+BCRYPT_QUEUE_SECONDS = Histogram(
+    'warbler_bcrypt_queue_seconds', "Wait for a bcrypt pool thread.")
+
+
+def _pool_checked_out():
+    if not has_app_context():
+        return 0
+
+    pool = current_app.extensions['sqlalchemy'].engine.pool
+    return pool.checkedout() if isinstance(pool, QueuePool) else 0
+
+
+def _bcrypt_queued():
+    import passwords
+
+    return passwords.stats()['queued']
+
+
+METRICS = [
+    REQUEST_SECONDS,
+    REQUEST_SQL_SECONDS,
+    REQUEST_RENDER_SECONDS,
+    SQL_STATEMENT_SECONDS,
+    POOL_WAIT_SECONDS,
+    Gauge('warbler_db_pool_checked_out', "Database connections in use.",
+          _pool_checked_out),
+    BCRYPT_SECONDS,
+    BCRYPT_QUEUE_SECONDS,
+    Gauge('warbler_bcrypt_queued', "Password operations waiting for a thread.",
+          _bcrypt_queued),
+]
+
+
+def render():
+    """Every metric in the Prometheus text format."""
+
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+def clear():
+    """Forget everything observed so far."""
+
+    for metric in METRICS:
+        metric.clear()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+
+##############################################################################
+# Tracing
+
+
+class SampleRate:
+    """The trace sample rate from a file, re-read every few seconds."""
+
+    def __init__(self):
+        self.path = None
+        self.rate = 0.0
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        now = time.monotonic()
+
+        with self.lock:
+            if path != self.path or now - self.checked_at > SAMPLE_FILE_CHECK_SECONDS:
+                self.path = path
+                self.checked_at = now
+                self.rate = self.read(path)
+
+            return self.rate
+
+    @staticmethod
+    def read(path):
+        try:
+            with open(path) as rate_file:
+                return min(1.0, max(0.0, float(rate_file.read().strip() or 0)))
+        except (OSError, ValueError):
+            return 0.0
+
+
+sample_rate = SampleRate()
+
+
+def trace_sample_rate():
+    path = current_app.config.get('TRACE_SAMPLE_FILE', DEFAULT_TRACE_SAMPLE_FILE)
+    return sample_rate.get(path)
+
+
+def current_trace():
+    """The sampled request's trace dict, or None."""
+
+    if has_request_context():
+        return g.get('trace')
+
+    return None
+
+
+def add_span(name, seconds, **attrs):
+    """Record a finished span on the current trace, if it's sampled."""
+
+    trace = current_trace()
+
+    if trace is not None:
+        trace['spans'].append({'name': name,
+                               'ms': round(seconds * 1000, 3),
+                               **attrs})
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as a span on the current trace, if it's sampled."""
+
+    if current_trace() is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - started, **attrs)
+
+
+def annotate(**attrs):
+    """Add these attributes to the current trace, if it's sampled."""
+
+    trace = current_trace()
+
+    if trace is not None:
+        trace['attrs'].update(attrs)
+
+
+##############################################################################
+# Hooks
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started:
+        return
+
+    seconds = time.perf_counter() - started.pop()
+    SQL_STATEMENT_SECONDS.observe(seconds)
+
+    if has_request_context() and 'sql_seconds' in g:
+        g.sql_seconds += seconds
+        add_span('sql', seconds, statement=statement[:SPAN_SQL_LENGTH])
+
+
+def _before_render(sender, template, context, **extra):
+    if has_request_context() and 'render_depth' in g:
+        if g.render_depth == 0:
+            g.render_started = time.perf_counter()
+        g.render_depth += 1
+
+
+def _after_render(sender, template, context, **extra):
+    if has_request_context() and g.get('render_depth'):
+        g.render_depth -= 1
+        if g.render_depth == 0:
+            seconds = time.perf_counter() - g.render_started
+            g.render_seconds += seconds
+            add_span('render', seconds, template=template.name)
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.sql_seconds = 0.0
+    g.render_seconds = 0.0
+    g.render_depth = 0
+
+    rate = trace_sample_rate()
+    if rate and random.random() < rate:
+        g.trace = {'trace_id': uuid.uuid4().hex, 'attrs': {}, 'spans': []}
+
+
+def note_status(resp):
+    g.response_status = resp.status_code
+    return resp
+
+
+def finish_request(exc=None):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+
+    seconds = time.perf_counter() - started
+    endpoint = request.endpoint or 'none'
+    status = g.get('response_status', 500)
+
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint,
+                            method=request.method, status=status)
+    REQUEST_SQL_SECONDS.observe(g.sql_seconds, endpoint=endpoint)
+    REQUEST_RENDER_SECONDS.observe(g.render_seconds, endpoint=endpoint)
+
+    trace = g.pop('trace', None)
+    if trace is not None:
+        trace_logger.info(json.dumps({
+            'trace_id': trace['trace_id'],
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': status,
+            'ms': round(seconds * 1000, 3),
+            'sql_ms': round(g.sql_seconds * 1000, 3),
+            'render_ms': round(g.render_seconds * 1000, 3),
+            **trace['attrs'],
+            'spans': trace['spans'],
+        }, default=str))
+
+
+def metrics_view():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Measure `app`'s requests and serve the results at /metrics."""
+
+    app.before_request(start_request)
+    app.after_request(note_status)
+    app.teardown_request(finish_request)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,334 @@
+"""Versioned schema migrations for Warbler.
+
+Each migration has a version number and a function that changes the
+schema in place, keeping data. Applied versions are recorded in the
+`schema_migrations` table, and `upgrade()` runs whatever is missing, each
+in its own transaction. A brand new database is simply created from the
+models and stamped as fully migrated.
+
+Migrations check the schema before changing it, so running one against a
+database that already has the change (e.g. made by `db.create_all()`) is
+harmless.
+
+Run them with `flask db-upgrade`. `flask check-indexes` EXPLAINs the hot
+page queries and fails if any of them would scan a whole table.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Integer, MetaData, Table, Text,
+                        inspect, text)
+
+from models import db, Follows, Job, Likes, Message, TimelineEntry, User
+import counters
+import timeline
+
+Migration = namedtuple('Migration', ['version', 'description', 'run'])
+
+MIGRATIONS = []
+
+schema_migrations = Table(
+    'schema_migrations',
+    MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', Text, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def migration(version, description):
+    """Register the decorated function as migration `version`."""
+
+    def register(fn):
+        MIGRATIONS.append(Migration(version, description, fn))
+        MIGRATIONS.sort()
+        return fn
+
+    return register
+
+
+##############################################################################
+# Helpers for looking at the current schema
+
+
+def dialect_name():
+    return db.session.connection().dialect.name
+
+
+def has_table(table):
+    return inspect(db.session.connection()).has_table(table)
+
+
+def has_column(table, column):
+    columns = inspect(db.session.connection()).get_columns(table)
+    return any(col['name'] == column for col in columns)
+
+
+def has_index(table, name):
+    indexes = inspect(db.session.connection()).get_indexes(table)
+    return any(index['name'] == name for index in indexes)
+
+
+def model_index(model, name):
+    """The Index called `name` declared on `model`'s table."""
+
+    return next(index for index in model.__table__.indexes
+                if index.name == name)
+
+
+def create_index(model, name):
+    """Create one of a model's declared indexes, unless it's already there."""
+
+    if not has_index(model.__tablename__, name):
+        model_index(model, name).create(db.session.connection())
+
+
+##############################################################################
+# The migrations, oldest first
+
+
+@migration(1, "Add timelines table")
+def add_timelines():
+    TimelineEntry.__table__.create(db.session.connection(), checkfirst=True)
+
+
+@migration(2, "Add profile counter columns to users")
+def add_user_counters():
+    added = False
+
+    for column in ('messages_count', 'following_count',
+                   'followers_count', 'likes_count'):
+        if not has_column('users', column):
+            db.session.execute(text(
+                f"ALTER TABLE users ADD COLUMN {column} "
+                "INTEGER NOT NULL DEFAULT 0"))
+            added = True
+
+    if added:
+        counters.reconcile(bump_version=False)
+
+
+@migration(3, "Add user and message search indexes")
+def add_search_indexes():
+    # Both indexes are Postgres-only; other databases search without them
+    if dialect_name() != 'postgresql':
+        return
+
+    db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    create_index(User, 'ix_users_username_trgm')
+    create_index(Message, 'ix_messages_text_fts')
+
+
+@migration(4, "Key likes on (user_id, message_id)")
+def rework_likes():
+    if not has_column('likes', 'id'):
+        return
+
+    # Build the new table alongside the old one, copy the likes over, then
+    # swap it in
+    db.session.execute(text(
+        "CREATE TABLE likes_new ("
+        " user_id INTEGER NOT NULL"
+        "  REFERENCES users (id) ON DELETE CASCADE,"
+        " message_id INTEGER NOT NULL"
+        "  REFERENCES messages (id) ON DELETE CASCADE,"
+        " PRIMARY KEY (user_id, message_id))"))
+
+    db.session.execute(text(
+        "INSERT INTO likes_new (user_id, message_id)"
+        " SELECT DISTINCT user_id, message_id FROM likes"
+        " WHERE user_id IS NOT NULL AND message_id IS NOT NULL"))
+
+    db.session.execute(text("DROP TABLE likes"))
+    db.session.execute(text("ALTER TABLE likes_new RENAME TO likes"))
+
+    if dialect_name() == 'postgresql':
+        db.session.execute(text("ALTER INDEX likes_new_pkey RENAME TO likes_pkey"))
+
+    create_index(Likes, 'ix_likes_message_id')
+
+
+@migration(5, "Add indexes for the timeline, profile and follow queries")
+def add_hot_path_indexes():
+    create_index(Message, 'ix_messages_user_id_timestamp')
+    create_index(Follows, 'ix_follows_user_following_id')
+    create_index(TimelineEntry, 'ix_timelines_user_id_timestamp')
+
+
+@migration(6, "Add users.version for conditional GETs")
+def add_user_version():
+    if not has_column('users', 'version'):
+        db.session.execute(text(
+            "ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+
+@migration(7, "Add jobs table for background work")
+def add_jobs():
+    Job.__table__.create(db.session.connection(), checkfirst=True)
+
+
+@migration(8, "Add users.timeline_built_at")
+def add_timeline_built_at():
+    if has_column('users', 'timeline_built_at'):
+        return
+
+    db.session.execute(text(
+        "ALTER TABLE users ADD COLUMN timeline_built_at TIMESTAMP"))
+
+    # Timelines with entries were built one way or another; the rest get
+    # rebuilt once, on their next homepage view
+    db.session.execute(
+        db.update(User)
+        .where(db.exists().where(TimelineEntry.user_id == User.id))
+        .values(timeline_built_at=datetime.utcnow()))
+
+
+@migration(9, "Add username prefix index for autocomplete")
+def add_username_prefix_index():
+    # text_pattern_ops is Postgres-only
+    if dialect_name() != 'postgresql':
+        return
+
+    create_index(User, 'ix_users_username_lower_prefix')
+
+
+@migration(10, "Add users.profile_version for the fragment cache")
+def add_profile_version():
+    if not has_column('users', 'profile_version'):
+        db.session.execute(text(
+            "ALTER TABLE users ADD COLUMN profile_version INTEGER NOT NULL"
+            " DEFAULT 1"))
+
+
+##############################################################################
+# Running migrations
+
+
+def applied_versions():
+    """Versions already applied to this database."""
+
+    schema_migrations.create(db.session.connection(), checkfirst=True)
+
+    return set(db.session.scalars(db.select(schema_migrations.c.version)))
+
+
+def stamp(step):
+    """Record `step` as applied."""
+
+    db.session.execute(schema_migrations.insert().values(
+        version=step.version,
+        description=step.description,
+        applied_at=datetime.utcnow()))
+
+
+def upgrade(target=None):
+    """Apply every pending migration up to `target` (default: all of them).
+
+    Returns the migrations that were applied.
+    """
+
+    if not has_table('users'):
+        # Nothing here yet: create the current schema and call it migrated
+        db.metadata.create_all(db.session.connection())
+        applied_versions()
+        for step in MIGRATIONS:
+            stamp(step)
+        db.session.commit()
+        return list(MIGRATIONS)
+
+    done = applied_versions()
+    db.session.commit()
+
+    applied = []
+    for step in MIGRATIONS:
+        if step.version in done:
+            continue
+        if target is not None and step.version > target:
+            break
+
+        step.run()
+        stamp(step)
+        db.session.commit()
+        applied.append(step)
+
+    return applied
+
+
+def current_version():
+    """Highest migration applied to this database, or 0."""
+
+    done = applied_versions()
+    db.session.commit()
+
+    return max(done, default=0)
+
+
+##############################################################################
+# Checking the hot queries use indexes
+
+
+# Tables the hot queries must never scan in full
+HOT_TABLES = ('messages', 'timelines', 'likes', 'follows')
+
+
+def hot_queries(user_id=1):
+    """The homepage, profile and likes page queries, as the routes run them."""
+
+    return {
+        'homepage': timeline.page_select(user_id),
+        'profile': Message.user_page_select(user_id),
+        'likes': Message.liked_page_select(user_id),
+    }
+
+
+def explain(stmt):
+    """The database's query plan for `stmt`, as a list of lines."""
+
+    dialect = db.session.connection().dialect
+    sql = str(stmt.compile(dialect=dialect,
+                           compile_kwargs={'literal_binds': True}))
+
+    if dialect.name == 'postgresql':
+        rows = db.session.execute(text(f"EXPLAIN {sql}"))
+        return [row[0] for row in rows]
+
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan):
+    """Lines of `plan` that read a whole hot table."""
+
+    scans = []
+
+    for line in plan:
+        words = line.strip().replace('->', '').split()
+        # Postgres: "Seq Scan on messages"; SQLite: "SCAN messages"
+        if words[:3] == ['Seq', 'Scan', 'on'] and words[3] in HOT_TABLES:
+            scans.append(line)
+        elif words[:1] == ['SCAN'] and words[1] in HOT_TABLES:
+            scans.append(line)
+
+    return scans
+
+
+def check_index_usage(user_id=1):
+    """EXPLAIN the hot queries; returns {name: (plan, full_scans)}.
+
+    On Postgres, sequential scans are switched off for the check so that
+    tiny test tables still show whether an index *could* be used.
+    """
+
+    if dialect_name() == 'postgresql':
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+
+    try:
+        results = {}
+        for name, stmt in hot_queries(user_id).items():
+            plan = explain(stmt)
+            results[name] = (plan, full_scans(plan))
+        return results
+
+    finally:
+        db.session.rollback()
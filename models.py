@@ -3,11 +3,24 @@
 from datetime import datetime
 import os
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects import postgresql, sqlite
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from sqlalchemy.orm import joinedload
+
+from pagination import page_query, PAGE_SIZE
+import passwords
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Trigram indexes (used by user search) need this extension on Postgres
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+)
 
 def connect_db(app, database_uri):
     """Connect this database to provided Flask app.
@@ -40,28 +53,72 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key covers "who follows X"; this covers "who does X follow"
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
-    __tablename__ = 'likes' 
-
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
+    __tablename__ = 'likes'
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+    )
+
+    # The primary key covers lookups by user; this covers counting a
+    # message's likes
+    __table_args__ = (
+        db.Index('ix_likes_message_id', 'message_id'),
     )
 
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Like the message if the user hasn't yet, otherwise unlike it.
+
+        Tries an INSERT ... ON CONFLICT DO NOTHING first, and only if the
+        like was already there issues a DELETE, so the usual case is a
+        single statement. Returns True if the message is now liked.
+        """
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            insert = postgresql.insert
+        else:
+            insert = sqlite.insert
+
+        inserted = db.session.execute(
+            insert(cls)
+            .values(user_id=user_id, message_id=message_id)
+            .on_conflict_do_nothing())
+
+        if inserted.rowcount:
+            return True
+
+        db.session.execute(
+            db.delete(cls)
+            .where(cls.user_id == user_id, cls.message_id == message_id))
+
+        return False
+
+    @classmethod
+    def count_for(cls, message_id):
+        """How many users like this message?"""
+
+        return db.session.scalar(
+            db.select(db.func.count())
+            .select_from(cls)
+            .where(cls.message_id == message_id))
+
 
 class User(db.Model):
     """User in the system."""
@@ -108,6 +165,75 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts for the profile stats; kept up to date by the
+    # routes and recomputable with `flask reconcile-counters`
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Goes up whenever anything shown about this user changes, so pages
+    # about them can be revalidated cheaply (see conditional.py)
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default='1',
+    )
+
+    # Goes up only when the profile itself (name, images, bio) changes, not
+    # with the counters; the cached cards are keyed on it (see fragments.py)
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default='1',
+    )
+
+    # When this user's home timeline was last built from scratch; NULL if
+    # it never has been (see timeline.warm)
+    timeline_built_at = db.Column(
+        db.DateTime,
+    )
+
+    # Lets Postgres answer username ILIKE '%q%' searches from an index.
+    # SQLite doesn't have trigram indexes, so it just scans.
+    __table_args__ = (
+        db.Index('ix_users_username_trgm',
+                 'username',
+                 postgresql_using='gin',
+                 postgresql_ops={'username': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        # Autocomplete's lower(username) LIKE 'q%' ... ORDER BY lower(username);
+        # trigram indexes can't help with the 1-2 character prefixes it
+        # mostly gets
+        db.Index('ix_users_username_lower_prefix',
+                 db.func.lower(username).label('username_lower'),
+                 postgresql_ops={'username_lower': 'text_pattern_ops'}).ddl_if(dialect='postgresql'),
+    )
+
     messages = db.relationship('Message',cascade="all, delete-orphan")
 
     followers = db.relationship(
@@ -132,17 +258,73 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    # Follow-id sets, loaded on first use (see following_ids/follower_ids)
+    _following_ids = None
+    _follower_ids = None
+
+    def following_ids(self):
+        """Ids of the users this user follows, as a set.
+
+        If the `following` relationship is already loaded we use it, so
+        in-memory changes are seen; otherwise the ids are fetched with one
+        query and kept on this instance for the rest of the request.
+        """
+
+        if 'following' in self.__dict__:
+            return {user.id for user in self.following}
+
+        if self._following_ids is None:
+            self._following_ids = set(db.session.scalars(
+                db.select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == self.id)))
+
+        return self._following_ids
+
+    def follower_ids(self):
+        """Ids of the users following this user, as a set.
+
+        Works like following_ids().
+        """
+
+        if 'followers' in self.__dict__:
+            return {user.id for user in self.followers}
+
+        if self._follower_ids is None:
+            self._follower_ids = set(db.session.scalars(
+                db.select(Follows.user_following_id)
+                .where(Follows.user_being_followed_id == self.id)))
+
+        return self._follower_ids
+
+    def following_among(self, user_ids):
+        """Which of `user_ids` does this user follow? Returns a set.
+
+        Answers in one query for a whole page of users, without loading
+        everyone this user follows.
+        """
+
+        user_ids = set(user_ids)
+
+        if 'following' in self.__dict__ or self._following_ids is not None:
+            return self.following_ids() & user_ids
+
+        if not user_ids:
+            return set()
+
+        return set(db.session.scalars(
+            db.select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == self.id,
+                   Follows.user_being_followed_id.in_(user_ids))))
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.follower_ids()
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.following_ids()
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -151,7 +333,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -172,13 +354,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with an old work factor, it's replaced
+        with a fresh one; the caller should commit.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash_password(password)
                 return user
 
         return False
@@ -202,7 +389,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -213,5 +400,153 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    __table_args__ = (
+        # A user's messages, newest first (profiles, timeline backfills)
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+        # Full-text index for message search on Postgres (see search.py)
+        db.Index('ix_messages_text_fts',
+                 db.func.to_tsvector(db.literal_column("'english'"), text),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+
+    @classmethod
+    def user_page_select(cls, user_id, before=None, per_page=PAGE_SIZE):
+        """SELECT for a page of `user_id`'s own messages (see pagination.py)."""
+
+        query = (db.select(cls)
+                 .options(joinedload(cls.user, innerjoin=True))
+                 .where(cls.user_id == user_id))
+
+        return page_query(query, cls.timestamp, cls.id, before, per_page)
+
+    @classmethod
+    def liked_page_select(cls, user_id, before=None, per_page=PAGE_SIZE):
+        """SELECT for a page of the messages `user_id` likes (see pagination.py)."""
+
+        query = (db.select(cls)
+                 .options(joinedload(cls.user, innerjoin=True))
+                 .join(Likes, Likes.message_id == cls.id)
+                 .where(Likes.user_id == user_id))
+
+        return page_query(query, cls.timestamp, cls.id, before, per_page)
+
+
+class TimelineEntry(db.Model):
+    """A message precomputed into a follower's home timeline."""
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # Copied from the message so the timeline can be read in order
+    # without touching the messages table
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+
+class Job(db.Model):
+    """A background job waiting for, or run by, a worker (see jobs.py)."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # Which handler runs it, and the keyword arguments it gets
+    name = db.Column(
+        db.String(100),
+        nullable=False,
+    )
+
+    args = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict,
+    )
+
+    # Jobs enqueued with the same key only run once
+    idempotency_key = db.Column(
+        db.String(200),
+        unique=True,
+    )
+
+    # queued, running, done or failed
+    status = db.Column(
+        db.String(20),
+        nullable=False,
+        default='queued',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    # Not before this time (later for retries)
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    # When a worker claimed it, to spot workers that died mid-job
+    locked_at = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        # Workers look for the next runnable job
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    @classmethod
+    def insert_once(cls, **values):
+        """INSERT a job unless one with the same idempotency key exists.
+
+        Returns True if it was inserted.
+        """
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            insert = postgresql.insert
+        else:
+            insert = sqlite.insert
 
+        inserted = db.session.execute(
+            insert(cls)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=['idempotency_key']))
 
+        return bool(inserted.rowcount)
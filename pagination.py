@@ -0,0 +1,88 @@
+"""Keyset (cursor) pagination for Warbler.
+
+Lists of messages are paged on `(timestamp, id)` instead of with OFFSET: a
+page asks for rows strictly older than the last row of the previous page,
+which an index on those columns answers directly, so page 500 costs the
+same as page 1.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, request, url_for
+from sqlalchemy import tuple_
+
+PAGE_SIZE = 100
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(timestamp, id):
+    """Make the `?before=` cursor that points just past this row."""
+
+    return f"{timestamp.isoformat()}_{id}"
+
+
+def decode_cursor(cursor):
+    """Split a cursor back into (timestamp, id); 400 if it's malformed."""
+
+    try:
+        timestamp, id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(id)
+    except ValueError:
+        abort(400)
+
+
+def page_query(query, timestamp_col, id_col, before=None, per_page=PAGE_SIZE):
+    """`query` (a Query or a select()) narrowed to one page, newest first.
+
+    Fetches one row more than `per_page` so `to_page()` can tell whether
+    there's a next page.
+    """
+
+    if before:
+        query = query.filter(
+            tuple_(timestamp_col, id_col) < tuple_(*decode_cursor(before)))
+
+    return (query
+            .order_by(timestamp_col.desc(), id_col.desc())
+            .limit(per_page + 1))
+
+
+def to_page(rows, per_page=PAGE_SIZE,
+            key=lambda item: (item.timestamp, item.id)):
+    """Make a Page from the rows a `page_query()` returned."""
+
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return Page(rows, encode_cursor(*key(rows[-1])))
+
+    return Page(rows, None)
+
+
+def paginate(query, timestamp_col, id_col, before=None, per_page=PAGE_SIZE,
+             key=lambda item: (item.timestamp, item.id)):
+    """Get one page of `query`, newest first, ordered by the given columns.
+
+    `before` is a cursor from a previous page (or None for the first page).
+    `key` pulls the (timestamp, id) pair back out of a result row so we can
+    build the cursor for the next page.
+
+    Returns a Page; `next_cursor` is None on the last page.
+    """
+
+    rows = page_query(query, timestamp_col, id_col, before, per_page).all()
+
+    return to_page(rows, per_page, key)
+
+
+def next_page_url(cursor, param='before'):
+    """URL for the current page with `param` set to `cursor`.
+
+    Keeps the rest of the querystring (e.g. a search) as it is.
+    """
+
+    args = request.args.to_dict()
+    args[param] = cursor
+
+    return url_for(request.endpoint, **request.view_args, **args)
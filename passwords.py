@@ -0,0 +1,125 @@
+"""Password hashing for Warbler.
+
+bcrypt is deliberately slow, so hashing and checking run on a small,
+bounded pool of threads instead of on whichever request thread asked.
+bcrypt releases the GIL while it works, so the pool size caps how many
+cores logins can eat at once; a burst of logins queues up here rather than
+starving every other request.
+
+Config (read from the Flask app when there is one):
+
+- BCRYPT_LOG_ROUNDS: work factor for new hashes (default 12). Hashes made
+  with a different factor get replaced on the next successful login.
+- BCRYPT_WORKERS: how many hashes can run at once (default: CPU count).
+"""
+
+import os
+import threading
+import time
+
+import bcrypt
+
+import metrics
+import pools
+
+DEFAULT_LOG_ROUNDS = 12
+
+_pool = pools.Pool('bcrypt', 'BCRYPT_WORKERS', os.cpu_count() or 1)
+
+_stats_lock = threading.Lock()
+_stats = {
+    'queued': 0,
+    'running': 0,
+    'completed': 0,
+    'queue_seconds': 0.0,
+    'hash_seconds': 0.0,
+    'max_queue_seconds': 0.0,
+    'max_hash_seconds': 0.0,
+}
+
+
+def log_rounds():
+    """The work factor new hashes should use."""
+
+    return int(pools.config('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS))
+
+
+def _timed(fn, queued_at, *args):
+    """Run `fn` on a pool thread, keeping queue/latency stats."""
+
+    started = time.perf_counter()
+
+    with _stats_lock:
+        _stats['queued'] -= 1
+        _stats['running'] += 1
+
+    try:
+        return fn(*args)
+
+    finally:
+        finished = time.perf_counter()
+        waited = started - queued_at
+        took = finished - started
+
+        metrics.BCRYPT_QUEUE_SECONDS.observe(waited)
+        metrics.BCRYPT_SECONDS.observe(took, operation=fn.__name__.lstrip('_'))
+
+        with _stats_lock:
+            _stats['running'] -= 1
+            _stats['completed'] += 1
+            _stats['queue_seconds'] += waited
+            _stats['hash_seconds'] += took
+            _stats['max_queue_seconds'] = max(_stats['max_queue_seconds'], waited)
+            _stats['max_hash_seconds'] = max(_stats['max_hash_seconds'], took)
+
+
+def _run(fn, *args):
+    """Run `fn(*args)` on the bcrypt pool and wait for the answer."""
+
+    with _stats_lock:
+        _stats['queued'] += 1
+
+    with metrics.span('bcrypt', operation=fn.__name__.lstrip('_')):
+        return _pool.submit(_timed, fn, time.perf_counter(),
+                            *args).result()
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+def hash_password(password):
+    """Hash `password` with the configured work factor."""
+
+    return _run(_hash, password, log_rounds())
+
+
+def check_password(pw_hash, password):
+    """Does `password` match `pw_hash`?"""
+
+    try:
+        return _run(_check, pw_hash, password)
+    except ValueError:
+        # Not a bcrypt hash at all
+        return False
+
+
+def needs_rehash(pw_hash):
+    """Was `pw_hash` made with a different work factor than we use now?"""
+
+    try:
+        return int(pw_hash.split('$')[2]) != log_rounds()
+    except (IndexError, ValueError):
+        return True
+
+
+def stats():
+    """Snapshot of the pool's queue depth and timings."""
+
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,69 @@
+"""Bounded thread pools for Warbler's slow, CPU-heavy work.
+
+Work like bcrypt hashing (passwords.py) and image resizing (media.py)
+runs on a small pool of threads instead of on whichever request thread
+asked for it, so a burst of it queues up here rather than starving every
+other request:
+
+    _pool = pools.Pool('media', 'MEDIA_WORKERS', default_workers=2)
+
+    _pool.submit(resize, data).result()
+
+Each pool is created the first time it's used, with as many threads as
+its config setting says (read from the Flask app when there is one).
+
+Under gunicorn's gevent worker (see gunicorn.conf.py) `threading` is
+patched to make greenlets, which would run this work on the one thread
+serving every connection; the pools use gevent's native OS threads there
+instead.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+from gevent import monkey
+from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+
+
+def config(key, default):
+    """The Flask app's `key` setting, or `default` outside an app."""
+
+    if has_app_context():
+        return current_app.config.get(key, default)
+
+    return default
+
+
+def greenlets():
+    """Is this process serving each connection on a greenlet (gevent)?"""
+
+    return monkey.is_module_patched('threading')
+
+
+class Pool:
+    """A ThreadPoolExecutor sized by the `workers_key` setting."""
+
+    def __init__(self, name, workers_key, default_workers):
+        self.name = name
+        self.workers_key = workers_key
+        self.default_workers = default_workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                workers = int(config(self.workers_key, self.default_workers))
+                if greenlets():
+                    self.executor = NativeThreadPoolExecutor(max_workers=workers)
+                else:
+                    self.executor = ThreadPoolExecutor(
+                        max_workers=workers, thread_name_prefix=self.name)
+
+        return self.executor
+
+    def submit(self, fn, *args):
+        """Queue `fn(*args)` on the pool; returns its Future."""
+
+        return self.get_executor().submit(fn, *args)
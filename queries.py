@@ -0,0 +1,219 @@
+"""SQL statement tracking for Warbler.
+
+Counts the statements each request runs and how long they take, and notes
+where each one came from: the template line if a template triggered it
+(usually a lazy load like `msg.user.username`), otherwise the innermost
+line of our own code. A request that runs the same statement
+N_PLUS_ONE_THRESHOLD or more times is flagged as an N+1 and logged as a
+warning.
+
+Request tracking is on when QUERY_TRACKING is set, and by default in debug
+and testing; it walks the stack for every statement, so it's off in
+production. Tests can use `capture()` or `assert_max_queries()` directly
+whatever the setting.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# The same statement this many times in one request is an N+1
+N_PLUS_ONE_THRESHOLD = 3
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+Statement = namedtuple('Statement', ['sql', 'seconds', 'location'])
+
+_local = threading.local()
+
+
+class QueryLog:
+    """The statements run while this log was active."""
+
+    def __init__(self, label=None):
+        self.label = label
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    @property
+    def seconds(self):
+        return sum(statement.seconds for statement in self.statements)
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """{sql: [Statement, ...]} for statements run `threshold`+ times."""
+
+        by_sql = defaultdict(list)
+        for statement in self.statements:
+            by_sql[statement.sql].append(statement)
+
+        return {sql: runs for sql, runs in by_sql.items()
+                if len(runs) >= threshold}
+
+    def describe(self):
+        """Multi-line report: one line per statement, then any N+1s."""
+
+        lines = [f"{len(self)} statements in {self.seconds * 1000:.1f}ms"
+                 f"{f' for {self.label}' if self.label else ''}"]
+
+        for statement in self.statements:
+            lines.append(f"  {statement.location}: {one_line(statement.sql)}")
+
+        for sql, runs in self.repeated().items():
+            lines.append(f"  N+1: {len(runs)}x from "
+                         f"{', '.join(sorted({run.location for run in runs}))}: "
+                         f"{one_line(sql)}")
+
+        return '\n'.join(lines)
+
+
+def one_line(sql, width=120):
+    sql = ' '.join(sql.split())
+    return sql if len(sql) <= width else sql[:width - 3] + '...'
+
+
+def statement_location():
+    """Where the statement being run came from, as 'file:line'.
+
+    Template frames are reported by template name and template line.
+    """
+
+    frame = sys._getframe(1)
+    code_location = None
+
+    while frame:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return (f"{template.name}:"
+                    f"{template.get_corresponding_lineno(frame.f_lineno)}")
+
+        filename = frame.f_code.co_filename
+        if (code_location is None
+                and filename.startswith(BASE_DIR)
+                and filename != __file__
+                and 'site-packages' not in filename):
+            code_location = (f"{os.path.relpath(filename, BASE_DIR)}:"
+                             f"{frame.f_lineno}")
+
+        frame = frame.f_back
+
+    return code_location or '?'
+
+
+def _active_logs():
+    return getattr(_local, 'logs', None)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_logs():
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    logs = _active_logs()
+    if not logs:
+        return
+
+    started = getattr(context, '_query_started', None)
+    took = time.perf_counter() - started if started else 0.0
+    record = Statement(statement, took, statement_location())
+
+    for log in logs:
+        log.statements.append(record)
+
+
+def start(label=None):
+    """Start recording this thread's statements into a new QueryLog."""
+
+    log = QueryLog(label)
+    _local.__dict__.setdefault('logs', []).append(log)
+
+    return log
+
+
+def stop(log):
+    """Stop recording into `log`."""
+
+    logs = _active_logs()
+    if logs and log in logs:
+        logs.remove(log)
+
+
+@contextmanager
+def capture(label=None):
+    """Record the statements run inside the block:
+
+        with queries.capture() as log:
+            client.get('/')
+        print(log.describe())
+    """
+
+    log = start(label)
+
+    try:
+        yield log
+    finally:
+        stop(log)
+
+
+@contextmanager
+def assert_max_queries(limit, allow_n_plus_one=False):
+    """Fail if the block runs more than `limit` statements, or an N+1.
+
+        with assert_max_queries(5):
+            resp = client.get('/')
+    """
+
+    with capture() as log:
+        yield log
+
+    if len(log) > limit:
+        raise AssertionError(
+            f"Expected at most {limit} statements, got {log.describe()}")
+
+    if not allow_n_plus_one and log.repeated():
+        raise AssertionError(f"N+1 queries: {log.describe()}")
+
+
+##############################################################################
+# Per-request tracking
+
+
+def tracking_enabled():
+    config = current_app.config
+    return config.get('QUERY_TRACKING', current_app.debug or current_app.testing)
+
+
+def start_request():
+    if tracking_enabled():
+        g.query_log = start(f"{request.method} {request.endpoint}")
+
+
+def finish_request(exc=None):
+    log = g.pop('query_log', None)
+    if log is None:
+        return
+
+    stop(log)
+
+    if log.repeated():
+        current_app.logger.warning(log.describe())
+    else:
+        current_app.logger.debug(log.describe())
+
+
+def init_app(app):
+    """Track statements for every request to `app` (see tracking_enabled)."""
+
+    app.before_request(start_request)
+    app.teardown_request(finish_request)
@@ -0,0 +1,126 @@
+"""Read replicas for Warbler.
+
+Views decorated with `@reads_from_replica` run their SELECTs against a read
+replica (one picked at random per request) when the request is a GET.
+Everything else -- writes, DDL, raw SQL, and any read made after the
+request has written something -- goes to the primary.
+
+Replication lags, so after a request writes, the browser is pinned to the
+primary for PIN_SECONDS (a timestamp in the session cookie) and sees its
+own writes.
+
+Replicas are set with DATABASE_REPLICA_URLS, a comma-separated list of
+database URLs, e.g. two local Postgres databases or two SQLite files. With
+no replicas configured everything reads from the primary as before.
+"""
+
+import os
+import random
+import time
+
+from flask import current_app, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+# How long after writing a browser keeps reading from the primary
+PIN_SECONDS = 5
+
+PRIMARY_UNTIL_KEY = 'primary_until'
+
+
+class RoutingSession(Session):
+    """Session that sends replica-safe SELECTs to the request's replica.
+
+    `info['replica']` is the engine chosen for this request, if any;
+    `info['wrote']` is set once anything has gone to the primary as a
+    write, after which all reads go there too.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info['wrote'] = True
+
+            elif (isinstance(clause, Select)
+                    and self.info.get('replica') is not None
+                    and not self.info.get('wrote')):
+                return self.info['replica']
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+def configure(app, urls):
+    """Use these replica database URLs for `app` (an empty list: none)."""
+
+    for engine in app.extensions.get('replicas', []):
+        engine.dispose()
+
+    app.extensions['replicas'] = [create_engine(url) for url in urls]
+
+
+def engines():
+    return current_app.extensions.get('replicas', [])
+
+
+def reads_from_replica(view):
+    """Mark a view whose GETs may read from a replica."""
+
+    view.reads_from_replica = True
+
+    return view
+
+
+def is_pinned():
+    """Has this browser written recently enough to need the primary?"""
+
+    return session.get(PRIMARY_UNTIL_KEY, 0) > time.time()
+
+
+def _session():
+    return current_app.extensions['sqlalchemy'].session
+
+
+def read_engine():
+    """The engine this request's SELECTs go to right now."""
+
+    info = _session().info
+
+    if info.get('replica') is not None and not info.get('wrote'):
+        return info['replica']
+
+    return current_app.extensions['sqlalchemy'].engine
+
+
+def start_request():
+    info = _session().info
+    info.pop('wrote', None)
+    info.pop('replica', None)
+
+    view = current_app.view_functions.get(request.endpoint)
+
+    if (engines()
+            and request.method in ('GET', 'HEAD')
+            and getattr(view, 'reads_from_replica', False)
+            and not is_pinned()):
+        info['replica'] = random.choice(engines())
+
+
+def finish_request(resp):
+    if _session().info.get('wrote'):
+        pin = current_app.config.get('REPLICA_PIN_SECONDS', PIN_SECONDS)
+        session[PRIMARY_UNTIL_KEY] = time.time() + pin
+
+    return resp
+
+
+def init_app(app):
+    """Route `app`'s reads to the DATABASE_REPLICA_URLS replicas."""
+
+    urls = os.environ.get('DATABASE_REPLICA_URLS', '')
+    configure(app, [url.strip() for url in urls.split(',') if url.strip()])
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
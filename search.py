@@ -0,0 +1,285 @@
+"""Search for Warbler.
+
+User search matches usernames by substring, case-insensitively, and ranks
+exact matches first, then prefix matches, then everything else. On
+Postgres the ILIKE is answered by a trigram index on users.username (see
+models.py); SQLite runs the same query without it, which is fine for tests
+and development. Results are paged by cursor on (rank, username) rather
+than OFFSET.
+
+Autocomplete only matches prefixes, in alphabetical order, so Postgres can
+read the first few matches straight off a btree on lower(username); the
+trigram index can't serve the one- and two-letter queries it mostly gets,
+and ranking would sort every match.
+
+Message search is full-text. On Postgres it uses a GIN index over
+to_tsvector(messages.text), which Postgres keeps up to date itself. Other
+databases get an in-process inverted index (MessageIndex) that is built
+from the messages table on first use and then updated by the message
+routes. Ranked results are paged by page number.
+"""
+
+import re
+import threading
+from collections import Counter, defaultdict
+
+from flask import abort
+from sqlalchemy import case, func, literal, literal_column, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, Message, User
+from pagination import Page
+
+USERS_PAGE_SIZE = 60
+AUTOCOMPLETE_SIZE = 10
+MESSAGES_PAGE_SIZE = 50
+
+# Nobody reads past this many pages of ranked results
+MAX_MESSAGE_PAGES = 20
+
+# Text search configuration for Postgres; must match the index in models.py
+TS_CONFIG = 'english'
+
+
+def like_pattern(q, prefix_only=False):
+    """Escape `q` for use in a LIKE pattern and wrap it in wildcards."""
+
+    q = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    return f"{q}%" if prefix_only else f"%{q}%"
+
+
+def user_rank(q):
+    """SQL expression ranking a username against `q`: 0 exact, 1 prefix, 2 other."""
+
+    return case(
+        (func.lower(User.username) == q.lower(), 0),
+        (User.username.ilike(like_pattern(q, prefix_only=True), escape='\\'), 1),
+        else_=2,
+    )
+
+
+def encode_user_cursor(rank, username):
+    return f"{rank}:{username}"
+
+
+def decode_user_cursor(cursor):
+    """Split a user cursor back into (rank, username); 400 if malformed."""
+
+    try:
+        rank, username = cursor.split(':', 1)
+        return int(rank), username
+    except ValueError:
+        abort(400)
+
+
+def search_users(q=None, after=None, per_page=None):
+    """Get one page of users whose username contains `q`, best match first.
+
+    With no `q`, every user is listed alphabetically. `after` is the cursor
+    from the previous page.
+
+    Returns a pagination.Page.
+    """
+
+    per_page = per_page or USERS_PAGE_SIZE
+
+    query = User.query
+
+    if q:
+        rank = user_rank(q)
+        query = (query
+                 .add_columns(rank.label('rank'))
+                 .filter(User.username.ilike(like_pattern(q), escape='\\')))
+        order = (rank, User.username)
+    else:
+        query = query.add_columns(literal(0).label('rank'))
+        order = (User.username,)
+
+    if after:
+        after_rank, after_username = decode_user_cursor(after)
+        if q:
+            query = query.filter(
+                tuple_(*order) > tuple_(after_rank, after_username))
+        else:
+            query = query.filter(User.username > after_username)
+
+    rows = (query
+            .order_by(*order)
+            .limit(per_page + 1)
+            .all())
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_user_cursor(last.rank, last[0].username)
+
+    return Page([row[0] for row in rows], next_cursor)
+
+
+def autocomplete_users(q, limit=AUTOCOMPLETE_SIZE):
+    """(id, username, image_url) rows for the first `limit` usernames starting with `q`."""
+
+    username = func.lower(User.username)
+
+    return (db.session.query(User.id, User.username, User.image_url)
+            .filter(username.like(like_pattern(q.lower(), prefix_only=True),
+                                  escape='\\'))
+            .order_by(username)
+            .limit(limit)
+            .all())
+
+
+##############################################################################
+# Message search
+
+
+def tokenize(text):
+    """Lowercased word tokens in `text`, for the in-process index."""
+
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+class MessageIndex:
+    """In-process inverted index over message text.
+
+    Maps each token to {message_id: occurrences}. Used when the database
+    has no full-text search of its own (SQLite in tests and development).
+    It only sees messages written through this process, so it's not meant
+    for a multi-worker deployment; that's what the Postgres path is for.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.tokens_by_message = {}
+        self.built = False
+        self.lock = threading.Lock()
+
+    def build(self):
+        """Index every message, unless we already have."""
+
+        with self.lock:
+            if self.built:
+                return
+
+            for message_id, text in db.session.execute(
+                    db.select(Message.id, Message.text)):
+                self._add(message_id, text)
+
+            self.built = True
+
+    def add(self, message_id, text):
+        """Index a new message. Does nothing until the index is built."""
+
+        with self.lock:
+            if self.built:
+                self._add(message_id, text)
+
+    def remove(self, message_id):
+        """Drop a message from the index."""
+
+        with self.lock:
+            for token in self.tokens_by_message.pop(message_id, ()):
+                self.postings[token].pop(message_id, None)
+                if not self.postings[token]:
+                    del self.postings[token]
+
+    def search(self, q):
+        """Ids of messages containing every token in `q`, best first.
+
+        Ranked by how often the query tokens appear, then newest first.
+        """
+
+        tokens = set(tokenize(q))
+
+        if not tokens:
+            return []
+
+        self.build()
+
+        with self.lock:
+            postings = sorted((self.postings.get(token, {}) for token in tokens),
+                              key=len)
+            scores = {message_id: count
+                      for message_id, count in postings[0].items()}
+            for posting in postings[1:]:
+                scores = {message_id: score + posting[message_id]
+                          for message_id, score in scores.items()
+                          if message_id in posting}
+
+        return sorted(scores, key=lambda message_id: (-scores[message_id],
+                                                      -message_id))
+
+    def _add(self, message_id, text):
+        counts = Counter(tokenize(text))
+        for token, count in counts.items():
+            self.postings[token][message_id] = count
+        self.tokens_by_message[message_id] = list(counts)
+
+
+message_index = MessageIndex()
+
+
+def uses_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def index_message(message):
+    """Make a newly committed message searchable."""
+
+    if not uses_postgres():
+        message_index.add(message.id, message.text)
+
+
+def unindex_messages(message_ids):
+    """Stop finding these (deleted) messages."""
+
+    if not uses_postgres():
+        for message_id in message_ids:
+            message_index.remove(message_id)
+
+
+def search_messages(q, page=1, per_page=None):
+    """Get one page of messages matching `q`, best match first.
+
+    Returns a (messages, has_more) pair. Page numbers start at 1 and stop
+    at MAX_MESSAGE_PAGES.
+    """
+
+    per_page = per_page or MESSAGES_PAGE_SIZE
+
+    if not q or not q.strip() or not 1 <= page <= MAX_MESSAGE_PAGES:
+        return [], False
+
+    start = (page - 1) * per_page
+
+    if uses_postgres():
+        # Spelled exactly like the index expression so the planner uses it
+        config = literal_column(f"'{TS_CONFIG}'")
+        vector = func.to_tsvector(config, Message.text)
+        query = func.plainto_tsquery(config, q)
+
+        messages = (Message
+                    .query
+                    .options(joinedload(Message.user, innerjoin=True))
+                    .filter(vector.op('@@')(query))
+                    .order_by(func.ts_rank(vector, query).desc(),
+                              Message.id.desc())
+                    .offset(start)
+                    .limit(per_page + 1)
+                    .all())
+
+    else:
+        ids = message_index.search(q)[start:start + per_page + 1]
+        found = {message.id: message
+                 for message in (Message
+                                 .query
+                                 .options(joinedload(Message.user, innerjoin=True))
+                                 .filter(Message.id.in_(ids)))}
+        messages = [found[message_id] for message_id in ids
+                    if message_id in found]
+
+    has_more = len(messages) > per_page and page < MAX_MESSAGE_PAGES
+
+    return messages[:per_page], has_more
@@ -1,24 +1,22 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db, app
-from models import User, Message, Follows
+    python seed.py [--dir generator] [--no-parallel]
 
-# Need to use an application context in Flask 3
-with app.app_context():
-
-    db.drop_all()
-    db.create_all()
+The actual loading is in loader.py.
+"""
 
-with app.app_context():
-    # Creating database tables
-    with open('generator/users.csv') as users:
-        db.session.bulk_insert_mappings(User, DictReader(users))
+import argparse
 
-    with open('generator/messages.csv') as messages:
-        db.session.bulk_insert_mappings(Message, DictReader(messages))
+from app import app
+import loader
 
-    with open('generator/follows.csv') as follows:
-        db.session.bulk_insert_mappings(Follows, DictReader(follows))
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--dir', default='generator',
+                    help="directory holding users.csv, messages.csv, etc.")
+parser.add_argument('--no-parallel', dest='parallel', action='store_false',
+                    help="load one table at a time")
+args = parser.parse_args()
 
-    db.session.commit()
+# Need to use an application context in Flask 3
+with app.app_context():
+    loader.load(args.dir, parallel=args.parallel)
@@ -0,0 +1,60 @@
+// Shows a "N new warbles" link above the home timeline.
+//
+// Polls /timeline/new. When the server has streaming on (data-stream),
+// listens on /timeline/stream instead, and goes back to polling if the
+// browser has no EventSource, the server turns the stream down (204) or
+// the stream asks us to resync.
+
+(function () {
+  const list = document.getElementById("messages");
+  const banner = document.getElementById("new-warbles");
+  if (!list || !banner || !list.dataset.newest) return;
+
+  const POLL_MS = 30000;
+  const newest = list.dataset.newest;
+  const seen = new Set();
+  let polling = false;
+
+  function show(count, max) {
+    if (!count) return;
+    const more = max && count >= max ? "+" : "";
+    banner.textContent = `${count}${more} new warble${count === 1 ? "" : "s"}`;
+    banner.classList.remove("d-none");
+  }
+
+  function poll() {
+    fetch(`/timeline/new?after=${newest}`, { credentials: "same-origin" })
+      .then((resp) => resp.json())
+      .then((body) => show(body.count, body.max))
+      .catch(() => {});
+  }
+
+  function startPolling() {
+    if (polling) return;
+    polling = true;
+    poll();
+    setInterval(poll, POLL_MS);
+  }
+
+  if (list.dataset.stream !== "1" || !window.EventSource) {
+    startPolling();
+    return;
+  }
+
+  const source = new EventSource(`/timeline/stream?after=${newest}`);
+
+  source.addEventListener("warble", (evt) => {
+    seen.add(evt.data);
+    show(seen.size);
+  });
+
+  source.addEventListener("resync", () => {
+    source.close();
+    startPolling();
+  });
+
+  source.addEventListener("error", () => {
+    // CLOSED means the browser won't reconnect, e.g. after a 204
+    if (source.readyState === EventSource.CLOSED) startPolling();
+  });
+})();
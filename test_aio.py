@@ -0,0 +1,156 @@
+"""Concurrent query tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_aio.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from sqlalchemy.engine import make_url
+
+from models import db, Follows, Likes, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import aio
+import counters
+import current_user
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AsyncUrlTestCase(TestCase):
+    """Test picking the asyncio driver."""
+
+    def test_async_url(self):
+        """Sync URLs should map to their asyncio driver"""
+
+        self.assertEqual(aio.async_url(make_url("postgresql:///warbler")).drivername,
+                         "postgresql+asyncpg")
+        self.assertEqual(aio.async_url(make_url("sqlite:////tmp/w.db")).drivername,
+                         "sqlite+aiosqlite")
+
+        with self.assertRaises(ValueError):
+            aio.async_url(make_url("mysql://localhost/warbler"))
+
+
+class AsyncPagesTestCase(TestCase):
+    """Test that pages come out the same with ASYNC_QUERIES on."""
+
+    def setUp(self):
+        """User 1 follows user 2 and likes one of their messages"""
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.client = app.test_client()
+
+            for username in ("testuser", "otheruser"):
+                User.signup(username=username,
+                            email=f"{username}@test.com",
+                            password="testuser",
+                            image_url=None)
+            db.session.flush()
+
+            for i in range(3):
+                db.session.add(Message(text=f"message {i}", user_id=2))
+            db.session.flush()
+
+            db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+            db.session.add(Likes(user_id=1, message_id=2))
+            counters.reconcile()
+            db.session.commit()
+
+            current_user.forget(1, 2)
+
+    def tearDown(self):
+        """Dropping all tables and async connections"""
+
+        app.config['ASYNC_QUERIES'] = False
+
+        with app.app_context():
+            aio.dispose()
+            db.session.rollback()
+            db.drop_all()
+            current_user.forget(1, 2)
+
+    def get_both_ways(self, url):
+        """`url`'s page with ASYNC_QUERIES off, then on"""
+
+        pages = []
+
+        for setting in (False, True):
+            app.config['ASYNC_QUERIES'] = setting
+
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 1
+
+                resp = c.get(url)
+                self.assertEqual(resp.status_code, 200)
+                pages.append(resp.get_data(as_text=True))
+
+        return pages
+
+    def test_homepage(self):
+        """The timeline and likes should match"""
+
+        sync_page, async_page = self.get_both_ways("/")
+
+        self.assertEqual(sync_page, async_page)
+        self.assertIn("message 2", async_page)
+        self.assertEqual(async_page.count("btn-primary"), 1)
+
+    def test_profile(self):
+        """The messages and follow button should match"""
+
+        sync_page, async_page = self.get_both_ways("/users/2")
+
+        self.assertEqual(sync_page, async_page)
+        self.assertIn("message 0", async_page)
+        self.assertIn("Unfollow", async_page)
+
+    def test_threads_share_one_engine(self):
+        """Queries from many threads should share one loop and one engine"""
+
+        app.config['ASYNC_QUERIES'] = True
+        results = []
+
+        def query():
+            with app.app_context():
+                results.append(aio.scalars_all(db.select(Message.id)))
+
+        for _ in range(3):
+            threads = [threading.Thread(target=query) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(results), 15)
+        self.assertEqual(len(aio._engines), 1)
+        self.assertEqual([thread.name for thread in threading.enumerate()
+                          if thread.name == 'aio'], ['aio'])
@@ -0,0 +1,187 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Follows, Likes, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import current_user
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiTestCase(TestCase):
+    """Test the /api/v1 JSON endpoints."""
+
+    def setUp(self):
+        """User 1 follows users 2 and 3, who have five messages each"""
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.client = app.test_client()
+
+            for i in range(1, 4):
+                db.session.add(User(username=f"user{i}",
+                                    email=f"user{i}@test.com",
+                                    password="x",
+                                    bio=f"bio {i}"))
+            db.session.flush()
+
+            start = datetime(2020, 1, 1)
+            for i in range(10):
+                db.session.add(Message(text=f"message {i}",
+                                       timestamp=start + timedelta(minutes=i),
+                                       user_id=2 + i % 2))
+            db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+            db.session.add(Follows(user_being_followed_id=3, user_following_id=1))
+            db.session.flush()
+
+            db.session.add(Likes(user_id=1, message_id=1))
+            counters.reconcile()
+            db.session.commit()
+
+            current_user.forget(1, 2, 3)
+
+    def tearDown(self):
+        """Dropping all tables"""
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+    def test_timeline_pages(self):
+        """The timeline should page through every message, newest first"""
+
+        with self.client as c:
+            self.login(c)
+
+            resp = c.get("/api/v1/timeline?limit=4")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, "application/json")
+
+            texts = []
+            body = resp.get_json()
+            while True:
+                texts += [item["text"] for item in body["items"]]
+                if not body["next_cursor"]:
+                    break
+                body = c.get("/api/v1/timeline",
+                             query_string={"limit": 4,
+                                           "before": body["next_cursor"]}).get_json()
+
+            self.assertEqual(texts, [f"message {i}" for i in range(9, -1, -1)])
+
+    def test_timeline_needs_login(self):
+        """The timeline should be a JSON 401 when logged out"""
+
+        with self.client as c:
+            resp = c.get("/api/v1/timeline")
+
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.get_json(), {"error": "Unauthorized"})
+
+    def test_profile(self):
+        """A profile should have its details and counters"""
+
+        with self.client as c:
+            body = c.get("/api/v1/users/2").get_json()
+
+            self.assertEqual(body["username"], "user2")
+            self.assertEqual(body["messages_count"], 5)
+            self.assertEqual(body["followers_count"], 1)
+            self.assertNotIn("password", body)
+            self.assertNotIn("email", body)
+
+            self.assertEqual(c.get("/api/v1/users/99").status_code, 404)
+
+    def test_message(self):
+        """A single message should include its author"""
+
+        with self.client as c:
+            body = c.get("/api/v1/messages/1").get_json()
+
+            self.assertEqual(body["text"], "message 0")
+            self.assertEqual(body["timestamp"], "2020-01-01T00:00:00")
+            self.assertEqual(body["user"]["username"], "user2")
+
+    def test_user_messages_and_likes(self):
+        """A user's messages and likes should be listed"""
+
+        with self.client as c:
+            self.login(c)
+
+            body = c.get("/api/v1/users/3/messages").get_json()
+            self.assertEqual([item["text"] for item in body["items"]],
+                             ["message 9", "message 7", "message 5",
+                              "message 3", "message 1"])
+            self.assertIsNone(body["next_cursor"])
+
+            body = c.get("/api/v1/users/1/likes").get_json()
+            self.assertEqual([item["id"] for item in body["items"]], [1])
+
+    def test_follow_lists(self):
+        """Following and followers lists should page by user id"""
+
+        with self.client as c:
+            self.login(c)
+
+            body = c.get("/api/v1/users/1/following?limit=1").get_json()
+            self.assertEqual([item["username"] for item in body["items"]],
+                             ["user2"])
+
+            body = c.get(f"/api/v1/users/1/following?limit=1"
+                         f"&after={body['next_cursor']}").get_json()
+            self.assertEqual([item["username"] for item in body["items"]],
+                             ["user3"])
+            self.assertIsNone(body["next_cursor"])
+
+            body = c.get("/api/v1/users/2/followers").get_json()
+            self.assertEqual(body["items"], [{"id": 1,
+                                              "username": "user1",
+                                              "image_url": "/static/images/default-pic.png",
+                                              "bio": "bio 1"}])
+
+    def test_bad_limit(self):
+        """Out of range limits should be a JSON 400"""
+
+        with self.client as c:
+            self.login(c)
+
+            self.assertEqual(c.get("/api/v1/timeline?limit=0").status_code, 400)
+            self.assertEqual(c.get("/api/v1/timeline?limit=x").status_code, 400)
+            self.assertEqual(c.get("/api/v1/users/1/following?after=x").status_code,
+                             400)
@@ -0,0 +1,126 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import brotli
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import assets
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AssetsTestCase(TestCase):
+    """Test building and serving assets from a scratch static folder."""
+
+    def setUp(self):
+        """A static folder with a stylesheet that uses an image"""
+
+        self.tmp = tempfile.mkdtemp()
+        self.original_static = app.static_folder
+        app.static_folder = self.tmp
+
+        os.makedirs(os.path.join(self.tmp, "images"))
+        os.makedirs(os.path.join(self.tmp, "stylesheets"))
+
+        with open(os.path.join(self.tmp, "images", "bg.png"), "wb") as out:
+            out.write(b"\x89PNG not really")
+        with open(os.path.join(self.tmp, "stylesheets", "style.css"), "w") as out:
+            out.write('body { background: url("/static/images/bg.png"); }\n'
+                      + "p { color: red; }\n" * 100)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.static_folder = self.original_static
+        assets.forget_manifest()
+        shutil.rmtree(self.tmp)
+
+    def test_without_build(self):
+        """static_url() should fall back to /static before a build"""
+
+        with app.test_request_context():
+            self.assertEqual(assets.static_url("stylesheets/style.css"),
+                             "/static/stylesheets/style.css")
+
+    def test_build(self):
+        """Files should get hashed names and CSS should point at them"""
+
+        manifest = assets.build(self.tmp, report=lambda line: None)
+
+        image = manifest["images/bg.png"]
+        css = manifest["stylesheets/style.css"]
+
+        self.assertRegex(image["path"], r"^images/bg\.[0-9a-f]{12}\.png$")
+        self.assertEqual(image["encodings"], [])
+        self.assertEqual(css["encodings"], ["br", "gzip"])
+
+        with open(os.path.join(self.tmp, "dist", css["path"])) as built:
+            self.assertIn(f'url("/assets/{image["path"]}")', built.read())
+
+        with app.test_request_context():
+            self.assertEqual(assets.static_url("stylesheets/style.css"),
+                             f"/assets/{css['path']}")
+
+    def test_serve_precompressed(self):
+        """Assets should be immutable and gzipped when the browser takes it"""
+
+        css = assets.build(self.tmp, report=lambda line: None)["stylesheets/style.css"]
+        url = f"/assets/{css['path']}"
+
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.headers["Cache-Control"], assets.IMMUTABLE)
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(resp.mimetype, "text/css")
+        self.assertIn(b"color: red", gzip.decompress(resp.data))
+        resp.close()
+
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertIn(b"color: red", brotli.decompress(resp.data))
+        resp.close()
+
+        resp = self.client.get(url)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertIn(b"color: red", resp.data)
+        resp.close()
+
+    def test_not_found(self):
+        """Unknown files and the manifest shouldn't be served"""
+
+        assets.build(self.tmp, report=lambda line: None)
+
+        self.assertEqual(self.client.get("/assets/nope.css").status_code, 404)
+        self.assertEqual(self.client.get("/assets/manifest.json").status_code, 404)
+        self.assertEqual(self.client.get("/assets/../app.py").status_code, 404)
@@ -0,0 +1,74 @@
+"""Benchmark harness tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_bench.py
+
+
+from unittest import TestCase
+
+import bench
+
+
+def stats(p95_ms=10.0, rps=100.0, sql_per_request=3.0, errors=0):
+    return {'p95_ms': p95_ms, 'rps': rps,
+            'sql_per_request': sql_per_request, 'errors': errors}
+
+
+class PercentileTestCase(TestCase):
+    """Test the nearest-rank percentile."""
+
+    def test_percentile(self):
+        """Should pick the nearest-rank value and stay inside the list"""
+
+        values = list(range(1, 101))
+
+        self.assertEqual(bench.percentile(values, 50), 50)
+        self.assertEqual(bench.percentile(values, 95), 95)
+        self.assertEqual(bench.percentile(values, 99), 99)
+        self.assertEqual(bench.percentile(values, 100), 100)
+        self.assertEqual(bench.percentile(values, 0), 1)
+        self.assertEqual(bench.percentile([7], 99), 7)
+        self.assertEqual(bench.percentile([1, 2, 3, 4], 50), 2)
+
+
+class RegressionsTestCase(TestCase):
+    """Test comparing a run against its baseline."""
+
+    def test_within_tolerance(self):
+        """Changes inside the tolerance, and routes new since the baseline, pass"""
+
+        baseline = {'home': stats()}
+        results = {'home': stats(p95_ms=12.0, rps=80.0, sql_per_request=3.5),
+                   'new_route': stats(p95_ms=1000.0)}
+
+        self.assertEqual(bench.regressions(results, baseline), [])
+
+    def test_regressions(self):
+        """Slower, fewer req/s, more SQL or more errors should each be reported"""
+
+        baseline = {'home': stats()}
+
+        self.assertEqual(len(bench.regressions({'home': stats(p95_ms=13.0)},
+                                               baseline)), 1)
+        self.assertEqual(len(bench.regressions({'home': stats(rps=70.0)},
+                                               baseline)), 1)
+        self.assertEqual(len(bench.regressions({'home': stats(sql_per_request=5.0)},
+                                               baseline)), 1)
+        self.assertEqual(len(bench.regressions({'home': stats(errors=1)},
+                                               baseline)), 1)
+
+        everything = bench.regressions(
+            {'home': stats(p95_ms=20.0, rps=10.0, sql_per_request=9.0, errors=2)},
+            baseline)
+        self.assertEqual(len(everything), 4)
+        self.assertTrue(all(line.startswith("home: ") for line in everything))
+
+    def test_tolerance(self):
+        """A tighter tolerance should catch smaller slowdowns"""
+
+        baseline = {'home': stats()}
+        results = {'home': stats(p95_ms=11.0)}
+
+        self.assertEqual(bench.regressions(results, baseline), [])
+        self.assertEqual(len(bench.regressions(results, baseline, tolerance=0.05)), 1)
@@ -0,0 +1,211 @@
+"""Response compression tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compression.py
+
+
+import gzip
+import os
+import zlib
+from unittest import TestCase
+
+import brotli
+
+from flask import Flask, Response
+
+from models import db, Follows, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import compression
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+GZIP = {"Accept-Encoding": "gzip"}
+
+
+def streaming_app(chunks, closed):
+    """A tiny app whose /stream yields `chunks` and notes when it's closed."""
+
+    small = Flask(__name__)
+
+    @small.route('/stream')
+    def stream():
+        resp = Response(iter(chunks), mimetype='application/json')
+        resp.call_on_close(lambda: closed.append(True))
+        return resp
+
+    @small.route('/small')
+    def small_page():
+        return "tiny"
+
+    @small.route('/events')
+    def events():
+        return Response(iter(chunks), mimetype='text/event-stream')
+
+    @small.route('/already')
+    def already():
+        return Response(gzip.compress(b"x" * 5000), mimetype='text/html',
+                        headers={"Content-Encoding": "gzip"})
+
+    small.wsgi_app = compression.CompressMiddleware(small.wsgi_app)
+
+    return small
+
+
+class CompressMiddlewareTestCase(TestCase):
+    """Test the middleware on its own."""
+
+    def setUp(self):
+        self.chunks = [b'{"items":[', b'"' + b"a" * 20000 + b'"',
+                       b',"' + b"b" * 20000 + b'"', b']}']
+        self.closed = []
+        self.client = streaming_app(self.chunks, self.closed).test_client()
+
+    def test_streamed_gzip(self):
+        """A streamed body should be gzipped chunk by chunk and then closed"""
+
+        resp = self.client.get('/stream', headers=GZIP, buffered=False)
+
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertNotIn("Content-Length", resp.headers)
+
+        # Each 20kB chunk goes past FLUSH_BYTES, so it comes out right away
+        body = iter(resp.response)
+        decompressor = zlib.decompressobj(31)
+        self.assertEqual(decompressor.decompress(next(body)), b'')
+        self.assertEqual(decompressor.decompress(next(body)),
+                         b''.join(self.chunks[:2]))
+
+        rest = b''.join(body)
+        resp.close()
+
+        self.assertEqual(decompressor.decompress(rest), b''.join(self.chunks[2:]))
+        self.assertTrue(decompressor.eof)
+        self.assertEqual(self.closed, [True])
+
+    def test_streamed_brotli(self):
+        """Brotli should be preferred, and decode to the whole body"""
+
+        resp = self.client.get('/stream', headers={"Accept-Encoding": "gzip, br"})
+
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(resp.data), b''.join(self.chunks))
+
+        resp.close()
+        self.assertEqual(self.closed, [True])
+
+    def test_not_accepted(self):
+        """Without Accept-Encoding the body should go out as it is"""
+
+        resp = self.client.get('/stream')
+
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.data, b''.join(self.chunks))
+        self.assertEqual(self.client.get(
+            '/stream', headers={"Accept-Encoding": "gzip;q=0"}).data,
+            b''.join(self.chunks))
+
+    def test_skipped(self):
+        """Small, event stream and already-encoded bodies should be left alone"""
+
+        resp = self.client.get('/small', headers=GZIP)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.data, b"tiny")
+
+        resp = self.client.get('/events', headers=GZIP)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.data, b''.join(self.chunks))
+
+        resp = self.client.get('/already', headers=GZIP)
+        self.assertEqual(gzip.decompress(resp.data), b"x" * 5000)
+
+    def test_choose_encoding(self):
+        """Brotli should win when it's accepted"""
+
+        environ = {"HTTP_ACCEPT_ENCODING": "gzip, deflate, br"}
+
+        self.assertEqual(compression.choose_encoding(environ), "br")
+        self.assertEqual(compression.choose_encoding(
+            {"HTTP_ACCEPT_ENCODING": "gzip, br;q=0"}), "gzip")
+        self.assertEqual(compression.choose_encoding({}), None)
+        self.assertEqual(compression.choose_encoding(
+            {"HTTP_ACCEPT_ENCODING": "identity"}), None)
+
+
+class CompressedPagesTestCase(TestCase):
+    """Test compression of Warbler's own pages."""
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            Follows.query.delete()
+            Message.query.delete()
+            User.query.delete()
+
+            db.session.add_all(User(username=f"user{i}", email=f"user{i}@test.com",
+                                    password="not-a-real-hash")
+                               for i in range(30))
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.drop_all()
+            db.session.rollback()
+
+    def test_users_page(self):
+        """/users should be gzipped to well under half its size"""
+
+        plain = self.client.get('/users')
+        resp = self.client.get('/users', headers=GZIP)
+
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertLess(len(resp.data), len(plain.data) / 2)
+
+    def test_weak_etag(self):
+        """A gzipped profile's weak ETag should still get a 304"""
+
+        with app.app_context():
+            user_id = User.query.filter_by(username="user0").one().id
+
+        resp = self.client.get(f'/users/{user_id}', headers=GZIP)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+
+        resp = self.client.get(f'/users/{user_id}',
+                               headers={**GZIP, "If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_assets_skipped(self):
+        """/assets/ files are precompressed, so they're passed through"""
+
+        resp = self.client.get('/assets/missing.css', headers=GZIP)
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertNotIn("Content-Encoding", resp.headers)
@@ -0,0 +1,149 @@
+"""Conditional GET tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_conditional.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import current_user
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test ETags and 304s on the profile and message pages."""
+
+    def setUp(self):
+        """Create two users, one with a message"""
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.client = app.test_client()
+
+            for username in ("testuser", "otheruser"):
+                User.signup(username=username,
+                            email=f"{username}@test.com",
+                            password="testuser",
+                            image_url=None)
+            db.session.flush()
+
+            db.session.add(Message(text="hello", user_id=2))
+            db.session.commit()
+
+            current_user.forget(1, 2)
+
+    def tearDown(self):
+        """Dropping all tables"""
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+            current_user.forget(1, 2)
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+    def revalidate(self, c, url, etag):
+        return c.get(url, headers={"If-None-Match": etag})
+
+    def test_message_not_modified(self):
+        """An unchanged message page should come back as a bare 304"""
+
+        with self.client as c:
+            self.login(c)
+
+            resp = c.get("/messages/1")
+            etag = resp.headers["ETag"]
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers["Cache-Control"], "private, no-cache")
+
+            resp = self.revalidate(c, "/messages/1", etag)
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b"")
+            self.assertEqual(resp.headers["ETag"], etag)
+
+    def test_missing_message(self):
+        """A missing message should 404 rather than fail to render"""
+
+        with self.client as c:
+            resp = c.get("/messages/99")
+
+            self.assertEqual(resp.status_code, 404)
+
+    def test_profile_changes_with_messages(self):
+        """Posting a message should change the author's profile ETag"""
+
+        with self.client as c:
+            self.login(c)
+
+            etag = c.get("/users/1").headers["ETag"]
+            self.assertEqual(self.revalidate(c, "/users/1", etag).status_code, 304)
+
+            c.post("/messages/new", data={"text": "news"})
+
+            resp = self.revalidate(c, "/users/1", etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("news", resp.get_data(as_text=True))
+            self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_follow_changes_both_profiles(self):
+        """Following someone changes the follow button and their counts"""
+
+        with self.client as c:
+            self.login(c)
+
+            etag = c.get("/users/2").headers["ETag"]
+
+            c.post("/users/follow/2")
+
+            resp = self.revalidate(c, "/users/2", etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Unfollow", resp.get_data(as_text=True))
+
+    def test_viewer_in_etag(self):
+        """Different viewers shouldn't share an ETag"""
+
+        with self.client as c:
+            anon_etag = c.get("/users/2").headers["ETag"]
+
+            self.login(c)
+            self.assertEqual(self.revalidate(c, "/users/2", anon_etag).status_code,
+                             200)
+
+    def test_static_cached(self):
+        """Static files should be cacheable for a long time"""
+
+        with self.client as c:
+            resp = c.get("/static/images/default-pic.png")
+
+            self.assertIn("max-age=604800", resp.headers["Cache-Control"])
+            resp.close()
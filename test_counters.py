@@ -0,0 +1,156 @@
+"""Profile counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CountersTestCase(TestCase):
+    """Test the denormalized profile counters."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        with app.app_context():
+            db.create_all()
+            Likes.query.delete()
+            Follows.query.delete()
+            Message.query.delete()
+            User.query.delete()
+
+            self.client = app.test_client()
+
+            testuser = User.signup(username="testuser",
+                                   email="test@test.com",
+                                   password="testuser",
+                                   image_url=None)
+
+            testauthor = User.signup(username="testauthor",
+                                     email="author@test.com",
+                                     password="testuser",
+                                     image_url=None)
+            db.session.commit()
+
+            self.testuser_id = testuser.id
+            self.testauthor_id = testauthor.id
+
+    def tearDown(self):
+        """Rolling back database, dropping all tables"""
+
+        with app.app_context():
+            db.drop_all()
+            db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def counts(self, user_id):
+        with app.app_context():
+            user = db.session.get(User, user_id)
+            return (user.messages_count, user.following_count,
+                    user.followers_count, user.likes_count)
+
+    def test_follow_counts(self):
+        """Following and unfollowing should update both users"""
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f"/users/follow/{self.testauthor_id}")
+
+            self.assertEqual(self.counts(self.testuser_id), (0, 1, 0, 0))
+            self.assertEqual(self.counts(self.testauthor_id), (0, 0, 1, 0))
+
+            c.post(f"/users/stop-following/{self.testauthor_id}")
+
+            self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.testauthor_id), (0, 0, 0, 0))
+
+    def test_message_and_like_counts(self):
+        """Messages and likes should be counted and uncounted"""
+
+        with self.client as c:
+            self.login(c, self.testauthor_id)
+            c.post("/messages/new", data={"text": "count me"})
+
+            with app.app_context():
+                msg_id = Message.query.one().id
+
+            self.login(c, self.testuser_id)
+            c.post(f"/users/add_like/{msg_id}")
+
+            self.assertEqual(self.counts(self.testauthor_id), (1, 0, 0, 0))
+            self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 1))
+
+            self.login(c, self.testauthor_id)
+            c.post(f"/messages/{msg_id}/delete")
+
+            self.assertEqual(self.counts(self.testauthor_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 0))
+
+    def test_delete_user_counts(self):
+        """Deleting a user should uncount them for everyone they touched"""
+
+        with self.client as c:
+            self.login(c, self.testauthor_id)
+            c.post("/messages/new", data={"text": "count me"})
+            c.post(f"/users/follow/{self.testuser_id}")
+
+            with app.app_context():
+                msg_id = Message.query.one().id
+
+            self.login(c, self.testuser_id)
+            c.post(f"/users/add_like/{msg_id}")
+            c.post(f"/users/follow/{self.testauthor_id}")
+
+            self.login(c, self.testauthor_id)
+            c.post("/users/delete")
+
+        self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 0))
+
+    def test_reconcile(self):
+        """Reconciling should recompute counts from the base tables"""
+
+        with app.app_context():
+            testuser = db.session.get(User, self.testuser_id)
+            testauthor = db.session.get(User, self.testauthor_id)
+            testuser.following.append(testauthor)
+            testauthor.messages.append(Message(text="uncounted"))
+            db.session.commit()
+
+            counters.reconcile()
+            db.session.commit()
+
+        self.assertEqual(self.counts(self.testuser_id), (0, 1, 0, 0))
+        self.assertEqual(self.counts(self.testauthor_id), (1, 0, 1, 0))
@@ -0,0 +1,116 @@
+"""Current user snapshot tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_current_user.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import current_user
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CurrentUserTestCase(TestCase):
+    """Test the cached current-user snapshot."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        with app.app_context():
+            db.create_all()
+            Follows.query.delete()
+            Message.query.delete()
+            User.query.delete()
+
+            self.client = app.test_client()
+
+            testuser = User.signup(username="testuser",
+                                   email="test@test.com",
+                                   password="testuser",
+                                   image_url=None)
+            db.session.commit()
+
+            self.testuser_id = testuser.id
+            current_user.forget(testuser.id)
+
+    def tearDown(self):
+        """Rolling back database, dropping all tables"""
+
+        with app.app_context():
+            db.drop_all()
+            db.session.rollback()
+
+    def test_snapshot_has_no_password(self):
+        """The snapshot should only carry display columns"""
+
+        with app.app_context():
+            user = current_user.load(self.testuser_id)
+
+            self.assertEqual(user.username, "testuser")
+            self.assertEqual(user.messages_count, 0)
+            self.assertFalse(hasattr(user, "password"))
+            self.assertEqual(user.row.username, "testuser")
+
+    def test_snapshot_is_cached(self):
+        """A second load should not see changes until the user is forgotten"""
+
+        with app.app_context():
+            current_user.load(self.testuser_id)
+
+            db.session.get(User, self.testuser_id).username = "renamed"
+            db.session.commit()
+
+            self.assertEqual(
+                current_user.load(self.testuser_id).username, "testuser")
+
+            current_user.forget(self.testuser_id)
+
+            self.assertEqual(
+                current_user.load(self.testuser_id).username, "renamed")
+
+    def test_missing_user(self):
+        """A session for a user that's gone should act logged out"""
+
+        with app.app_context():
+            self.assertIsNone(current_user.load(self.testuser_id + 100))
+
+    def test_profile_edit_forgets_snapshot(self):
+        """Editing the profile should show up on the very next page"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get("/")
+            c.post("/users/profile", data={"username": "newname",
+                                           "email": "test@test.com",
+                                           "password": "testuser"})
+            resp = c.get("/")
+
+            self.assertIn('alt="newname"', resp.get_data(as_text=True))
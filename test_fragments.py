@@ -0,0 +1,209 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, Follows, Likes, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import current_user
+import fragments
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class BackendTestCase(TestCase):
+    """Test the cache backends on their own."""
+
+    def test_memory_lru(self):
+        """The least recently used entry should be evicted first"""
+
+        cache = fragments.MemoryBackend(size=2)
+        cache.set("a", 1, "A")
+        cache.set("b", 1, "B")
+        cache.get("a")
+        cache.set("c", 1, "C")
+
+        self.assertEqual(cache.get("a"), (1, "A"))
+        self.assertIsNone(cache.get("b"))
+
+        cache.delete("a")
+        self.assertIsNone(cache.get("a"))
+
+    def test_sqlite_shared(self):
+        """Two caches on the same file should see each other's entries"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fragments.db")
+            first = fragments.SQLiteBackend(path, size=2)
+            second = fragments.SQLiteBackend(path, size=2)
+
+            first.set("a", 3, "A")
+            self.assertEqual(second.get("a"), (3, "A"))
+
+            second.delete("a")
+            self.assertIsNone(first.get("a"))
+
+            for key in "bcd":
+                first.set(key, 1, key)
+            first.trim()
+            self.assertIsNone(first.get("b"))
+            self.assertEqual(first.get("d"), (1, "d"))
+
+
+class FragmentPagesTestCase(TestCase):
+    """Test pages built from cached cards."""
+
+    def setUp(self):
+        """One user following and liking the other's message"""
+
+        app.config['FRAGMENT_CACHE'] = 'memory'
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            fragments.clear()
+
+            self.client = app.test_client()
+
+            for username in ("testuser", "otheruser"):
+                User.signup(username=username,
+                            email=f"{username}@test.com",
+                            password="testuser",
+                            image_url=None)
+            db.session.flush()
+
+            db.session.add(Message(text="shared message", user_id=2))
+            db.session.flush()
+            db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+            db.session.add(Likes(user_id=1, message_id=1))
+            counters.reconcile()
+            db.session.commit()
+
+            current_user.forget(1, 2)
+
+    def tearDown(self):
+        """Dropping all tables and turning the cache back off"""
+
+        with app.app_context():
+            fragments.clear()
+            db.session.rollback()
+            db.drop_all()
+            current_user.forget(1, 2)
+
+        del app.config['FRAGMENT_CACHE']
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def cached(self, key):
+        with app.app_context():
+            return fragments.backend().get(key)
+
+    def test_card_shared_between_viewers(self):
+        """Viewers should share a card but keep their own like button"""
+
+        with self.client as c:
+            self.login(c, 2)
+            first = c.get("/users/1/likes").get_data(as_text=True)
+            self.assertIsNotNone(self.cached("message:1"))
+
+            self.login(c, 1)
+            home = c.get("/").get_data(as_text=True)
+
+            self.assertIn("shared message", first)
+            self.assertIn("shared message", home)
+            self.assertIn("btn-primary", home)
+            self.assertNotIn(fragments.SLOT, home)
+
+    def test_user_cards(self):
+        """User cards should be cached with the follow button filled in"""
+
+        with self.client as c:
+            self.login(c, 1)
+            data = c.get("/users").get_data(as_text=True)
+
+            self.assertIn('action="/users/stop-following/2"', data)
+            self.assertNotIn(fragments.SLOT, data)
+            self.assertIsNotNone(self.cached("user:2"))
+
+    def test_profile_edit_invalidates(self):
+        """Editing a profile should drop its card and re-render with the new name"""
+
+        with self.client as c:
+            self.login(c, 2)
+            c.get("/users")
+            self.assertIsNotNone(self.cached("user:2"))
+
+            c.post("/users/profile", data={"username": "renamed",
+                                            "email": "otheruser@test.com",
+                                            "password": "testuser"})
+            self.assertIsNone(self.cached("user:2"))
+
+            data = c.get("/users/2").get_data(as_text=True)
+            self.assertIn("@renamed", data)
+
+    def test_delete_message_invalidates(self):
+        """Deleting a message should drop its card"""
+
+        with self.client as c:
+            self.login(c, 2)
+            c.get("/users/2")
+            self.assertIsNotNone(self.cached("message:1"))
+
+            c.post("/messages/1/delete")
+            self.assertIsNone(self.cached("message:1"))
+
+    def test_cards_survive_likes_and_follows(self):
+        """Likes and follows change counters, not cards, so the cards stay cached"""
+
+        with self.client as c:
+            self.login(c, 1)
+            c.get("/users")
+            c.get("/users/2")
+
+            with app.app_context():
+                cache = fragments.backend()
+                for key in ("user:2", "message:1"):
+                    version, html = cache.get(key)
+                    cache.set(key, version, html + "<!-- still cached -->")
+
+            c.post("/messages/1/like")
+            c.post("/users/stop-following/2")
+            c.post("/users/follow/2")
+
+            with app.app_context():
+                self.assertGreater(db.session.get(User, 2).version, 1)
+
+            for url in ("/users", "/users/2"):
+                data = c.get(url).get_data(as_text=True)
+                self.assertIn("<!-- still cached -->", data)
+            self.assertIn("still cached", self.cached("message:1")[1])
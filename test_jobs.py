@@ -0,0 +1,265 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Follows, Job, TimelineEntry, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import current_user
+import jobs
+import timeline
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+# Calls to the test handlers below
+calls = []
+
+
+@jobs.handler('test.record')
+def record_job(value):
+    calls.append(value)
+
+
+@jobs.handler('test.flaky')
+def flaky_job(fail_times):
+    calls.append(fail_times)
+    if len(calls) <= fail_times:
+        raise RuntimeError("not yet")
+
+
+class JobsTestCase(TestCase):
+    """Test queueing and running jobs."""
+
+    def setUp(self):
+        """User 1 follows user 2; jobs are queued rather than run inline"""
+
+        app.config['JOBS_SYNC'] = False
+        calls.clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.client = app.test_client()
+
+            for username in ("testuser", "otheruser"):
+                User.signup(username=username,
+                            email=f"{username}@test.com",
+                            password="testuser",
+                            image_url=None)
+            db.session.flush()
+
+            db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+            db.session.commit()
+
+            current_user.forget(1, 2)
+
+    def tearDown(self):
+        """Dropping all tables"""
+
+        del app.config['JOBS_SYNC']
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+            current_user.forget(1, 2)
+
+    def make_due(self):
+        """Move every queued job's retry time to now"""
+
+        db.session.execute(db.update(Job).values(run_at=datetime.utcnow()))
+        db.session.commit()
+
+    def test_route_enqueues(self):
+        """Posting should queue the timeline push and leave it to a worker"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 2
+
+            c.post("/messages/new", data={"text": "queued"})
+
+        with app.app_context():
+            job = db.session.scalars(db.select(Job)).one()
+            self.assertEqual(job.name, "timeline.push_message")
+            self.assertEqual(job.status, "queued")
+            self.assertIsNone(db.session.get(TimelineEntry, (1, 1)))
+
+            self.assertEqual(jobs.run_pending(), 1)
+
+            self.assertEqual(db.session.get(Job, job.id).status, "done")
+            self.assertIsNotNone(db.session.get(TimelineEntry, (1, 1)))
+
+    def test_push_after_rebuild(self):
+        """A push that races a rebuild, or is retried, shouldn't duplicate rows"""
+
+        with app.app_context():
+            User.signup(username="thirduser", email="thirduser@test.com",
+                        password="testuser", image_url=None)
+            db.session.flush()
+            db.session.add(Follows(user_being_followed_id=2, user_following_id=3))
+            db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 2
+
+            c.post("/messages/new", data={"text": "raced"})
+
+        with app.app_context():
+            # User 1's first homepage view builds their timeline first
+            timeline.warm(1)
+
+            self.assertEqual(jobs.run_pending(), 1)
+            self.assertEqual(jobs.counts(), {"done": 1})
+
+            timeline.push_message_job(message_id=1)
+            db.session.commit()
+
+            rows = db.session.execute(
+                db.select(TimelineEntry.user_id, db.func.count())
+                .where(TimelineEntry.message_id == 1)
+                .group_by(TimelineEntry.user_id)).all()
+            self.assertEqual(sorted(rows), [(1, 1), (3, 1)])
+
+    def test_delete_user(self):
+        """Deleting a user should leave their timeline cleanup to the cascade"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 2
+
+            for text in ("one", "two", "three"):
+                c.post("/messages/new", data={"text": text})
+            c.post("/users/delete")
+
+        with app.app_context():
+            self.assertEqual(set(db.session.scalars(db.select(Job.name))),
+                             {"timeline.push_message"})
+
+            jobs.run_pending()
+            self.assertEqual(jobs.counts(), {"done": 3})
+            self.assertEqual(db.session.scalars(
+                db.select(TimelineEntry).where(TimelineEntry.user_id == 1)).all(), [])
+
+    def test_idempotency_key(self):
+        """Jobs with the same key should only be queued once"""
+
+        with app.app_context():
+            self.assertTrue(jobs.enqueue('test.record', value=1, key="once"))
+            db.session.commit()
+            self.assertFalse(jobs.enqueue('test.record', value=2, key="once"))
+            jobs.enqueue('test.record', value=3)
+            db.session.commit()
+
+            jobs.run_pending()
+
+        self.assertEqual(calls, [1, 3])
+
+    def test_retry_with_backoff(self):
+        """A failing job should be retried later, then succeed"""
+
+        with app.app_context():
+            jobs.enqueue('test.flaky', fail_times=1)
+            db.session.commit()
+
+            jobs.run_pending()
+
+            job = db.session.scalars(db.select(Job)).one()
+            self.assertEqual(job.status, "queued")
+            self.assertEqual(job.attempts, 1)
+            self.assertEqual(job.last_error, "RuntimeError: not yet")
+            self.assertGreater(job.run_at, datetime.utcnow())
+
+            # Not due yet
+            self.assertEqual(jobs.run_pending(), 0)
+
+            self.make_due()
+            jobs.run_pending()
+
+            job = db.session.scalars(db.select(Job)).one()
+            self.assertEqual(job.status, "done")
+            self.assertEqual(job.attempts, 2)
+
+    def test_gives_up(self):
+        """A job that keeps failing should end up failed"""
+
+        with app.app_context():
+            jobs.enqueue('test.flaky', fail_times=jobs.MAX_ATTEMPTS)
+            db.session.commit()
+
+            for _ in range(jobs.MAX_ATTEMPTS):
+                self.make_due()
+                jobs.run_pending()
+
+            job = db.session.scalars(db.select(Job)).one()
+            self.assertEqual(job.status, "failed")
+            self.assertEqual(len(calls), jobs.MAX_ATTEMPTS)
+
+    def test_reclaims_abandoned(self):
+        """A job whose worker went away should be run again"""
+
+        with app.app_context():
+            db.session.add(Job(name='test.record', args={'value': 1},
+                               status='running', attempts=1,
+                               locked_at=datetime.utcnow() - timedelta(days=1)))
+            db.session.commit()
+
+            self.assertEqual(jobs.run_pending(), 1)
+
+        self.assertEqual(calls, [1])
+
+    def test_workers(self):
+        """A pool of workers should run every job once"""
+
+        with app.app_context():
+            for value in range(20):
+                jobs.enqueue('test.record', value=value)
+            db.session.commit()
+
+        jobs.work(app, workers=3, stop_when_idle=True)
+
+        self.assertEqual(sorted(calls), list(range(20)))
+
+        with app.app_context():
+            self.assertEqual(jobs.counts(), {"done": 20})
+            self.assertEqual(jobs.purge(days=0), 20)
+
+    def test_sync(self):
+        """In sync mode jobs should run right away"""
+
+        app.config['JOBS_SYNC'] = True
+
+        with app.app_context():
+            jobs.enqueue('test.record', value=1)
+            self.assertEqual(calls, [1])
+
+            with self.assertRaises(jobs.UnknownJob):
+                jobs.enqueue('test.missing')
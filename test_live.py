@@ -0,0 +1,266 @@
+"""Live timeline update tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_live.py
+
+
+import os
+import subprocess
+import sys
+import textwrap
+from unittest import TestCase, mock
+
+from models import db, Follows, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import current_user
+import live
+import pools
+import timeline
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+# Parks 1000 streams under gevent, then wakes them with one message
+GREENLET_STREAMS = textwrap.dedent("""
+    from gevent import monkey
+    monkey.patch_all()
+
+    import gevent
+    import live
+
+    hub = live.Hub()
+    bodies = [live.stream(hub.subscribe(1), [], heartbeat=30)
+              for _ in range(1000)]
+    for body in bodies:
+        next(body)
+
+    waiting = [gevent.spawn(next, body) for body in bodies]
+    gevent.sleep(0.1)
+    assert not any(greenlet.ready() for greenlet in waiting)
+
+    hub.deliver([1], 7)
+    gevent.joinall(waiting, timeout=5)
+
+    print(sum(greenlet.value == live.event(7) for greenlet in waiting),
+          monkey.get_original('threading', 'active_count')())
+""")
+
+
+class HubTestCase(TestCase):
+    """Test the hub on its own."""
+
+    def test_deliver(self):
+        """Messages should only reach the named users' streams"""
+
+        hub = live.Hub()
+        first = hub.subscribe(1)
+        second = hub.subscribe(1)
+        other = hub.subscribe(2)
+
+        hub.deliver([1, 3], 10)
+
+        self.assertEqual(first.next(timeout=0), 10)
+        self.assertEqual(second.next(timeout=0), 10)
+        self.assertIsNone(other.next(timeout=0))
+
+        hub.unsubscribe(first)
+        hub.unsubscribe(second)
+        self.assertEqual(hub.connected_user_ids(), [2])
+
+    def test_overflow(self):
+        """A stream that falls too far behind should be told to resync"""
+
+        subscriber = live.Subscriber(1)
+
+        for message_id in range(live.QUEUE_SIZE + 2):
+            subscriber.deliver(message_id)
+
+        self.assertIs(subscriber.next(timeout=0), live.RESYNC)
+        self.assertEqual(subscriber.next(timeout=0), live.QUEUE_SIZE + 1)
+        self.assertIsNone(subscriber.next(timeout=0))
+
+
+class LiveViewsTestCase(TestCase):
+    """Test the stream and the polling endpoint."""
+
+    def setUp(self):
+        """User 1 follows user 2, who has one message"""
+
+        app.config['LIVE_HEARTBEAT_SECONDS'] = 0.01
+        app.config['LIVE_MAX_STREAMS'] = 1
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.client = app.test_client()
+
+            for username in ("testuser", "otheruser"):
+                User.signup(username=username,
+                            email=f"{username}@test.com",
+                            password="testuser",
+                            image_url=None)
+            db.session.flush()
+
+            db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+            db.session.add(Message(text="first", user_id=2))
+            counters.reconcile()
+            timeline.rebuild(1)
+            db.session.commit()
+
+            current_user.forget(1, 2)
+
+    def tearDown(self):
+        """Dropping all tables"""
+
+        del app.config['LIVE_HEARTBEAT_SECONDS']
+        del app.config['LIVE_MAX_STREAMS']
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+            current_user.forget(1, 2)
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def post_message(self, text):
+        """Post `text` as user 2, from a separate client"""
+
+        with app.test_client() as c:
+            self.login(c, 2)
+            c.post("/messages/new", data={"text": text})
+
+    def test_stream(self):
+        """A follower's open stream should hear about new messages"""
+
+        with self.client as c:
+            self.login(c, 1)
+            resp = c.get("/timeline/stream", buffered=False)
+
+            self.assertEqual(resp.mimetype, "text/event-stream")
+            self.assertEqual(live.hub.connected_user_ids(), [1])
+
+            body = (chunk.decode() for chunk in resp.response)
+            self.assertTrue(next(body).startswith("retry: "))
+
+            self.post_message("second")
+            self.assertEqual(next(body), "id: 2\nevent: warble\ndata: 2\n\n")
+            self.assertEqual(next(body), ": keep-alive\n\n")
+
+            resp.close()
+            self.assertEqual(live.hub.connected_user_ids(), [])
+
+    def test_stream_catches_up(self):
+        """Reconnecting with Last-Event-ID should replay what was missed"""
+
+        self.post_message("second")
+        self.post_message("third")
+
+        with self.client as c:
+            self.login(c, 1)
+            resp = c.get("/timeline/stream", buffered=False,
+                         headers={"Last-Event-ID": "1"})
+
+            body = (chunk.decode() for chunk in resp.response)
+            next(body)
+
+            self.assertEqual(next(body), live.event(2))
+            self.assertEqual(next(body), live.event(3))
+
+            resp.close()
+
+    def test_stream_limit(self):
+        """Streams past LIVE_MAX_STREAMS, or with it at 0, should get a 204"""
+
+        with self.client as c:
+            self.login(c, 1)
+            resp = c.get("/timeline/stream", buffered=False)
+            self.assertEqual(resp.status_code, 200)
+
+            with app.test_client() as other:
+                self.login(other, 2)
+                self.assertEqual(other.get("/timeline/stream").status_code, 204)
+
+            resp.close()
+            self.assertEqual(live.hub.count, 0)
+
+            app.config['LIVE_MAX_STREAMS'] = 0
+            self.assertEqual(c.get("/timeline/stream").status_code, 204)
+            self.assertIn('data-stream="0"', c.get("/").get_data(as_text=True))
+
+    def test_streaming_default(self):
+        """Streaming should be on by default only when serving on greenlets"""
+
+        with mock.patch.dict(app.config), app.app_context():
+            del app.config['LIVE_MAX_STREAMS']
+
+            self.assertEqual(live.max_streams(), live.MAX_STREAMS)
+
+            with mock.patch.object(pools, 'greenlets', return_value=True):
+                self.assertEqual(live.max_streams(), live.GREENLET_MAX_STREAMS)
+
+    def test_idle_streams_on_one_thread(self):
+        """Under gevent, a thousand idle streams should share one thread"""
+
+        here = os.path.dirname(os.path.abspath(__file__))
+        out = subprocess.run([sys.executable, '-c', GREENLET_STREAMS],
+                             cwd=here, capture_output=True, text=True,
+                             check=True).stdout
+
+        self.assertEqual(out.split(), ["1000", "1"])
+
+    def test_stream_needs_login(self):
+        """Logged out users shouldn't be able to open a stream"""
+
+        with self.client as c:
+            self.assertEqual(c.get("/timeline/stream").status_code, 401)
+
+    def test_new_count(self):
+        """The polling endpoint should count messages newer than `after`"""
+
+        self.post_message("second")
+        self.post_message("third")
+
+        with self.client as c:
+            self.login(c, 1)
+
+            self.assertEqual(c.get("/timeline/new?after=1").get_json()["count"], 2)
+            self.assertEqual(c.get("/timeline/new?after=3").get_json()["count"], 0)
+            self.assertEqual(c.get("/timeline/new").status_code, 400)
+            self.assertEqual(c.get("/timeline/new?after=x").status_code, 400)
+
+    def test_home_has_newest(self):
+        """The home page should tell the client where its timeline starts"""
+
+        with self.client as c:
+            self.login(c, 1)
+            data = c.get("/").get_data(as_text=True)
+
+            self.assertIn('data-newest="1"', data)
+            self.assertIn('data-stream="1"', data)
+            self.assertIn("/static/js/live.js", data)
@@ -0,0 +1,122 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import loader
+import migrations
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+CSVS = {
+    'users.csv': (
+        "email,username,image_url,password,bio,header_image_url,location\n"
+        "a@test.com,alice,/a.png,x,Hi,/h.png,Here\n"
+        "b@test.com,bob,/b.png,x,\"Hi, again\",/h.png,There\n"),
+    'messages.csv': (
+        "text,timestamp,user_id\n"
+        "first,2017-01-21 11:04:53.522807,1\n"
+        "second,2017-01-22 11:04:53.522807,1\n"),
+    'follows.csv': (
+        "user_being_followed_id,user_following_id\n"
+        "1,2\n"),
+    'likes.csv': (
+        "user_id,message_id\n"
+        "2,1\n"),
+}
+
+
+class LoaderTestCase(TestCase):
+    """Test loading the generator CSVs."""
+
+    def setUp(self):
+        """Writing a tiny data set to a scratch directory"""
+
+        self.dir = tempfile.TemporaryDirectory()
+        for name, contents in CSVS.items():
+            with open(os.path.join(self.dir.name, name), 'w') as csv_file:
+                csv_file.write(contents)
+
+    def tearDown(self):
+        """Dropping the loaded tables"""
+
+        self.dir.cleanup()
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+            migrations.schema_migrations.drop(db.engine, checkfirst=True)
+
+    def test_load(self):
+        """Every table should be loaded, with counters, indexes and migrations"""
+
+        with app.app_context():
+            lines = []
+            results = loader.load(self.dir.name, report=lines.append)
+
+            self.assertEqual({loaded.table: loaded.rows for loaded in results},
+                             {'users': 2, 'messages': 2, 'follows': 1, 'likes': 1})
+            self.assertTrue(lines[-1].startswith("total: 6 rows"))
+
+            self.assertEqual(User.query.count(), 2)
+            self.assertEqual(Message.query.count(), 2)
+            self.assertEqual(Follows.query.count(), 1)
+            self.assertEqual(Likes.query.count(), 1)
+
+            alice = db.session.get(User, 1)
+            bob = db.session.get(User, 2)
+            self.assertEqual(bob.bio, "Hi, again")
+            self.assertEqual((alice.messages_count, alice.followers_count),
+                             (2, 1))
+            self.assertEqual((bob.following_count, bob.likes_count), (1, 1))
+
+            indexes = inspect(db.engine).get_indexes('messages')
+            self.assertIn('ix_messages_user_id_timestamp',
+                          [index['name'] for index in indexes])
+
+            self.assertEqual(migrations.current_version(),
+                             migrations.MIGRATIONS[-1].version)
+
+    def test_missing_csv(self):
+        """A table without a CSV should just be left empty"""
+
+        os.remove(os.path.join(self.dir.name, 'likes.csv'))
+
+        with app.app_context():
+            results = loader.load(self.dir.name, report=lambda line: None)
+
+            self.assertNotIn('likes', [loaded.table for loaded in results])
+            self.assertEqual(Likes.query.count(), 0)
+            self.assertEqual(db.session.get(User, 2).likes_count, 0)
@@ -0,0 +1,205 @@
+"""Uploaded image tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_media.py
+
+
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from models import db, Follows, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import media
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def png(width=640, height=480, color=(200, 30, 30)):
+    """A PNG file's bytes."""
+
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(out, 'PNG')
+    return out.getvalue()
+
+
+class MediaTestCase(TestCase):
+    """Test storing and serving uploaded images."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        app.config['MEDIA_FOLDER'] = self.folder
+
+        with app.app_context():
+            db.create_all()
+            Follows.query.delete()
+            Message.query.delete()
+            User.query.delete()
+
+            user = User.signup("testuser", "test@test.com", "password", None)
+            db.session.commit()
+            self.user_id = user.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config.pop('MEDIA_FOLDER')
+        shutil.rmtree(self.folder)
+
+        with app.app_context():
+            db.drop_all()
+            db.session.rollback()
+
+    def save(self, data):
+        with app.app_context():
+            return media.save(FileStorage(io.BytesIO(data), "upload.png"))
+
+    def test_save_variants(self):
+        """An upload should be stored as every variant in every format"""
+
+        name = self.save(png())
+
+        for variant, size in media.VARIANTS.items():
+            for mimetype in media.FORMATS:
+                path = media.variant_path(self.folder, name, variant, mimetype)
+                with Image.open(path) as image:
+                    self.assertEqual(image.size, size)
+                    self.assertEqual(Image.MIME[image.format], mimetype)
+
+    def test_save_same_image(self):
+        """The same bytes should be stored once, under the same name"""
+
+        name = self.save(png())
+        path = media.variant_path(self.folder, name, 'card', 'image/jpeg')
+        stored_at = os.stat(path).st_mtime_ns
+
+        self.assertEqual(self.save(png()), name)
+        self.assertEqual(os.stat(path).st_mtime_ns, stored_at)
+        self.assertNotEqual(self.save(png(color=(0, 0, 255))), name)
+
+    def test_save_invalid(self):
+        """Non-images and empty files should be refused"""
+
+        with self.assertRaises(media.InvalidImage):
+            self.save(b"not an image at all")
+        with self.assertRaises(media.InvalidImage):
+            self.save(b"")
+
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_image_filter(self):
+        """Uploaded image URLs should switch variant; others stay the same"""
+
+        url = f"/media/{'a' * 64}/card"
+
+        self.assertEqual(media.image_variant(url, 'timeline'),
+                         f"/media/{'a' * 64}/timeline")
+        self.assertEqual(media.image_variant("https://example.com/me.jpg",
+                                             'timeline'),
+                         "https://example.com/me.jpg")
+        self.assertEqual(media.image_variant(None, 'card'), None)
+
+    def test_serve(self):
+        """WebP should go to browsers that take it, JPEG to the rest"""
+
+        url = f"/media/{self.save(png())}/timeline"
+
+        resp = self.client.get(url, headers={"Accept": "image/webp,image/*,*/*;q=0.8"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "image/webp")
+        self.assertEqual(resp.headers["Cache-Control"], media.IMMUTABLE)
+        self.assertIn("Accept", resp.headers["Vary"])
+        resp.close()
+
+        resp = self.client.get(url, headers={"Accept": "image/*,*/*;q=0.8"})
+        self.assertEqual(resp.mimetype, "image/jpeg")
+        resp.close()
+
+        self.assertEqual(self.client.get(f"/media/{'a' * 64}/card").status_code, 404)
+        self.assertEqual(self.client.get(f"/media/{'a' * 64}/huge").status_code, 404)
+        self.assertEqual(self.client.get("/media/..%2F..%2Fapp.py/card").status_code, 404)
+
+    def test_signup_upload(self):
+        """Signing up with an uploaded image should use its card variant"""
+
+        resp = self.client.post("/signup", data={
+            "username": "uploader",
+            "email": "uploader@test.com",
+            "password": "password",
+            "image_file": (io.BytesIO(png()), "me.png"),
+        }, content_type="multipart/form-data")
+
+        self.assertEqual(resp.status_code, 302)
+
+        with app.app_context():
+            user = User.query.filter_by(username="uploader").one()
+            self.assertRegex(user.image_url, r"^/media/[0-9a-f]{64}/card$")
+
+        resp = self.client.get(f"/users/{user.id}")
+        self.assertIn(user.image_url, resp.get_data(as_text=True))
+
+    def test_profile_upload(self):
+        """An uploaded header image should show on the user's card"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+        resp = self.client.post("/users/profile", data={
+            "username": "testuser",
+            "email": "test@test.com",
+            "password": "password",
+            "header_image_file": (io.BytesIO(png(2400, 800)), "header.png"),
+        }, content_type="multipart/form-data")
+
+        self.assertEqual(resp.status_code, 302)
+
+        with app.app_context():
+            user = db.session.get(User, self.user_id)
+            self.assertRegex(user.header_image_url, r"^/media/[0-9a-f]{64}/hero$")
+            self.assertEqual(user.image_url, User.image_url.default.arg)
+
+    def test_profile_bad_upload(self):
+        """A file that isn't an image should be refused without saving"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+        resp = self.client.post("/users/profile", data={
+            "username": "renamed",
+            "email": "test@test.com",
+            "password": "password",
+            "image_file": (io.BytesIO(b"MZ not a picture"), "me.png"),
+        }, content_type="multipart/form-data")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("isn&#39;t an image", resp.get_data(as_text=True))
+
+        with app.app_context():
+            self.assertEqual(db.session.get(User, self.user_id).username, "testuser")
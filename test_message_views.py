@@ -199,7 +199,40 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("Access unauthorized.", data)
 
+    def test_two_users_like_message(self):
+        """More than one user should be able to like the same message"""
 
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post("/messages/new", data={"text": "Likeable"})
+
+            with app.app_context():
+                msg_id = Message.query.one().id
+
+            c.post(f"/users/add_like/{msg_id}")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 3
 
+            resp = c.post(f"/messages/{msg_id}/like")
 
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json,
+                             {"message_id": msg_id, "liked": True, "likes": 2})
+
+            resp = c.post(f"/messages/{msg_id}/like")
+            self.assertEqual(resp.json,
+                             {"message_id": msg_id, "liked": False, "likes": 1})
+
+            resp = c.post("/messages/999/like")
+            self.assertEqual(resp.status_code, 404)
+
+    def test_loggedout_like_json(self):
+        """The JSON like toggle should refuse anonymous users"""
+
+        with self.client as c:
+            resp = c.post("/messages/1/like")
 
+            self.assertEqual(resp.status_code, 401)
@@ -0,0 +1,166 @@
+"""Metrics and tracing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, Follows, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import current_user
+import metrics
+import timeline
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HistogramTestCase(TestCase):
+    """Test the Prometheus text output."""
+
+    def test_render(self):
+        """Buckets should be cumulative and labels escaped"""
+
+        histogram = metrics.Histogram('test_seconds', "Test.", ('route',),
+                                      buckets=(0.1, 1.0))
+        histogram.observe(0.05, route='a"b')
+        histogram.observe(0.5, route='a"b')
+
+        self.assertEqual(list(histogram.render()), [
+            '# HELP test_seconds Test.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{route="a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{route="a\\"b",le="1.0"} 2',
+            'test_seconds_bucket{route="a\\"b",le="+Inf"} 2',
+            'test_seconds_sum{route="a\\"b"} 0.55',
+            'test_seconds_count{route="a\\"b"} 2',
+        ])
+
+
+class MetricsViewsTestCase(TestCase):
+    """Test what requests record."""
+
+    def setUp(self):
+        """User 1 follows user 2, who has a message"""
+
+        metrics.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.sample_file = os.path.join(self.tmp.name, "rate")
+        app.config['TRACE_SAMPLE_FILE'] = self.sample_file
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.client = app.test_client()
+
+            for username in ("testuser", "otheruser"):
+                User.signup(username=username,
+                            email=f"{username}@test.com",
+                            password="testuser",
+                            image_url=None)
+            db.session.flush()
+
+            db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+            db.session.add(Message(text="hello", user_id=2))
+            timeline.rebuild(1)
+            db.session.commit()
+
+            current_user.forget(1, 2)
+
+    def tearDown(self):
+        """Dropping all tables"""
+
+        del app.config['TRACE_SAMPLE_FILE']
+        self.tmp.cleanup()
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+            current_user.forget(1, 2)
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+    def test_request_metrics(self):
+        """/metrics should show the homepage's latency, SQL and render time"""
+
+        with self.client as c:
+            self.login(c)
+            c.get("/")
+            body = c.get("/metrics").get_data(as_text=True)
+
+        self.assertIn('warbler_request_seconds_count'
+                      '{endpoint="homepage",method="GET",status="200"} 1', body)
+        self.assertIn('warbler_request_sql_seconds_count{endpoint="homepage"} 1',
+                      body)
+        self.assertIn('warbler_request_render_seconds_count{endpoint="homepage"} 1',
+                      body)
+        self.assertIn('# TYPE warbler_db_pool_wait_seconds histogram', body)
+        self.assertIn('warbler_db_pool_checked_out ', body)
+
+    def test_bcrypt_metrics(self):
+        """Logging in should record bcrypt time"""
+
+        with self.client as c:
+            c.post("/login", data={"username": "testuser",
+                                   "password": "testuser"})
+            body = c.get("/metrics").get_data(as_text=True)
+
+        self.assertIn('warbler_bcrypt_seconds_count{operation="check"} 1', body)
+
+    def test_no_tracing_by_default(self):
+        """Without a sample rate file nothing should be traced"""
+
+        with self.assertNoLogs('warbler.trace'):
+            with self.client as c:
+                self.login(c)
+                c.get("/")
+
+    def test_tracing(self):
+        """With the rate at 1 every request should log its spans"""
+
+        with open(self.sample_file, "w") as rate_file:
+            rate_file.write("1\n")
+
+        with self.assertLogs('warbler.trace') as logs:
+            with self.client as c:
+                self.login(c)
+                c.get("/")
+
+        trace = json.loads(logs.records[-1].getMessage())
+
+        self.assertEqual(trace["endpoint"], "homepage")
+        self.assertEqual(trace["status"], 200)
+        self.assertEqual(trace["messages"], 1)
+        self.assertEqual(trace["likes"], 0)
+
+        names = {span["name"] for span in trace["spans"]}
+        self.assertEqual(names, {"sql", "render"})
+        self.assertIn("home.html", [span.get("template") for span in trace["spans"]])
@@ -0,0 +1,152 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData,
+                        String, Table, Text, inspect)
+
+from models import db, User, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import migrations
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+# The schema as it was before migrations existed
+legacy = MetaData()
+
+Table('users', legacy,
+      Column('id', Integer, primary_key=True),
+      Column('email', Text, nullable=False, unique=True),
+      Column('username', Text, nullable=False, unique=True),
+      Column('image_url', Text),
+      Column('header_image_url', Text),
+      Column('bio', Text),
+      Column('location', Text),
+      Column('password', Text, nullable=False))
+
+Table('messages', legacy,
+      Column('id', Integer, primary_key=True),
+      Column('text', String(140), nullable=False),
+      Column('timestamp', DateTime, nullable=False),
+      Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'),
+             nullable=False))
+
+Table('follows', legacy,
+      Column('user_being_followed_id', Integer,
+             ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+      Column('user_following_id', Integer,
+             ForeignKey('users.id', ondelete='cascade'), primary_key=True))
+
+Table('likes', legacy,
+      Column('id', Integer, primary_key=True),
+      Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade')),
+      Column('message_id', Integer,
+             ForeignKey('messages.id', ondelete='cascade'), unique=True))
+
+
+class MigrationsTestCase(TestCase):
+    """Test upgrading the schema in place."""
+
+    def tearDown(self):
+        """Dropping every table, migrated or not"""
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+            legacy.drop_all(db.engine)
+            migrations.schema_migrations.drop(db.engine, checkfirst=True)
+
+    def test_fresh_database(self):
+        """An empty database should be created and stamped as current"""
+
+        with app.app_context():
+            db.drop_all()
+            migrations.schema_migrations.drop(db.engine, checkfirst=True)
+
+            applied = migrations.upgrade()
+
+            self.assertEqual(len(applied), len(migrations.MIGRATIONS))
+            self.assertEqual(migrations.current_version(),
+                             migrations.MIGRATIONS[-1].version)
+            self.assertEqual(migrations.upgrade(), [])
+
+    def test_upgrade_legacy_database(self):
+        """An old database should be migrated without losing data"""
+
+        with app.app_context():
+            db.drop_all()
+            legacy.create_all(db.engine)
+
+            with db.engine.begin() as conn:
+                conn.execute(legacy.tables['users'].insert(), [
+                    dict(email="a@test.com", username="a", password="x"),
+                    dict(email="b@test.com", username="b", password="x"),
+                ])
+                conn.execute(legacy.tables['messages'].insert(), [
+                    dict(text="hello", timestamp=datetime(2020, 1, 1), user_id=1),
+                ])
+                conn.execute(legacy.tables['follows'].insert(), [
+                    dict(user_being_followed_id=1, user_following_id=2),
+                ])
+                conn.execute(legacy.tables['likes'].insert(), [
+                    dict(user_id=2, message_id=1),
+                ])
+
+            migrations.upgrade()
+
+            self.assertEqual(migrations.current_version(),
+                             migrations.MIGRATIONS[-1].version)
+
+            author = db.session.get(User, 1)
+            fan = db.session.get(User, 2)
+            self.assertEqual((author.messages_count, author.followers_count),
+                             (1, 1))
+            self.assertEqual((fan.following_count, fan.likes_count), (1, 1))
+
+            # Likes are keyed on (user_id, message_id) now, so a second user
+            # can like the same message
+            self.assertEqual(Likes.toggle(1, 1), True)
+            db.session.commit()
+            self.assertEqual(Likes.count_for(1), 2)
+
+            indexes = {index['name']
+                       for index in inspect(db.engine).get_indexes('messages')}
+            self.assertIn('ix_messages_user_id_timestamp', indexes)
+
+    def test_hot_queries_use_indexes(self):
+        """The homepage, profile and likes queries shouldn't scan tables"""
+
+        with app.app_context():
+            db.create_all()
+
+            for name, (plan, scans) in migrations.check_index_usage().items():
+                self.assertEqual(scans, [], f"{name}: {plan}")
@@ -0,0 +1,112 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import passwords
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordsTestCase(TestCase):
+    """Test hashing, checking and rehashing passwords."""
+
+    def setUp(self):
+        """Use a cheap work factor so the tests stay quick."""
+
+        self.old_rounds = app.config['BCRYPT_LOG_ROUNDS']
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+
+        with app.app_context():
+            db.create_all()
+            Follows.query.delete()
+            Message.query.delete()
+            User.query.delete()
+
+    def tearDown(self):
+        """Rolling back database, dropping all tables"""
+
+        app.config['BCRYPT_LOG_ROUNDS'] = self.old_rounds
+
+        with app.app_context():
+            db.drop_all()
+            db.session.rollback()
+
+    def test_hash_and_check(self):
+        """A hash should match its password and nothing else"""
+
+        with app.app_context():
+            pw_hash = passwords.hash_password("secret")
+
+            self.assertTrue(pw_hash.startswith("$2b$04$"))
+            self.assertTrue(passwords.check_password(pw_hash, "secret"))
+            self.assertFalse(passwords.check_password(pw_hash, "wrong"))
+            self.assertFalse(passwords.check_password("not a hash", "secret"))
+
+    def test_needs_rehash(self):
+        """Hashes from another work factor should need a rehash"""
+
+        with app.app_context():
+            self.assertFalse(passwords.needs_rehash(
+                passwords.hash_password("secret")))
+
+            app.config['BCRYPT_LOG_ROUNDS'] = 5
+            self.assertTrue(passwords.needs_rehash("$2b$04$abc"))
+
+    def test_rehash_on_login(self):
+        """Logging in should upgrade an old hash"""
+
+        with app.app_context():
+            User.signup(username="testuser",
+                        email="test@test.com",
+                        password="testuser",
+                        image_url=None)
+            db.session.commit()
+
+            app.config['BCRYPT_LOG_ROUNDS'] = 5
+
+            user = User.authenticate("testuser", "testuser")
+            db.session.commit()
+
+            self.assertTrue(user.password.startswith("$2b$05$"))
+            self.assertTrue(User.authenticate("testuser", "testuser"))
+
+    def test_stats(self):
+        """The pool should count what it's done"""
+
+        with app.app_context():
+            before = passwords.stats()['completed']
+            passwords.hash_password("secret")
+            after = passwords.stats()
+
+        self.assertEqual(after['completed'], before + 1)
+        self.assertEqual(after['queued'], 0)
+        self.assertEqual(after['running'], 0)
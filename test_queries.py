@@ -0,0 +1,142 @@
+"""SQL query budget tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_queries.py
+
+
+import os
+from unittest import TestCase
+
+from flask import render_template
+
+from models import db, Follows, Likes, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import current_user
+import queries
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryBudgetTestCase(TestCase):
+    """Test how many statements each page runs."""
+
+    def setUp(self):
+        """Create a user following three authors and liking their messages"""
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.client = app.test_client()
+
+            for i in range(4):
+                db.session.add(User(username=f"user{i}",
+                                    email=f"user{i}@test.com",
+                                    password="x"))
+            db.session.flush()
+
+            for author_id in (2, 3, 4):
+                db.session.add(Follows(user_being_followed_id=author_id,
+                                       user_following_id=1))
+                for i in range(3):
+                    db.session.add(Message(text=f"message {i} from {author_id}",
+                                           user_id=author_id))
+            db.session.flush()
+
+            for message_id in range(1, 10):
+                db.session.add(Likes(user_id=1, message_id=message_id))
+
+            counters.reconcile()
+            db.session.commit()
+
+            current_user.forget(1, 2, 3, 4)
+
+    def tearDown(self):
+        """Dropping all tables"""
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+    def test_page_budgets(self):
+        """Pages should stay within their statement budgets, with no N+1s"""
+
+        budgets = {
+            # The first homepage view also loads g.user and builds the
+            # timeline; later pages get g.user from the snapshot cache
+            "/": 8,
+            "/users": 3,
+            "/users/2": 3,
+            "/users/1/likes": 3,
+            "/users/1/following": 4,
+            "/users/1/followers": 3,
+            "/messages/1": 4,
+            # Includes building the in-process search index
+            "/messages/search?q=message": 3,
+        }
+
+        with self.client as c:
+            self.login(c)
+
+            for url, budget in budgets.items():
+                with self.subTest(url=url):
+                    with queries.assert_max_queries(budget):
+                        resp = c.get(url)
+                    self.assertEqual(resp.status_code, 200)
+
+            # Once built, the timeline is cheap
+            with queries.assert_max_queries(3):
+                c.get("/")
+
+    def test_detects_n_plus_one(self):
+        """Lazy loads in a template loop should be flagged, by template line"""
+
+        with app.test_request_context("/users/1/likes"):
+            messages = Message.query.all()
+
+            with queries.capture() as log:
+                render_template("users/likes.html",
+                                messages=messages,
+                                next_cursor=None)
+
+            repeated = log.repeated()
+            self.assertEqual(len(repeated), 1)
+
+            runs, = repeated.values()
+            self.assertEqual(len(runs), 3)
+            self.assertTrue(all(run.location.startswith("users/likes.html:")
+                                for run in runs))
+
+            db.session.expunge_all()
+
+            with self.assertRaises(AssertionError):
+                with queries.assert_max_queries(10):
+                    for message in Message.query.all():
+                        message.user.username
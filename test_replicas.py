@@ -0,0 +1,145 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# A second database standing in for a replica
+REPLICA_URL = "postgresql:///warbler-test-replica"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import current_user
+import replicas
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def add_user(conn, username):
+    conn.execute(User.__table__.insert().values(
+        id=1, username=username, email="test@test.com", password="x"))
+
+
+class ReplicaTestCase(TestCase):
+    """Test sending reads to a replica and writes to the primary.
+
+    The primary and the "replica" hold the same user under different
+    usernames, so pages show which database they read from.
+    """
+
+    def setUp(self):
+        """Create both databases and point the app at the replica"""
+
+        self.replica = create_engine(REPLICA_URL)
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            with db.engine.begin() as conn:
+                add_user(conn, "onprimary")
+
+            db.metadata.drop_all(self.replica)
+            db.metadata.create_all(self.replica)
+            with self.replica.begin() as conn:
+                add_user(conn, "onreplica")
+
+            current_user.forget(1)
+
+        replicas.configure(app, [REPLICA_URL])
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Dropping both databases' tables"""
+
+        replicas.configure(app, [])
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+            current_user.forget(1)
+
+        db.metadata.drop_all(self.replica)
+        self.replica.dispose()
+
+    def test_get_reads_replica(self):
+        """Marked GET routes should read from the replica"""
+
+        with self.client as c:
+            resp = c.get("/users/1")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("onreplica", resp.get_data(as_text=True))
+
+    def test_unmarked_route_reads_primary(self):
+        """Routes that aren't marked should read from the primary"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.get("/users/profile")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("onprimary", resp.get_data(as_text=True))
+
+    def test_read_your_writes(self):
+        """After writing, a browser should read from the primary for a while"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.post("/messages/new", data={"text": "fresh message"})
+            self.assertEqual(resp.status_code, 302)
+
+            with app.app_context():
+                self.assertEqual(Message.query.count(), 1)
+
+            resp = c.get("/users/1")
+            data = resp.get_data(as_text=True)
+            self.assertIn("onprimary", data)
+            self.assertIn("fresh message", data)
+
+            # Once the pin runs out, reads go back to the replica
+            with c.session_transaction() as sess:
+                sess[replicas.PRIMARY_UNTIL_KEY] = 0
+
+            resp = c.get("/users/1")
+            self.assertIn("onreplica", resp.get_data(as_text=True))
+
+    def test_no_replicas(self):
+        """With no replicas configured everything reads from the primary"""
+
+        replicas.configure(app, [])
+
+        with self.client as c:
+            resp = c.get("/users/1")
+
+            self.assertIn("onprimary", resp.get_data(as_text=True))
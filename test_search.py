@@ -0,0 +1,236 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import search
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserSearchTestCase(TestCase):
+    """Test searching for users."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        with app.app_context():
+            db.create_all()
+            Follows.query.delete()
+            Message.query.delete()
+            User.query.delete()
+
+            self.client = app.test_client()
+
+            # Passwords aren't used here, so skip the bcrypt cost of signup()
+            for i, username in enumerate(["abob", "bobcat", "bob", "robert",
+                                          "bob_smith", "bobby"]):
+                db.session.add(User(username=username,
+                                    email=f"{i}@test.com",
+                                    password="HASHED_PASSWORD"))
+            db.session.commit()
+
+    def tearDown(self):
+        """Rolling back database, dropping all tables"""
+
+        with app.app_context():
+            db.drop_all()
+            db.session.rollback()
+
+    def usernames(self, page):
+        return [user.username for user in page.items]
+
+    def test_ranked_search(self):
+        """Exact matches, then prefix matches, then substring matches"""
+
+        with app.app_context():
+            page = search.search_users("BOB")
+
+            self.assertEqual(self.usernames(page),
+                             ["bob", "bob_smith", "bobby", "bobcat", "abob"])
+            self.assertIsNone(page.next_cursor)
+
+    def test_wildcards_are_literal(self):
+        """A '_' in the search should only match an underscore"""
+
+        with app.app_context():
+            page = search.search_users("b_s")
+
+            self.assertEqual(self.usernames(page), ["bob_smith"])
+
+    def test_search_pages(self):
+        """Following cursors should walk every match exactly once"""
+
+        with app.app_context():
+            seen = []
+            after = None
+
+            while True:
+                page = search.search_users("bob", after=after, per_page=2)
+                seen += self.usernames(page)
+                after = page.next_cursor
+                if not after:
+                    break
+
+            self.assertEqual(seen,
+                             ["bob", "bob_smith", "bobby", "bobcat", "abob"])
+
+            page = search.search_users(per_page=4)
+            self.assertEqual(self.usernames(page),
+                             ["abob", "bob", "bob_smith", "bobby"])
+            page = search.search_users(after=page.next_cursor, per_page=4)
+            self.assertEqual(self.usernames(page), ["bobcat", "robert"])
+
+    def test_list_users_load_more(self):
+        """The load more link should keep the search"""
+
+        search.USERS_PAGE_SIZE, old_size = 2, search.USERS_PAGE_SIZE
+
+        try:
+            with self.client as c:
+                resp = c.get("/users?q=bob")
+                data = resp.get_data(as_text=True)
+        finally:
+            search.USERS_PAGE_SIZE = old_size
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@bob<", data)
+        self.assertNotIn("@bobby<", data)
+        self.assertIn("q=bob", data)
+        self.assertIn("after=", data)
+
+    def test_autocomplete(self):
+        """Autocomplete should return the best few matches as JSON"""
+
+        with self.client as c:
+            resp = c.get("/users/autocomplete?q=rob")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([user["username"] for user in resp.json["users"]],
+                             ["robert"])
+
+            resp = c.get("/users/autocomplete?q=")
+            self.assertEqual(resp.json, {"users": []})
+
+    def test_autocomplete_prefix(self):
+        """Autocomplete should only match prefixes, alphabetically"""
+
+        with self.client as c:
+            resp = c.get("/users/autocomplete?q=BO")
+            self.assertEqual([user["username"] for user in resp.json["users"]],
+                             ["bob", "bob_smith", "bobby", "bobcat"])
+
+            resp = c.get("/users/autocomplete?q=bob_")
+            self.assertEqual([user["username"] for user in resp.json["users"]],
+                             ["bob_smith"])
+
+
+class MessageSearchTestCase(TestCase):
+    """Test full-text search of messages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        with app.app_context():
+            db.create_all()
+            Follows.query.delete()
+            Message.query.delete()
+            User.query.delete()
+
+            self.client = app.test_client()
+
+            testuser = User(username="testuser",
+                            email="test@test.com",
+                            password="HASHED_PASSWORD")
+            testuser.messages.append(Message(text="Coffee first, then code"))
+            testuser.messages.append(Message(text="coffee coffee COFFEE"))
+            testuser.messages.append(Message(text="Tea is fine too"))
+            db.session.add(testuser)
+            db.session.commit()
+
+            self.testuser_id = testuser.id
+
+        # Start each test with a fresh in-process index
+        search.message_index = search.MessageIndex()
+
+    def tearDown(self):
+        """Rolling back database, dropping all tables"""
+
+        with app.app_context():
+            db.drop_all()
+            db.session.rollback()
+
+    def texts(self, q, **kwargs):
+        with app.app_context():
+            messages, has_more = search.search_messages(q, **kwargs)
+            return [msg.text for msg in messages], has_more
+
+    def test_ranked_search(self):
+        """Messages that mention the words more often come first"""
+
+        self.assertEqual(self.texts("coffee"),
+                         (["coffee coffee COFFEE", "Coffee first, then code"],
+                          False))
+        self.assertEqual(self.texts("coffee code"),
+                         (["Coffee first, then code"], False))
+        self.assertEqual(self.texts("nothing"), ([], False))
+        self.assertEqual(self.texts(""), ([], False))
+
+    def test_search_pages(self):
+        """Results should be split into numbered pages"""
+
+        self.assertEqual(self.texts("coffee", per_page=1),
+                         (["coffee coffee COFFEE"], True))
+        self.assertEqual(self.texts("coffee", page=2, per_page=1),
+                         (["Coffee first, then code"], False))
+
+    def test_index_follows_writes(self):
+        """New messages should be found and deleted ones shouldn't"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            self.assertEqual(self.texts("tea"), (["Tea is fine too"], False))
+
+            c.post("/messages/new", data={"text": "More tea please"})
+            resp = c.get("/messages/search?q=tea")
+            self.assertIn("More tea please", resp.get_data(as_text=True))
+
+            with app.app_context():
+                tea_id = Message.query.filter_by(text="Tea is fine too").one().id
+
+            c.post(f"/messages/{tea_id}/delete")
+            resp = c.get("/messages/search?q=tea")
+            data = resp.get_data(as_text=True)
+
+            self.assertIn("More tea please", data)
+            self.assertNotIn("Tea is fine too", data)
@@ -0,0 +1,236 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase, mock
+
+from sqlalchemy import event
+
+from models import db, Message, User, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+
+# Configuring app in a similar way to how it would be in production
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Disable some of Flasks error behavior and disabling debugtoolbar. Disabling CSRF token.
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test the precomputed home timeline."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        with app.app_context():
+            db.create_all()
+            TimelineEntry.query.delete()
+            Follows.query.delete()
+            Message.query.delete()
+            User.query.delete()
+
+            self.client = app.test_client()
+
+            testuser = User.signup(username="testuser",
+                                   email="test@test.com",
+                                   password="testuser",
+                                   image_url=None)
+
+            testauthor = User.signup(username="testauthor",
+                                     email="author@test.com",
+                                     password="testuser",
+                                     image_url=None)
+
+            testauthor.messages.append(Message(text="older message"))
+            db.session.commit()
+
+            self.testuser_id = testuser.id
+            self.testauthor_id = testauthor.id
+
+    def tearDown(self):
+        """Rolling back database, dropping all tables"""
+
+        with app.app_context():
+            db.drop_all()
+            db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def timeline_texts(self, user_id):
+        with app.app_context():
+            return [msg.text for msg in
+                    db.session.scalars(timeline.page_select(user_id))]
+
+    def test_follow_backfills_timeline(self):
+        """Following someone should copy their messages into our timeline"""
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f"/users/follow/{self.testauthor_id}")
+
+        self.assertEqual(self.timeline_texts(self.testuser_id),
+                         ["older message"])
+
+    def test_new_message_fans_out(self):
+        """A new message should be pushed to followers' timelines"""
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f"/users/follow/{self.testauthor_id}")
+
+            self.login(c, self.testauthor_id)
+            c.post("/messages/new", data={"text": "brand new message"})
+
+            self.login(c, self.testuser_id)
+            resp = c.get("/")
+
+        self.assertIn("brand new message", resp.get_data(as_text=True))
+        self.assertIn("brand new message",
+                      self.timeline_texts(self.testuser_id))
+
+    def test_unfollow_prunes_timeline(self):
+        """Unfollowing someone should drop their messages from our timeline"""
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f"/users/follow/{self.testauthor_id}")
+            c.post(f"/users/stop-following/{self.testauthor_id}")
+
+        with app.app_context():
+            count = TimelineEntry.query.filter_by(
+                user_id=self.testuser_id).count()
+
+        self.assertEqual(count, 0)
+
+    def test_delete_message_removes_entry(self):
+        """Deleting a message should remove it from every timeline"""
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f"/users/follow/{self.testauthor_id}")
+
+            with app.app_context():
+                msg = Message.query.first()
+
+            self.login(c, self.testauthor_id)
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(self.timeline_texts(self.testuser_id), [])
+
+    def test_cold_timeline_is_rebuilt(self):
+        """Follows made outside the routes should still show up"""
+
+        with app.app_context():
+            testuser = db.session.get(User, self.testuser_id)
+            testauthor = db.session.get(User, self.testauthor_id)
+            testuser.following.append(testauthor)
+            db.session.commit()
+
+        self.assertEqual(self.timeline_texts(self.testuser_id), [])
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.get("/")
+
+        self.assertEqual(self.timeline_texts(self.testuser_id),
+                         ["older message"])
+
+    def test_empty_timeline_built_once(self):
+        """Following only quiet users shouldn't rebuild on every view"""
+
+        with app.app_context():
+            quiet = User.signup(username="quietuser",
+                                email="quiet@test.com",
+                                password="testuser",
+                                image_url=None)
+            testuser = db.session.get(User, self.testuser_id)
+            testuser.following.append(quiet)
+            db.session.commit()
+
+        writes = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.split(None, 1)[0].upper() in ("INSERT", "UPDATE", "DELETE"):
+                writes.append(statement)
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.get("/")
+
+            with app.app_context():
+                event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                resp = c.get("/")
+            finally:
+                with app.app_context():
+                    event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(writes, [])
+
+    def test_trim_keeps_ties(self):
+        """Trimming should keep exactly TIMELINE_LENGTH entries, even on ties"""
+
+        same_time = datetime(2024, 1, 1)
+
+        with app.app_context():
+            author = db.session.get(User, self.testauthor_id)
+            for i in range(5):
+                author.messages.append(Message(text=f"tied {i}",
+                                               timestamp=same_time))
+            db.session.flush()
+
+            db.session.add_all(TimelineEntry(user_id=self.testuser_id,
+                                             message_id=msg.id,
+                                             timestamp=same_time)
+                               for msg in author.messages
+                               if msg.timestamp == same_time)
+
+            with mock.patch.object(timeline, 'TIMELINE_LENGTH', 3):
+                timeline.trim(self.testuser_id)
+            db.session.commit()
+
+        self.assertEqual(self.timeline_texts(self.testuser_id),
+                         ["tied 4", "tied 3", "tied 2"])
+
+    def test_push_trims(self):
+        """Pushes should keep followers' timelines from growing without bound"""
+
+        with app.app_context():
+            db.session.add(Follows(user_being_followed_id=self.testauthor_id,
+                                   user_following_id=self.testuser_id))
+
+            with mock.patch.multiple(timeline, TIMELINE_LENGTH=2, TRIM_EVERY=1):
+                for i in range(4):
+                    msg = Message(text=f"new {i}", user_id=self.testauthor_id)
+                    db.session.add(msg)
+                    db.session.flush()
+                    timeline.push_message(msg)
+            db.session.commit()
+
+        self.assertEqual(len(self.timeline_texts(self.testuser_id)), 2)
@@ -201,6 +201,35 @@ class MessageViewTestCase(TestCase):
 
                 self.assertEqual(testuser.is_followed_by(testfollower), False)
 
+    def test_testuser_following_among(self):
+        """
+        Does following_among() pick out only the users testuser follows?
+        """
+
+        with self.client as c:
+            with app.app_context():
+                testuser = User.query.get(1)
+
+                self.assertEqual(testuser.following_among([1, 2, 3]), {2})
+                self.assertEqual(testuser.following_among([]), set())
+
+    def test_follow_ids_loaded_once(self):
+        """
+        Do repeated is_following() checks reuse the same follow-id set?
+        """
+
+        with self.client as c:
+            with app.app_context():
+                testuser = User.query.get(1)
+                testfollowing = User.query.get(2)
+                testfollower = User.query.get(3)
+
+                ids = testuser.following_ids()
+                self.assertEqual(ids, {2})
+                self.assertIs(testuser.following_ids(), ids)
+                self.assertEqual(testuser.is_following(testfollowing), True)
+                self.assertEqual(testuser.is_following(testfollower), False)
+
     def test_user_signup(self):
         """Does user signup work?"""
 
@@ -6,9 +6,11 @@
 
 
 import os
+import re
+from datetime import datetime, timedelta
 from unittest import TestCase
 
-from models import db, Message, User
+from models import db, Follows, Message, User
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -184,6 +186,33 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("testfollower", data)
 
+    def test_list_users_follow_buttons(self):
+        """The users list should offer to unfollow people we follow"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.get("/users")
+            data = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('action="/users/stop-following/2"', data)
+            self.assertIn('action="/users/follow/3"', data)
+
+    def test_follow_twice(self):
+        """Following someone we already follow should change nothing"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.post("/users/follow/2")
+            self.assertEqual(resp.status_code, 302)
+
+        with app.app_context():
+            self.assertEqual(Follows.query.filter_by(user_following_id=1).count(), 1)
+
     def test_see_other_user(self):
         """We should be able to see other users' profiles"""
 
@@ -199,3 +228,31 @@ class MessageViewTestCase(TestCase):
             data = resp.get_data(as_text=True)
             self.assertEqual(resp.status_code, 200)
             self.assertIn("testfollower", data)
+
+    def test_profile_load_more(self):
+        """Profiles past one page should link to the next page by cursor"""
+
+        with app.app_context():
+            start = datetime(2020, 1, 1)
+            for i in range(101):
+                db.session.add(Message(text=f"paged message {i}",
+                                       timestamp=start + timedelta(minutes=i),
+                                       user_id=2))
+            db.session.commit()
+
+        with self.client as c:
+
+            resp = c.get("/users/2")
+            data = resp.get_data(as_text=True)
+            self.assertIn("paged message 100", data)
+            self.assertNotIn("paged message 0<", data)
+
+            next_url = re.search(r'href="([^"]*before=[^"]*)"', data).group(1)
+            resp = c.get(next_url.replace("&amp;", "&"))
+            data = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("paged message 1<", data)
+            self.assertIn("paged message 0<", data)
+            self.assertNotIn("paged message 2<", data)
+            self.assertNotIn("Load more", data)
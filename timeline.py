@@ -0,0 +1,232 @@
+"""Precomputed home timelines for Warbler.
+
+Rather than joining messages against follows on every homepage view, each
+user has a bounded list of message ids in the `timelines` table. It is kept
+up to date when messages are written (fan-out on write) and when follows
+change, so the homepage is a single range read.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import delete, exists, insert, literal, select, tuple_, update
+from sqlalchemy.orm import joinedload
+
+from models import db, Follows, Message, TimelineEntry, User
+import jobs
+from pagination import page_query, PAGE_SIZE
+
+# How many messages we keep in each user's timeline
+TIMELINE_LENGTH = 800
+
+# Each push trims about one in this many of the author's followers (a
+# different slice each time), so timelines stay within roughly this many
+# entries past TIMELINE_LENGTH without a query per follower per push
+TRIM_EVERY = 100
+
+
+def push_message(message):
+    """Push a new `message` into the timeline of everyone following its author.
+
+    The message must already be flushed so that it has an id and timestamp.
+    Followers who already have it (a rebuild or backfill got there first,
+    or this is a retry) are skipped.
+    """
+
+    already_there = exists().where(
+        TimelineEntry.user_id == Follows.user_following_id,
+        TimelineEntry.message_id == message.id)
+
+    followers = (select(Follows.user_following_id,
+                        literal(message.id),
+                        literal(message.timestamp))
+                 .where(Follows.user_being_followed_id == message.user_id,
+                        ~already_there))
+
+    db.session.execute(
+        insert(TimelineEntry)
+        .from_select(['user_id', 'message_id', 'timestamp'], followers))
+
+    due = db.session.scalars(
+        select(Follows.user_following_id)
+        .where(Follows.user_being_followed_id == message.user_id,
+               (Follows.user_following_id + message.id) % TRIM_EVERY == 0))
+
+    for user_id in due.all():
+        trim(user_id)
+
+
+def remove_messages(message_ids):
+    """Remove these messages from every timeline they were pushed to."""
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.message_id.in_(message_ids)))
+
+
+def backfill(user_id, followed_id):
+    """Copy `followed_id`'s recent messages into `user_id`'s timeline.
+
+    Called when `user_id` starts following `followed_id`.
+    """
+
+    already_there = exists().where(
+        TimelineEntry.user_id == user_id,
+        TimelineEntry.message_id == Message.id)
+
+    recent = (select(literal(user_id), Message.id, Message.timestamp)
+              .where(Message.user_id == followed_id, ~already_there)
+              .order_by(Message.timestamp.desc())
+              .limit(TIMELINE_LENGTH))
+
+    db.session.execute(
+        insert(TimelineEntry)
+        .from_select(['user_id', 'message_id', 'timestamp'], recent))
+
+    trim(user_id)
+
+
+def prune(user_id, followed_id):
+    """Drop `followed_id`'s messages from `user_id`'s timeline.
+
+    Called when `user_id` stops following `followed_id`.
+    """
+
+    followed_messages = select(Message.id).where(Message.user_id == followed_id)
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id,
+               TimelineEntry.message_id.in_(followed_messages)))
+
+
+def rebuild(user_id):
+    """Recompute `user_id`'s timeline from the messages and follows tables."""
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id))
+
+    recent = (select(literal(user_id), Message.id, Message.timestamp)
+              .join(Follows, Follows.user_being_followed_id == Message.user_id)
+              .where(Follows.user_following_id == user_id)
+              .order_by(Message.timestamp.desc())
+              .limit(TIMELINE_LENGTH))
+
+    db.session.execute(
+        insert(TimelineEntry)
+        .from_select(['user_id', 'message_id', 'timestamp'], recent))
+
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(timeline_built_at=datetime.utcnow()))
+
+
+def trim(user_id):
+    """Drop everything past the newest TIMELINE_LENGTH entries for `user_id`.
+
+    Entries are ordered by (timestamp, message_id), as the homepage pages
+    them, so ties at the cutoff don't take extra entries with them. Pushes
+    trim a slice of followers each (see TRIM_EVERY); the `trim-timelines`
+    command trims everyone exactly.
+    """
+
+    cutoff = db.session.execute(
+        select(TimelineEntry.timestamp, TimelineEntry.message_id)
+        .where(TimelineEntry.user_id == user_id)
+        .order_by(TimelineEntry.timestamp.desc(),
+                  TimelineEntry.message_id.desc())
+        .offset(TIMELINE_LENGTH)
+        .limit(1)).first()
+
+    if cutoff is not None:
+        db.session.execute(
+            delete(TimelineEntry)
+            .where(TimelineEntry.user_id == user_id,
+                   tuple_(TimelineEntry.timestamp, TimelineEntry.message_id)
+                   <= tuple_(*cutoff)))
+
+
+def is_cold(user_id):
+    """Does `user_id` follow people but have a timeline that was never built?
+
+    A built timeline can still be empty (everyone followed is quiet), so
+    this goes by users.timeline_built_at rather than by the entries.
+    """
+
+    never_built = select(User.id).where(User.id == user_id,
+                                        User.timeline_built_at.is_(None))
+
+    return bool(db.session.scalar(
+        select(exists(never_built)
+               & exists().where(Follows.user_following_id == user_id))))
+
+
+def warm(user_id):
+    """Build `user_id`'s timeline now if it has never been built.
+
+    Needed for users whose follows were loaded without one (e.g. seeded
+    data).
+    """
+
+    if is_cold(user_id):
+        rebuild(user_id)
+        db.session.commit()
+
+
+def page_select(user_id, before=None, per_page=PAGE_SIZE):
+    """SELECT for a page of `user_id`'s timeline messages (see pagination.py)."""
+
+    query = (select(Message)
+             .options(joinedload(Message.user, innerjoin=True))
+             .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+             .where(TimelineEntry.user_id == user_id))
+
+    return page_query(query, TimelineEntry.timestamp,
+                      TimelineEntry.message_id, before, per_page)
+
+
+def page_ids_select(user_id, before=None, per_page=PAGE_SIZE):
+    """SELECT for the message ids on the same page as `page_select()`."""
+
+    query = (select(TimelineEntry.message_id)
+             .where(TimelineEntry.user_id == user_id))
+
+    return page_query(query, TimelineEntry.timestamp,
+                      TimelineEntry.message_id, before, per_page)
+
+
+##############################################################################
+# Jobs (see jobs.py); these run after the write that queued them, so they
+# check the rows they were queued for are still there
+
+
+@jobs.handler('timeline.push_message')
+def push_message_job(message_id):
+    message = db.session.get(Message, message_id)
+
+    if message is not None:
+        push_message(message)
+
+
+@jobs.handler('timeline.remove_messages')
+def remove_messages_job(message_ids):
+    remove_messages(message_ids)
+
+
+def is_following(user_id, followed_id):
+    return db.session.scalar(select(exists().where(
+        Follows.user_following_id == user_id,
+        Follows.user_being_followed_id == followed_id)))
+
+
+@jobs.handler('timeline.backfill')
+def backfill_job(user_id, followed_id):
+    if is_following(user_id, followed_id):
+        backfill(user_id, followed_id)
+
+
+@jobs.handler('timeline.prune')
+def prune_job(user_id, followed_id):
+    if not is_following(user_id, followed_id):
+        prune(user_id, followed_id)